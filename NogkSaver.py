@@ -4,10 +4,41 @@ import subprocess
 import threading
 import os
 import re
-import json
-import shutil
+import queue
+import logging
 import webbrowser
-import time # 用於快取迴避
+import multiprocessing
+from logging.handlers import RotatingFileHandler
+
+# 產生網頁的邏輯放在 nogk_core.py (不依賴 tkinter，可供命令列與其他程式使用)
+from nogk_core import ChatGenerator, AVATAR_SIZE, GROUP_NAMES, run_colmsg_jobs, snapshot_members, changed_members, make_server
+
+# --- 執行紀錄設定 (v31.7) ---
+LOG_MAX_LINES = 2000  # 畫面上最多保留的行數，較舊的只留在紀錄檔
+LOG_FLUSH_MS = 100  # 每隔多久把累積的紀錄一次寫到畫面上
+LOG_FILE = "NogkSaver.log"  # 完整紀錄 (與 colmsg.exe 同一個資料夾)，超過 5 MB 換檔，保留 3 份
+ERROR_LOG_LIMIT = 5  # 統計中的失敗原因最多列出幾個，其餘只顯示數量
+PROGRESS_PATTERNS = (
+    re.compile(r'(\d+)\s*/\s*(\d+)'),  # 12/345
+    re.compile(r'(\d+(?:\.\d+)?)\s*%'),  # 42.5%
+)
+
+def parse_progress(line):
+    """ 從 colmsg 的輸出行找出進度，回傳 0~1 的比例，找不到時回傳 None """
+    match = PROGRESS_PATTERNS[0].search(line)
+    if match:
+        done, total = int(match.group(1)), int(match.group(2))
+        if 0 < total and done <= total: return done / total  # 排除 2024/01 之類的日期
+    match = PROGRESS_PATTERNS[1].search(line)
+    if match and float(match.group(1)) <= 100: return float(match.group(1)) / 100
+    return None
+
+def format_errors(title, errors, limit=ERROR_LOG_LIMIT):
+    """ 把統計中的失敗原因排成紀錄用的幾行文字；沒有失敗時回傳空字串 """
+    if not errors: return ""
+    lines = [f"\n  {title}: {e}" for e in errors[:limit]]
+    if len(errors) > limit: lines.append(f"\n  …另外還有 {len(errors) - limit} 個")
+    return "".join(lines)
 
 # --- Avatar 選擇視窗 (v30.0: 支援回調函數 Callback) ---
 class AvatarSelectionWindow(tk.Toplevel):
@@ -18,8 +49,9 @@ class AvatarSelectionWindow(tk.Toplevel):
         self.member_list = member_list
         self.target_dir = target_dir
         self.avatar_map = {} 
+        self.avatar_stats = None
         self.parent = parent
-        self.callback = callback # 執行完成後要呼叫的函式
+        self.callback = callback # 執行完成後要呼叫的函式 callback(avatar_map, 複製統計)
         self.attributes('-topmost', True)
 
         ttk.Label(self, text="請為成員選擇頭像圖片:", padding=15).pack(fill='x')
@@ -67,6 +99,9 @@ class AvatarSelectionWindow(tk.Toplevel):
         bottom_frame = ttk.Frame(self, padding=15)
         bottom_frame.pack(fill='x')
 
+        self.resize_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(bottom_frame, text=f"縮小頭像為 {AVATAR_SIZE}px (需安裝 Pillow，未安裝時照原檔複製)", variable=self.resize_var).pack(anchor='w', pady=(0, 10))
+
         self.progress = ttk.Progressbar(bottom_frame, orient="horizontal", mode="determinate")
         self.progress.pack(fill='x', pady=(0, 15))
         
@@ -109,32 +144,19 @@ class AvatarSelectionWindow(tk.Toplevel):
 
     def on_confirm(self):
         self.confirm_btn.config(state="disabled", text="處理中...")
-        self.progress["maximum"] = len(self.path_vars)
+        # Tk 變數只能在主執行緒讀取
+        sources = {m: var.get().strip() for m, var in self.path_vars.items()}
+        sources = {m: p for m, p in sources.items() if p and os.path.exists(p)}
+        size = AVATAR_SIZE if self.resize_var.get() else None
+        self.progress["maximum"] = max(len(sources), 1)
         self.progress["value"] = 0
-        threading.Thread(target=self.process_avatars, daemon=True).start()
-
-    def process_avatars(self):
-        avatar_dir = os.path.join(self.target_dir, "avatars")
-        if not os.path.exists(avatar_dir):
-            os.makedirs(avatar_dir)
+        threading.Thread(target=self.process_avatars, args=(sources, size), daemon=True).start()
 
-        count = 0
-        timestamp = int(time.time()) # 加入時間戳記避免快取
-        
-        for member, var in self.path_vars.items():
-            src_path = var.get().strip()
-            if src_path and os.path.exists(src_path):
-                ext = os.path.splitext(src_path)[1]
-                new_filename = f"avatar_{member}{ext}"
-                dest_path = os.path.join(avatar_dir, new_filename)
-                try:
-                    shutil.copy2(src_path, dest_path)
-                    # 這裡加入 ?t=... 讓瀏覽器認為是新圖片
-                    self.avatar_map[member] = f"avatars/{new_filename}?t={timestamp}"
-                except Exception as e:
-                    print(f"複製頭像失敗 {member}: {e}")
-            count += 1
-            self.after(0, self.update_progress, count)
+    def process_avatars(self, sources, size):
+        # 檔名依圖片內容雜湊決定：沒換的頭像不重新複製，瀏覽器也不必重新下載
+        def progress(done, total, member):
+            self.after(0, self.update_progress, done)
+        self.avatar_map, self.avatar_stats = ChatGenerator().copy_avatars(self.target_dir, sources, size, progress_callback=progress)
         self.after(500, self.finish)
 
     def update_progress(self, value):
@@ -144,317 +166,33 @@ class AvatarSelectionWindow(tk.Toplevel):
         self.destroy()
         # 執行回調函數
         if self.callback:
-            self.callback(self.avatar_map)
-
-# --- HTML 生成器邏輯 (v30.0: 新增 update_html_avatars) ---
-class ChatGenerator:
-    def generate_single_index(self, group_folder_path, nickname="", avatar_map=None):
-        # ... (保持原有的生成邏輯不變) ...
-        if avatar_map is None: avatar_map = {}
-        if not os.path.exists(group_folder_path): return False, "找不到資料夾"
-
-        all_data = {}
-        members = []
-        for entry in os.listdir(group_folder_path):
-            full_path = os.path.join(group_folder_path, entry)
-            if os.path.isdir(full_path) and len(os.listdir(full_path)) > 0:
-                if entry == "avatars": continue
-                members.append(entry)
-        members.sort()
-
-        if not members: return False, "找不到成員資料夾"
-
-        valid_exts = {'.txt', '.jpg', '.jpeg', '.png', '.mp4', '.m4a', '.mp3', '.wav'}
-        time_pattern = re.compile(r'(\d{14})')
-
-        for member in members:
-            member_path = os.path.join(group_folder_path, member)
-            member_msgs = []
-            for f in os.listdir(member_path):
-                ext = os.path.splitext(f)[1].lower()
-                if ext in valid_exts:
-                    match = time_pattern.search(f)
-                    timestamp_str = match.group(1) if match else "00000000000000"
-                    msg_obj = {'f': f, 't': ext, 'ts': timestamp_str, 'd': self._format_date(timestamp_str), 'hm': self._format_time(timestamp_str), 'c': ''}
-                    if ext == '.txt':
-                        try:
-                            with open(os.path.join(member_path, f), 'r', encoding='utf-8') as tf:
-                                raw_text = tf.read()
-                                if nickname: raw_text = raw_text.replace('%%%', nickname)
-                                msg_obj['c'] = raw_text
-                        except: msg_obj['c'] = "(Error)"
-                    member_msgs.append(msg_obj)
-            member_msgs.sort(key=lambda x: x['ts'])
-            all_data[member] = member_msgs
-
-        json_data = json.dumps(all_data, ensure_ascii=False)
-        json_avatars = json.dumps(avatar_map, ensure_ascii=False)
-
-        # 這裡縮略 HTML 內容，保持跟 v24.0 一樣的 HTML 結構，只展示關鍵部分
-        html_content = self._get_html_template(json_data, json_avatars)
-        
-        output_path = os.path.join(group_folder_path, "index.html")
-        try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            return True, output_path
-        except Exception as e:
-            return False, str(e)
-
-    def update_html_avatars(self, group_folder_path, avatar_map):
-        """ v30: 只更新現有 index.html 中的 avatarMap """
-        html_path = os.path.join(group_folder_path, "index.html")
-        if not os.path.exists(html_path):
-            return False, "找不到 index.html，請先執行「產生入口網頁」。"
-
-        try:
-            with open(html_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            # 將新的 avatar_map 轉為 JSON
-            new_json = json.dumps(avatar_map, ensure_ascii=False)
-            
-            # 使用 Regex 替換 const avatarMap = { ... };
-            # 注意：這裡假設 HTML 裡只有一個 const avatarMap = ...
-            pattern = r'const avatarMap = \{.*?\};'
-            replacement = f'const avatarMap = {new_json};'
-            
-            new_content = re.sub(pattern, replacement, content, flags=re.DOTALL)
-            
-            if new_content == content:
-                return False, "無法在 index.html 中找到 avatarMap 設定，可能檔案已損壞或版本過舊。"
-
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-                
-            return True, html_path
-        except Exception as e:
-            return False, str(e)
-
-    def _format_time(self, ts):
-        if len(ts) >= 12: return f"{ts[8:10]}:{ts[10:12]}"
-        return ""
-    def _format_date(self, ts):
-        if len(ts) >= 8: return f"{ts[0:4]}/{ts[4:6]}/{ts[6:8]}"
-        return ""
-
-    def _get_html_template(self, json_data, json_avatars):
-        # 為了縮減程式碼長度，這裡直接回傳 v24 的 HTML 字串
-        # 實務上建議把 HTML 放在單獨檔案讀取，但為了單一執行檔方便，這裡維持字串形式
-        return f"""<!DOCTYPE html>
-<html lang="zh-TW">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>Nogi MSG Viewer</title>
-<style>
-body {{ background-color: #f2f3f7; font-family: "Helvetica Neue", Arial, sans-serif; margin: 0; padding: 0; display: flex; height: 100vh; overflow: hidden; }}
-.sidebar {{ width: 220px; background-color: #fff; border-right: 1px solid #ddd; display: flex; flex-direction: column; flex-shrink: 0; }}
-.sidebar-header {{ padding: 15px; background-color: #6a0d6e; color: white; font-weight: bold; text-align: center; }}
-.sidebar-sort-info {{ background-color: #f8f0fc; padding: 5px 10px; font-size: 12px; color: #666; display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid #eee; }}
-.reset-btn {{ font-size: 10px; background: #ddd; border: none; padding: 2px 6px; cursor: pointer; border-radius: 4px; color: #333; display: none; }}
-.reset-btn:hover {{ background: #ccc; }}
-.member-list {{ overflow-y: auto; flex-grow: 1; }}
-.member-item {{ padding: 12px 20px; cursor: grab; border-bottom: 1px solid #f0f0f0; display: flex; align-items: center; gap: 10px; transition: background 0.1s; user-select: none; }}
-.member-item:hover {{ background-color: #f9f9f9; }}
-.member-item.active {{ background-color: #f3e5f5; color: #7e1083; font-weight: bold; border-left: 4px solid #7e1083; }}
-.member-item.dragging {{ opacity: 0.5; background-color: #eee; }}
-.member-avatar-icon {{ width: 32px; height: 32px; background: #ddd; border-radius: 50%; display: flex; justify-content: center; align-items: center; font-size: 12px; color: #fff; overflow: hidden; flex-shrink: 0; }}
-.member-avatar-icon img {{ width: 100%; height: 100%; object-fit: cover; transition: transform 0.2s; }}
-.member-avatar-icon.clickable {{ cursor: zoom-in; }} 
-.member-avatar-icon.clickable:hover img {{ transform: scale(1.1); }}
-.main-area {{ flex-grow: 1; display: flex; flex-direction: column; height: 100%; position: relative; }}
-.header {{ background-color: #7e1083; color: white; height: 50px; display: flex; align-items: center; justify-content: center; padding: 0 20px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); flex-shrink: 0; position: relative; }}
-.header-center-group {{ display: flex; align-items: center; gap: 10px; }}
-.header-title {{ font-size: 18px; font-weight: bold; margin-right: 5px; }}
-select {{ padding: 3px 8px; border-radius: 12px; border: none; outline: none; background: rgba(255,255,255,0.9); color: #7e1083; font-weight: bold; cursor: pointer; font-size: 13px; }}
-#scaleSelect {{ background: rgba(255,255,255,0.7); color: #333; }}
-.chat-container {{ flex-grow: 1; padding: 20px; overflow-y: auto; display: flex; flex-direction: column; gap: 10px; opacity: 0; transition: opacity 0.15s ease-out; }}
-.empty-state {{ text-align: center; color: #999; margin-top: 100px; }}
-.timestamp-separator {{ text-align: center; color: #888; font-size: 12px; margin: 15px 0; background-color: rgba(0,0,0,0.05); padding: 4px 10px; border-radius: 12px; align-self: center; }}
-.msg-row {{ display: flex; align-items: flex-start; gap: 8px; margin-bottom: 10px; }}
-.avatar {{ width: 40px; height: 40px; background-color: #ccc; border-radius: 50%; display: flex; align-items: center; justify-content: center; color: white; font-size: 16px; flex-shrink: 0; overflow: hidden; }}
-.avatar img {{ width: 100%; height: 100%; object-fit: cover; transition: opacity 0.2s; }}
-.avatar.clickable {{ cursor: zoom-in; }}
-.avatar.clickable:hover {{ opacity: 0.8; }}
-.bubble-wrapper {{ display: flex; flex-direction: column; max-width: 80%; }}
-.bubble a {{ color: #0066cc; text-decoration: underline; word-break: break-all; }}
-.bubble {{ background-color: white; padding: 10px 14px; border-radius: 18px; border-top-left-radius: 4px; box-shadow: 0 1px 2px rgba(0,0,0,0.1); word-wrap: break-word; line-height: 1.5; color: #333; font-size: 15px; white-space: pre-wrap; }}
-.media-bubble {{ background: transparent; box-shadow: none; padding: 0; border-radius: 12px; overflow: hidden; display: inline-block; }}
-:root {{ --img-scale: 25%; --video-scale: 65%; }}
-.chat-img {{ width: var(--img-scale); border-radius: 12px; display: block; cursor: zoom-in; border: 1px solid #eee; transition: width 0.3s; }}
-.chat-video {{ width: 100%; border-radius: 12px; max-height: 400px; display: block; margin: 0; }}
-.video-container {{ display: flex; align-items: center; gap: 8px; }}
-.video-wrapper {{ width: var(--video-scale); line-height: 0; }}
-.video-expand-btn {{ width: 30px; height: 30px; border-radius: 50%; border: none; background-color: #ddd; color: #555; font-size: 16px; cursor: pointer; display: flex; align-items: center; justify-content: center; transition: background 0.2s; }}
-.video-expand-btn:hover {{ background-color: #bbb; color: #000; }}
-.chat-audio {{ width: 240px; }}
-.time-label {{ font-size: 11px; color: #999; margin-left: 4px; margin-top: 5px; min-width: 35px; }}
-.nav-buttons {{ position: fixed; bottom: 30px; right: 30px; display: flex; flex-direction: column; gap: 10px; z-index: 500; }}
-.nav-btn {{ width: 40px; height: 40px; border-radius: 50%; background: rgba(126, 16, 131, 0.8); color: white; border: none; font-size: 20px; cursor: pointer; box-shadow: 0 2px 5px rgba(0,0,0,0.3); display: flex; align-items: center; justify-content: center; opacity: 0.7; transition: opacity 0.2s, transform 0.2s; }}
-.nav-btn:hover {{ opacity: 1; transform: scale(1.1); }}
-#lightbox {{ display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; overflow: auto; background-color: rgba(0,0,0,0.9); align-items: center; justify-content: center; }}
-#lightbox-img {{ max-width: 90%; max-height: 90%; border-radius: 5px; box-shadow: 0 0 20px rgba(0,0,0,0.5); object-fit: contain; cursor: default; }}
-#lightbox-video {{ max-width: 90%; max-height: 90%; outline: none; }}
-@media (max-width: 768px) {{ .sidebar {{ display: none; }} .header-center-group {{ flex-wrap: wrap; justify-content: center; }} }}
-</style>
-</head>
-<body>
-<div id="lightbox" onclick="closeLightbox(event)">
-<img id="lightbox-img" src="" alt="Full size" style="display:none;" onclick="event.stopPropagation()">
-<video id="lightbox-video" controls style="display:none;" onclick="event.stopPropagation()"></video>
-</div>
-<div class="nav-buttons">
-<button class="nav-btn" title="回頂端" onclick="scrollToTop()">↑</button>
-<button class="nav-btn" title="去底部" onclick="scrollToBottom()">↓</button>
-</div>
-<div class="sidebar">
-<div class="sidebar-header">乃木坂46 MSG</div>
-<div class="sidebar-sort-info"><span id="sortStatus">排序：50音 (預設)</span><button id="resetSortBtn" class="reset-btn" onclick="resetSort()">重置</button></div>
-<div class="member-list" id="memberList"></div>
-</div>
-<div class="main-area">
-<div class="header">
-<div class="header-center-group">
-<div class="header-title" id="headerTitle">請選擇成員</div>
-<select id="yearSelect" disabled><option>年</option></select>
-<select id="monthSelect" disabled><option>月</option></select>
-<select id="scaleSelect"><option value="25%" selected>圖: 小</option><option value="50%">圖: 中</option><option value="75%">圖: 大</option><option value="100%">圖: 原</option></select>
-</div>
-</div>
-<div class="chat-container" id="chatBox"><div class="empty-state">請從左側選擇要瀏覽的成員</div></div>
-</div>
-<script>
-const allData = {json_data};
-const avatarMap = {json_avatars};
-let currentMember = null;
-let currentYears = {{}}; 
-let scrollTimeout = null;
-const memberListEl = document.getElementById('memberList');
-const chatBox = document.getElementById('chatBox');
-const headerTitle = document.getElementById('headerTitle');
-const yearSelect = document.getElementById('yearSelect');
-const monthSelect = document.getElementById('monthSelect');
-const scaleSelect = document.getElementById('scaleSelect');
-const sortStatus = document.getElementById('sortStatus');
-const resetSortBtn = document.getElementById('resetSortBtn');
-function openLightbox(src, type='img') {{ const lb = document.getElementById('lightbox'); const lbImg = document.getElementById('lightbox-img'); const lbVid = document.getElementById('lightbox-video'); lb.style.display = "flex"; if (type === 'video') {{ lbImg.style.display = "none"; lbVid.style.display = "block"; lbVid.src = src; lbVid.play(); }} else {{ lbVid.style.display = "none"; lbVid.pause(); lbImg.style.display = "block"; lbImg.src = src; }} }}
-function closeLightbox(e) {{ const lb = document.getElementById('lightbox'); const lbVid = document.getElementById('lightbox-video'); lbVid.pause(); lb.style.display = "none"; }}
-function scrollToTop() {{ chatBox.scrollTo({{ top: 0, behavior: 'smooth' }}); }}
-function scrollToBottom() {{ chatBox.scrollTo({{ top: chatBox.scrollHeight, behavior: 'smooth' }}); }}
-function init() {{
-let members = Object.keys(allData).sort();
-const savedOrder = localStorage.getItem('nogi_member_order');
-if (savedOrder) {{ try {{ const customOrder = JSON.parse(savedOrder); const validCustom = customOrder.filter(m => members.includes(m)); const missing = members.filter(m => !validCustom.includes(m)); members = [...validCustom, ...missing]; updateSortStatus(true); }} catch(e) {{}} }}
-renderSidebar(members);
-scaleSelect.onchange = function() {{ document.documentElement.style.setProperty('--img-scale', this.value); }};
-document.documentElement.style.setProperty('--img-scale', '25%');
-const lastMember = localStorage.getItem('nogi_last_member');
-if (lastMember && allData[lastMember]) {{ loadMember(lastMember); }}
-chatBox.addEventListener('scroll', function() {{ if (!currentMember || chatBox.style.opacity === '0') return; clearTimeout(scrollTimeout); scrollTimeout = setTimeout(() => {{ localStorage.setItem('nogi_scroll_' + currentMember, chatBox.scrollTop); }}, 200); }});
-}}
-function renderSidebar(members) {{
-memberListEl.innerHTML = '';
-members.forEach(m => {{
-const div = document.createElement('div'); div.className = 'member-item'; div.draggable = true; div.dataset.name = m;
-let avatarHtml = `<div class="member-avatar-icon">${{m[0]}}</div>`;
-if (avatarMap[m]) {{ avatarHtml = `<div class="member-avatar-icon clickable" onclick="event.stopPropagation(); openLightbox('${{avatarMap[m]}}')"><img src="${{avatarMap[m]}}"></div>`; }}
-div.innerHTML = `${{avatarHtml}}<div>${{m}}</div>`;
-div.onclick = () => loadMember(m);
-div.addEventListener('dragstart', handleDragStart); div.addEventListener('dragover', handleDragOver); div.addEventListener('drop', handleDrop); div.addEventListener('dragenter', handleDragEnter); div.addEventListener('dragleave', handleDragLeave);
-memberListEl.appendChild(div);
-}});
-}}
-let dragSrcEl = null;
-function handleDragStart(e) {{ this.classList.add('dragging'); dragSrcEl = this; e.dataTransfer.effectAllowed = 'move'; e.dataTransfer.setData('text/html', this.innerHTML); }}
-function handleDragOver(e) {{ if (e.preventDefault) {{ e.preventDefault(); }} e.dataTransfer.dropEffect = 'move'; return false; }}
-function handleDragEnter(e) {{ this.classList.add('over'); }}
-function handleDragLeave(e) {{ this.classList.remove('over'); }}
-function handleDrop(e) {{
-if (e.stopPropagation) {{ e.stopPropagation(); }}
-document.querySelectorAll('.member-item').forEach(col => {{ col.classList.remove('over'); col.classList.remove('dragging'); }});
-if (dragSrcEl !== this) {{ const allItems = [...memberListEl.querySelectorAll('.member-item')]; const srcIndex = allItems.indexOf(dragSrcEl); const targetIndex = allItems.indexOf(this); if (srcIndex < targetIndex) {{ this.after(dragSrcEl); }} else {{ this.before(dragSrcEl); }} saveSortOrder(); }}
-return false;
-}}
-function saveSortOrder() {{ const items = document.querySelectorAll('.member-item'); const order = Array.from(items).map(item => item.dataset.name); localStorage.setItem('nogi_member_order', JSON.stringify(order)); updateSortStatus(true); }}
-function resetSort() {{ localStorage.removeItem('nogi_member_order'); location.reload(); }}
-function updateSortStatus(isCustom) {{ if (isCustom) {{ sortStatus.textContent = "排序：自訂"; sortStatus.style.color = "#7e1083"; sortStatus.style.fontWeight = "bold"; resetSortBtn.style.display = "inline-block"; }} else {{ sortStatus.textContent = "排序：50音 (預設)"; sortStatus.style.color = "#666"; sortStatus.style.fontWeight = "normal"; resetSortBtn.style.display = "none"; }} }}
-function loadMember(name) {{
-chatBox.style.opacity = '0'; currentMember = name; localStorage.setItem('nogi_last_member', name);
-document.querySelectorAll('.member-item').forEach(el => el.classList.remove('active'));
-const targetItem = document.querySelector(`.member-item[data-name="${{name}}"]`);
-if(targetItem) targetItem.classList.add('active');
-headerTitle.textContent = name; analyzeDates(name);
-setTimeout(() => {{ renderMessages(name); }}, 10);
-}}
-function analyzeDates(name) {{
-const msgs = allData[name]; currentYears = {{}};
-msgs.forEach(msg => {{ const y = msg.ts.substring(0, 4); const m = msg.ts.substring(4, 6); if (!currentYears[y]) currentYears[y] = new Set(); currentYears[y].add(m); }});
-const years = Object.keys(currentYears).sort().reverse();
-yearSelect.innerHTML = '<option value="">年</option>';
-years.forEach(y => {{ const opt = document.createElement('option'); opt.value = y; opt.textContent = y; yearSelect.appendChild(opt); }});
-yearSelect.disabled = false; monthSelect.innerHTML = '<option value="">月</option>'; monthSelect.disabled = true;
-yearSelect.onchange = () => updateMonthSelect(yearSelect.value);
-monthSelect.onchange = () => scrollToDate(yearSelect.value, monthSelect.value);
-}}
-function updateMonthSelect(year) {{
-monthSelect.innerHTML = '<option value="">月</option>'; if (!year) {{ monthSelect.disabled = true; return; }}
-const months = Array.from(currentYears[year]).sort();
-months.forEach(m => {{ const opt = document.createElement('option'); opt.value = m; opt.textContent = m + "月"; monthSelect.appendChild(opt); }});
-monthSelect.disabled = false;
-}}
-function linkify(text) {{ var urlRegex = /(https?:\\/\\/[^\\s]+)/g; return text.replace(urlRegex, function(url) {{ return '<a href="' + url + '" target="_blank">' + url + '</a>'; }}); }}
-function renderMessages(name) {{
-chatBox.innerHTML = ''; const msgs = allData[name]; let lastDate = ''; let lastMonthKey = '';
-const fragment = document.createDocumentFragment();
-msgs.forEach(msg => {{
-const msgDiv = document.createElement('div'); const dateStr = msg.d; const monthKey = msg.ts.substring(0, 6);
-if (dateStr !== lastDate) {{ const sep = document.createElement('div'); sep.className = 'timestamp-separator'; sep.textContent = dateStr; if (monthKey !== lastMonthKey) {{ sep.id = 'anchor-' + monthKey; lastMonthKey = monthKey; }} fragment.appendChild(sep); lastDate = dateStr; }}
-let contentHtml = ''; const safePath = name + '/' + msg.f;
-if (msg.t === '.txt') {{ let textContent = msg.c.replace(/\\n/g, '<br>'); textContent = linkify(textContent); contentHtml = `<div class="bubble">${{textContent}}</div>`; }}
-else if (['.jpg', '.jpeg', '.png'].includes(msg.t)) {{ contentHtml = `<div class="bubble media-bubble"><img src="${{safePath}}" class="chat-img" onclick="openLightbox(this.src)"></div>`; }}
-else if (msg.t === '.mp4') {{ contentHtml = `<div class="video-container"><div class="video-wrapper"><div class="bubble media-bubble"><video src="${{safePath}}" controls class="chat-video" preload="metadata"></video></div></div><button class="video-expand-btn" title="全螢幕播放" onclick="openLightbox('${{safePath}}', 'video')">⛶</button></div>`; }}
-else if (['.m4a', '.mp3', '.wav'].includes(msg.t)) {{ contentHtml = `<div class="bubble media-bubble"><audio src="${{safePath}}" controls class="chat-audio"></audio></div>`; }}
-msgDiv.className = 'msg-row';
-let avatarHtml = `<div class="avatar">${{name[0]}}</div>`;
-if (avatarMap[name]) {{ avatarHtml = `<div class="avatar clickable" onclick="openLightbox('${{avatarMap[name]}}')"><img src="${{avatarMap[name]}}"></div>`; }}
-msgDiv.innerHTML = `${{avatarHtml}}<div class="bubble-wrapper">${{contentHtml}}</div><div class="time-label">${{msg.hm}}</div>`;
-fragment.appendChild(msgDiv);
-}});
-chatBox.appendChild(fragment);
-waitForImagesAndScroll(name);
-}}
-function waitForImagesAndScroll(name) {{
-const imgs = chatBox.querySelectorAll('img'); let loadedCount = 0; const total = imgs.length;
-const reveal = () => {{ const savedScroll = localStorage.getItem('nogi_scroll_' + name); if (savedScroll) {{ chatBox.scrollTop = parseInt(savedScroll); }} else {{ chatBox.scrollTop = chatBox.scrollHeight; }} chatBox.style.opacity = '1'; }};
-if (total === 0) {{ reveal(); }} else {{ const fallback = setTimeout(reveal, 1000); imgs.forEach(img => {{ if(img.complete) {{ loadedCount++; if(loadedCount === total) {{ clearTimeout(fallback); reveal(); }} }} else {{ img.onload = img.onerror = () => {{ loadedCount++; if(loadedCount === total) {{ clearTimeout(fallback); reveal(); }} }}; }} }}); }}
-}}
-function scrollToDate(year, month) {{ if (!year || !month) return; const id = 'anchor-' + year + month; const el = document.getElementById(id); if (el) {{ el.scrollIntoView({{ behavior: 'auto', block: 'start' }}); }} }}
-init();
-</script>
-</body>
-</html>"""
+            self.callback(self.avatar_map, self.avatar_stats)
 
 # --- 主程式 (v30.0: 新增更新頭像按鈕) ---
 class NogiBackupApp:
     def __init__(self, root):
         self.root = root
         self.root.title("NogkSaver (非官方) - 乃木坂MSG 備份工具 | by ann-nogk")
-        self.root.geometry("510x700") 
+        self.root.geometry("510x720") 
         
         style = ttk.Style()
         style.configure("TButton", font=("Microsoft JhengHei", 10))
         style.configure("TLabel", font=("Microsoft JhengHei", 10))
         style.configure("TLabelframe.Label", font=("Microsoft JhengHei", 10, "bold"))
         style.configure("TCheckbutton", font=("Microsoft JhengHei", 10))
+        style.configure("TNotebook.Tab", font=("Microsoft JhengHei", 10, "bold"), padding=(10, 3))
 
         # --- 0. 頂部連結 ---
         link_frame = ttk.Frame(root, padding=(0, 5))
         link_frame.pack(fill="x", padx=10)
 
+        # 備份與網頁設定分成兩個分頁，視窗不必同時容納所有選項 (小螢幕也放得下)
+        self.notebook = ttk.Notebook(root)
+        self.notebook.pack(fill="x", padx=10, pady=5)
+
         # --- 1. 區塊 A: 下載與備份設定 ---
-        self.frame_backup = ttk.LabelFrame(root, text="備份與下載設定", padding=15)
-        self.frame_backup.pack(fill="x", padx=10, pady=5)
+        self.frame_backup = ttk.Frame(self.notebook, padding=15)
+        self.notebook.add(self.frame_backup, text="備份與下載設定")
 
         ttk.Label(self.frame_backup, text="Refresh Token:").grid(row=0, column=0, sticky="w", pady=5)
         self.token_entry = ttk.Entry(self.frame_backup, width=50)
@@ -476,12 +214,27 @@ class NogiBackupApp:
         lbl_hint = ttk.Label(self.frame_backup, text="(可用 , 分隔多位成員 如：久保史緒里,田村真佑)", foreground="#666666", font=("Microsoft JhengHei", 8))
         lbl_hint.grid(row=3, column=1, columnspan=2, sticky="w", padx=5, pady=(0, 10))
 
+        ttk.Label(self.frame_backup, text="同時備份:").grid(row=4, column=0, sticky="w", pady=5)
+        self.parallel_var = tk.IntVar(value=1)
+        parallel_frame = ttk.Frame(self.frame_backup)
+        parallel_frame.grid(row=4, column=1, columnspan=2, sticky="w", padx=5)
+        ttk.Spinbox(parallel_frame, from_=1, to=8, width=4, textvariable=self.parallel_var, state="readonly").pack(side="left")
+        ttk.Label(parallel_frame, text="位成員 (指定多位成員時，每位成員各自執行 colmsg)", foreground="#666666").pack(side="left", padx=5)
+
+        self.auto_update_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.frame_backup, text="備份完成後自動更新網頁 (只更新有新訊息的成員)", variable=self.auto_update_var).grid(row=5, column=0, columnspan=3, sticky="w")
+
         self.btn_start = ttk.Button(self.frame_backup, text="開始備份", command=self.start_backup_thread)
-        self.btn_start.grid(row=4, column=0, columnspan=3, sticky="ew", pady=5)
+        self.btn_start.grid(row=6, column=0, columnspan=3, sticky="ew", pady=5)
+
+        self.backup_progress = ttk.Progressbar(self.frame_backup, orient="horizontal", mode="determinate")
+        self.backup_progress.grid(row=7, column=0, columnspan=3, sticky="ew")
+        self.backup_status_var = tk.StringVar()
+        ttk.Label(self.frame_backup, textvariable=self.backup_status_var, foreground="#666666").grid(row=8, column=0, columnspan=3, sticky="w")
 
         # --- 區塊 B: 網頁檢視器設定 ---
-        self.frame_viewer = ttk.LabelFrame(root, text="網頁檢視器設定", padding=15)
-        self.frame_viewer.pack(fill="x", padx=10, pady=10)
+        self.frame_viewer = ttk.Frame(self.notebook, padding=15)
+        self.notebook.add(self.frame_viewer, text="網頁檢視器設定")
 
         ttk.Label(self.frame_viewer, text="Msg 暱稱:").grid(row=0, column=0, sticky="w", pady=5)
         self.nickname_var = tk.StringVar()
@@ -503,6 +256,58 @@ class NogiBackupApp:
         self.btn_update_avatar = ttk.Button(action_frame, text="僅更新現有頭像", command=self.update_avatar_action)
         self.btn_update_avatar.pack(side="left", fill="x", expand=True)
 
+        self.split_layout_var = tk.BooleanVar(value=False)
+        self.chk_split_layout = ttk.Checkbutton(self.frame_viewer, text="依成員分檔 (大型備份用，點選成員時才載入訊息)", variable=self.split_layout_var)
+        self.chk_split_layout.grid(row=2, column=0, columnspan=3, sticky="w")
+
+        self.thumbnails_var = tk.BooleanVar(value=False)
+        self.chk_thumbnails = ttk.Checkbutton(self.frame_viewer, text="產生圖片縮圖 (需安裝 Pillow，瀏覽大量照片更順暢)", variable=self.thumbnails_var)
+        self.chk_thumbnails.grid(row=3, column=0, columnspan=3, sticky="w")
+
+        self.search_var = tk.BooleanVar(value=False)
+        self.chk_search = ttk.Checkbutton(self.frame_viewer, text="建立全文搜尋索引 (網頁上方可搜尋訊息)", variable=self.search_var)
+        self.chk_search.grid(row=4, column=0, columnspan=3, sticky="w")
+
+        # 不常用的選項預設收合
+        self.show_advanced_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.frame_viewer, text="顯示進階選項 (強制重建、效能分析、預先壓縮…)", variable=self.show_advanced_var,
+                        command=self.toggle_advanced).grid(row=5, column=0, columnspan=3, sticky="w", pady=(5, 0))
+        self.frame_advanced = ttk.Frame(self.frame_viewer, padding=(20, 0, 0, 0))
+        self.frame_advanced.grid(row=6, column=0, columnspan=3, sticky="w")
+
+        self.force_rebuild_var = tk.BooleanVar(value=False)
+        self.chk_force_rebuild = ttk.Checkbutton(self.frame_advanced, text="強制完整重建 (忽略快取，重新讀取所有檔案)", variable=self.force_rebuild_var)
+        self.chk_force_rebuild.grid(row=0, column=0, sticky="w")
+
+        self.profile_var = tk.BooleanVar(value=False)
+        self.chk_profile = ttk.Checkbutton(self.frame_advanced, text="效能分析 (各階段耗時寫入 .nogk_cache/profile.json)", variable=self.profile_var)
+        self.chk_profile.grid(row=1, column=0, sticky="w")
+
+        self.precompress_var = tk.BooleanVar(value=False)
+        self.chk_precompress = ttk.Checkbutton(self.frame_advanced, text="預先壓縮資料 (以本機伺服器開啟時載入更快)", variable=self.precompress_var)
+        self.chk_precompress.grid(row=2, column=0, sticky="w")
+
+        self.dedup_var = tk.BooleanVar(value=False)
+        self.chk_dedup = ttk.Checkbutton(self.frame_advanced, text="合併重複的媒體 (內容相同的圖片、影片只載入一份)", variable=self.dedup_var)
+        self.chk_dedup.grid(row=3, column=0, sticky="w")
+
+        self.quick_scan_var = tk.BooleanVar(value=False)
+        self.chk_quick_scan = ttk.Checkbutton(self.frame_advanced, text="快速掃描 (資料夾沒有變動的成員不逐一檢查檔案，適合網路磁碟)", variable=self.quick_scan_var)
+        self.chk_quick_scan.grid(row=4, column=0, sticky="w")
+        self.frame_advanced.grid_remove()
+
+        progress_frame = ttk.Frame(self.frame_viewer)
+        progress_frame.grid(row=7, column=0, columnspan=3, sticky="ew", pady=(10, 0))
+        self.gen_progress = ttk.Progressbar(progress_frame, orient="horizontal", mode="determinate")
+        self.gen_progress.pack(side="left", fill="x", expand=True)
+        self.btn_cancel_gen = ttk.Button(progress_frame, text="取消", width=6, command=self.cancel_generation, state="disabled")
+        self.btn_cancel_gen.pack(side="right", padx=(5, 0))
+        self.gen_status_var = tk.StringVar()
+        ttk.Label(self.frame_viewer, textvariable=self.gen_status_var, foreground="#666666").grid(row=8, column=0, columnspan=3, sticky="w")
+
+        self.btn_serve = ttk.Button(self.frame_viewer, text="以本機伺服器開啟網頁 (支援影片拖曳、載入較快)", command=self.serve_action)
+        self.btn_serve.grid(row=9, column=0, columnspan=3, sticky="ew", pady=(5, 0))
+
         # 5. GitHub 連結
         link_frame_mid = ttk.Frame(root, padding=(0, 5))
         link_frame_mid.pack(fill="x", padx=15)
@@ -518,8 +323,21 @@ class NogiBackupApp:
         self.log_area.insert(tk.END, "歡迎使用 NogkSaver！\n\n【已知問題】\n感謝訂閱訊息：因為 API 資料特性，訂閱時的第一則「感謝訂閱」訊息可能不會顯示在第一則。\n----------------------------------------")
         self.log_area.config(state='disabled')
 
-        self.process = None
+        # 背景執行緒只把紀錄放進佇列，由主執行緒定時整批寫到畫面，大量輸出時視窗也不會卡住
+        self.log_queue = queue.Queue()
+        self.backup_progress_state = None  # (成員, 比例, 輸出行)，由備份執行緒更新
+        self.file_logger = self._open_log_file()
+        self.root.after(LOG_FLUSH_MS, self.flush_log)
+
         self.is_running = False
+        self.http_server = None  # 本機伺服器 (serve_action 啟動)
+        self.http_server_dir = None
+        self.gen_thread = None  # 背景產生網頁的執行緒
+        self.cancel_event = None
+
+    def toggle_advanced(self):
+        if self.show_advanced_var.get(): self.frame_advanced.grid()
+        else: self.frame_advanced.grid_remove()
 
     def open_github(self):
         webbrowser.open("https://github.com/ann-nogk/NogkSaver")
@@ -529,11 +347,47 @@ class NogiBackupApp:
         if folder:
             self.path_var.set(folder)
 
+    def _open_log_file(self):
+        logger = logging.getLogger("NogkSaver")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            handler = RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
+        except OSError:
+            return None  # 資料夾無法寫入時只顯示在畫面上
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        return logger
+
     def log(self, msg):
-        self.log_area.config(state='normal')
-        self.log_area.insert(tk.END, "\n" + str(msg))
-        self.log_area.see(tk.END)
-        self.log_area.config(state='disabled')
+        # 任何執行緒都可以呼叫
+        self.log_queue.put(str(msg))
+
+    def flush_log(self):
+        lines = []
+        try:
+            while len(lines) < 5000:
+                lines.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if lines:
+            if self.file_logger:
+                for line in lines: self.file_logger.info(line)
+            self.log_area.config(state='normal')
+            self.log_area.insert(tk.END, "\n" + "\n".join(lines))
+            excess = int(self.log_area.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+            if excess > 0: self.log_area.delete('1.0', f"{excess + 1}.0")
+            self.log_area.see(tk.END)
+            self.log_area.config(state='disabled')
+        if self.backup_progress_state is not None:
+            name, fraction, line = self.backup_progress_state
+            self.backup_progress_state = None
+            if fraction is not None:
+                self.backup_progress.stop()
+                self.backup_progress.config(mode="determinate", maximum=100, value=fraction * 100)
+            label = f"[{name}] {line}" if name else line
+            self.backup_status_var.set(label if len(label) <= 60 else label[:57] + "...")
+        self.root.after(LOG_FLUSH_MS, self.flush_log)
 
     def start_backup_thread(self):
         if not os.path.exists("colmsg.exe"):
@@ -547,57 +401,59 @@ class NogiBackupApp:
 
         self.is_running = True
         self.btn_start.config(state="disabled")
+        self.backup_progress.config(mode="indeterminate", value=0)
+        self.backup_progress.start(15)  # 讀到進度之前先顯示忙碌狀態
         self.log("\n" + "-" * 30)
         self.log("=== 開始執行備份 ===")
         
-        threading.Thread(target=self.run_colmsg, args=(token,), daemon=True).start()
-
-    def run_colmsg(self, token):
+        # Tk 變數只能在主執行緒讀取
         save_dir = self.path_var.get()
-        member_input = self.member_var.get().strip()
-        
+        names = [n.strip() for n in re.split(r'[,,]', self.member_var.get().strip()) if n.strip()]
+        max_parallel = self.parallel_var.get()
+        auto_update = self.auto_update_var.get()
+        for n in names:
+            self.log(f"指定成員: {n}")
+        threading.Thread(target=self.run_colmsg, args=(token, save_dir, names, max_parallel, auto_update), daemon=True).start()
+
+    def run_colmsg(self, token, save_dir, names, max_parallel=1, auto_update=False):
         cmd = ["colmsg.exe", "--n_refresh_token", token, "-d", save_dir]
-        
-        if member_input:
-            names = re.split(r'[,,]', member_input)
-            for n in names:
-                n = n.strip()
-                if n:
-                    cmd.extend(["--name", n])
-                    self.log(f"指定成員: {n}")
-
-        self.log(f"執行中...")
-        
-        try:
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            self.process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8', 
-                bufsize=1,
-                startupinfo=startupinfo
-            )
-
-            for line in self.process.stdout:
-                if not self.is_running:
-                    break
-                self.root.after(0, self.log, line.strip())
-
-            self.process.wait()
-            
-            if self.is_running:
-                if self.process.returncode == 0:
-                    self.root.after(0, self.log, "=== 備份完成 ===")
-                    self.root.after(0, lambda: messagebox.showinfo("成功", "備份任務已完成"))
-                else:
-                    self.root.after(0, self.log, f"=== 異常結束 ({self.process.returncode}) ===")
+        # 備份前先記錄各成員資料夾的狀態，結束後比對就知道哪些成員有新訊息
+        group_dirs = [os.path.join(save_dir, name) for name in GROUP_NAMES]
+        before = {g: snapshot_members(g) for g in group_dirs} if auto_update else {}
+        parallel = max_parallel > 1 and len(names) > 1
+        self.root.after(0, self.log, f"執行中... (同時 {min(max_parallel, len(names))} 位成員)" if parallel else "執行中...")
+
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        def on_line(name, line):
+            # 平行執行時每行加上成員名稱，才分得出是誰的輸出
+            self.log(f"[{name}] {line}" if name else line)
+            self.backup_progress_state = (name, parse_progress(line), line)
+
+        def on_done(name, result):
+            if name:
+                status = "完成" if result['ok'] else f"失敗 (結束碼 {result['returncode']})"
+                self.root.after(0, self.log, f"[{name}] {status}，{result['elapsed']}s")
 
+        try:
+            summary = run_colmsg_jobs(cmd, names, max_parallel, on_line=on_line, on_done=on_done, startupinfo=startupinfo)
+            if auto_update:
+                # 部分成員失敗時，已下載的檔案仍然可以先更新
+                changes = {g: changed_members(before[g], snapshot_members(g)) for g in group_dirs
+                           if os.path.exists(os.path.join(g, "index.html"))}
+                self.root.after(0, self.run_auto_update, changes)
+            failed = [n or "colmsg" for n, r in summary['results'].items() if not r['ok']]
+            if not failed:
+                self.root.after(0, self.log, f"=== 備份完成 (耗時 {summary['elapsed']}s) ===")
+                self.root.after(0, lambda: messagebox.showinfo("成功", "備份任務已完成"))
+            elif parallel:
+                ok_count = len(summary['results']) - len(failed)
+                self.root.after(0, self.log, f"=== 備份結束 (耗時 {summary['elapsed']}s)：成功 {ok_count} 位，失敗 {', '.join(failed)} ===")
+            else:
+                self.root.after(0, self.log, f"=== 異常結束 ({summary['results']['']['returncode']}) ===")
         except Exception as e:
             self.root.after(0, self.log, f"執行錯誤: {e}")
         finally:
@@ -606,6 +462,65 @@ class NogiBackupApp:
     def reset_buttons(self):
         self.is_running = False
         self.btn_start.config(state="normal")
+        self.backup_progress.stop()
+        self.backup_progress.config(mode="determinate", value=0)
+        self.backup_status_var.set("")
+
+    def run_auto_update(self, changes):
+        # changes: {群組資料夾: [有變動的成員]}
+        changes = {g: members for g, members in changes.items() if members}
+        if not changes:
+            self.log("自動更新網頁: 沒有新訊息")
+            return
+        if self.gen_thread is not None and self.gen_thread.is_alive():
+            self.log("自動更新網頁: 目前正在產生網頁，略過")
+            return
+        self.cancel_event = threading.Event()
+        self.set_generating(True)
+
+        def progress(done, total, member):
+            self.root.after(0, self.update_gen_progress, done, total, member)
+
+        def worker():
+            for group, members in changes.items():
+                gen = ChatGenerator()
+                self.log(f"自動更新網頁: {os.path.basename(group)} ({', '.join(members)})")
+                try:
+                    success, result = gen.regenerate_members(group, members, progress_callback=progress, cancel_event=self.cancel_event)
+                except Exception as e:
+                    success, result = False, str(e)
+                if success and gen.last_profile is not None:
+                    self.log(f"更新完成，耗時 {gen.last_profile.total:.1f}s")
+                else:
+                    self.log(f"自動更新失敗: {result}")
+            self.root.after(0, self.on_auto_update_done)
+
+        self.gen_thread = threading.Thread(target=worker, daemon=True)
+        self.gen_thread.start()
+
+    def on_auto_update_done(self):
+        self.set_generating(False)
+        self.cancel_event = None
+
+    def serve_action(self):
+        initial_dir = os.path.join(self.path_var.get(), "nogizaka")
+        if not os.path.exists(initial_dir):
+            initial_dir = self.path_var.get()
+        target_dir = filedialog.askdirectory(initialdir=initial_dir, title="請選擇 nogizaka 資料夾 (含有 index.html)")
+        if not target_dir: return
+        if self.http_server is None or self.http_server_dir != target_dir:
+            if self.http_server is not None:
+                self.http_server.shutdown()
+                self.http_server.server_close()
+            try:
+                self.http_server = make_server(target_dir, quiet=True)
+            except OSError:
+                self.http_server = make_server(target_dir, port=0, quiet=True)  # 預設連接埠被占用時改用任意可用的
+            self.http_server_dir = target_dir
+            threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{self.http_server.server_address[1]}/"
+        self.log(f"本機伺服器: {url} ({target_dir})，關閉本程式即停止")
+        webbrowser.open(url)
 
     def generate_html_action(self):
         # 產生全新網頁的入口 (掃描資料夾 -> 生成 HTML)
@@ -627,7 +542,7 @@ class NogiBackupApp:
                 self.run_generation(target_dir, nickname, {})
 
     def update_avatar_action(self):
-        # 僅更新頭像的入口 (讀取 HTML -> 替換 JSON)
+        # 僅更新頭像的入口 (只改寫 avatars/avatar_map.js)
         nickname = self.nickname_var.get().strip() # 這裡的 nickname 其實用不到，因為只改 avatarMap
         
         initial_dir = os.path.join(self.path_var.get(), "nogizaka")
@@ -645,14 +560,8 @@ class NogiBackupApp:
             self.open_avatar_dialog(target_dir, nickname, action="update")
 
     def open_avatar_dialog(self, target_dir, nickname, action):
-        members = []
         try:
-            for entry in os.listdir(target_dir):
-                full_path = os.path.join(target_dir, entry)
-                if os.path.isdir(full_path) and len(os.listdir(full_path)) > 0:
-                    if entry == "avatars": continue
-                    members.append(entry)
-            members.sort()
+            members = ChatGenerator().list_members(target_dir)
         except Exception as e:
             messagebox.showerror("錯誤", f"讀取成員失敗: {e}")
             return
@@ -662,10 +571,14 @@ class NogiBackupApp:
             return
 
         # 根據 action 決定 callback
-        if action == "generate":
-            callback_func = lambda amap: self.run_generation(target_dir, nickname, amap)
-        else: # update
-            callback_func = lambda amap: self.run_update_only(target_dir, amap)
+        def callback_func(amap, stats):
+            if stats:
+                self.log(f"頭像: 複製 {stats['copied']} / 縮小 {stats['resized']} / 未變更 {stats['skipped']} / 失敗 {stats['failed']}"
+                         + format_errors("頭像複製失敗", stats.get('errors')))
+            if action == "generate":
+                self.run_generation(target_dir, nickname, amap)
+            else: # update
+                self.run_update_only(target_dir, amap)
 
         dialog = AvatarSelectionWindow(self.root, members, target_dir, callback_func)
         # 這裡不使用 wait_window，因為 callback 會在視窗內觸發，避免邏輯卡住
@@ -673,11 +586,89 @@ class NogiBackupApp:
         # 為了簡化，AvatarSelectionWindow 在 finish 時會呼叫 callback。
 
     def run_generation(self, target_dir, nickname, avatar_map):
-        gen = ChatGenerator()
-        success, result = gen.generate_single_index(target_dir, nickname, avatar_map)
-        
+        # 生成工作放到背景執行緒，大量訊息時視窗也不會「沒有回應」；Tk 變數必須在主執行緒讀取
+        if self.gen_thread is not None and self.gen_thread.is_alive(): return
+        options = {
+            'force_rebuild': self.force_rebuild_var.get(),
+            'layout': "split" if self.split_layout_var.get() else "inline",
+            'thumbnails': self.thumbnails_var.get(),
+            'search': self.search_var.get(),
+            'profile': self.profile_var.get(),
+            'precompress': self.precompress_var.get(),
+            'dedup': self.dedup_var.get(),
+            'quick_scan': self.quick_scan_var.get(),
+        }
+        self.cancel_event = threading.Event()
+        self.set_generating(True)
+        self.log("=== 開始產生網頁 ===")
+
+        def progress(done, total, member):
+            self.root.after(0, self.update_gen_progress, done, total, member)
+
+        def worker():
+            gen = ChatGenerator()
+            try:
+                success, result = gen.generate_single_index(target_dir, nickname, avatar_map, progress_callback=progress, cancel_event=self.cancel_event, **options)
+            except Exception as e:
+                success, result = False, str(e)
+            self.root.after(0, self.on_generation_done, gen, success, result, nickname)
+
+        self.gen_thread = threading.Thread(target=worker, daemon=True)
+        self.gen_thread.start()
+
+    def update_gen_progress(self, done, total, member):
+        self.gen_progress.config(mode="determinate", maximum=max(total, 1), value=done)
+        self.gen_status_var.set(f"{done}/{total} {member}")
+
+    def cancel_generation(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.btn_cancel_gen.config(state="disabled")
+            self.gen_status_var.set("取消中...")
+
+    def set_generating(self, busy):
+        state = "disabled" if busy else "normal"
+        self.btn_html.config(state=state)
+        self.btn_update_avatar.config(state=state)
+        self.btn_cancel_gen.config(state="normal" if busy else "disabled")
+        if busy:
+            self.gen_progress.config(mode="indeterminate", value=0)
+            self.gen_progress.start(15)
+            self.gen_status_var.set("掃描中...")
+        else:
+            self.gen_progress.stop()
+            self.gen_progress.config(mode="determinate", value=0)
+            self.gen_status_var.set("")
+
+    def on_generation_done(self, gen, success, result, nickname):
+        self.set_generating(False)
+        cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+        self.cancel_event = None
+
         log_msg = f"=== 網頁產生完畢 ===\n檔案位置: {result}"
         if nickname: log_msg += f"\nMsg 暱稱: {nickname}"
+        stats = gen.last_stats
+        if stats:
+            log_msg += f"\n讀取檔案: {stats['parsed']} / 沿用快取: {stats['reused']} (未變動成員 {stats['cached_members']}/{stats['members']})"
+            thumbs = stats.get('thumbs')
+            if isinstance(thumbs, dict):
+                log_msg += f"\n縮圖: 新增 {thumbs['made']} / 略過 {thumbs['skipped']} / 失敗 {thumbs['failed']}"
+                log_msg += format_errors("縮圖失敗", thumbs.get('errors'))
+            elif thumbs:
+                log_msg += f"\n縮圖: {thumbs}"
+            if 'search' in stats:
+                log_msg += f"\n搜尋索引: {stats['search']['keys']} 個詞 / {stats['search']['bytes'] // 1024} KB"
+            dd = stats.get('dedup')
+            if isinstance(dd, dict):
+                log_msg += f"\n重複媒體: {dd['groups']} 組 / {dd['duplicates']} 個檔案 ({dd['duplicate_bytes'] // 1024} KB，已是硬連結 {dd['already_linked']} 個)"
+            elif dd:
+                log_msg += f"\n重複媒體: {dd}"
+            if 'precompress' in stats:
+                pc = stats['precompress']
+                log_msg += f"\n預先壓縮: {pc['compressed']} / {pc['files']} 個檔案 ({pc['bytes_in'] // 1024} KB → {pc['bytes_out'] // 1024} KB)"
+            log_msg += format_errors("警告", stats.get('warnings'))
+        if success and gen.last_profile is not None:
+            log_msg += "\n" + gen.last_profile.format_summary()
         
         if success:
             self.log(log_msg)
@@ -686,14 +677,27 @@ class NogiBackupApp:
             if nickname: popup_msg += f"Msg 暱稱已替換為: {nickname}\n"
             popup_msg += f"\n檔案位置: {result}\n請手動開啟瀏覽。"
             messagebox.showinfo("成功", popup_msg)
+        elif cancelled:
+            self.log(f"=== 已取消 === {result}")
         else:
             self.log(f"產生失敗: {result}")
             messagebox.showerror("失敗", result)
 
     def run_update_only(self, target_dir, avatar_map):
-        gen = ChatGenerator()
-        success, result = gen.update_html_avatars(target_dir, avatar_map)
-        
+        if self.gen_thread is not None and self.gen_thread.is_alive(): return
+        self.set_generating(True)
+        self.btn_cancel_gen.config(state="disabled")  # 只改頭像很快，不提供取消
+
+        def worker():
+            gen = ChatGenerator()
+            success, result = gen.update_html_avatars(target_dir, avatar_map)
+            self.root.after(0, self.on_update_done, success, result)
+
+        self.gen_thread = threading.Thread(target=worker, daemon=True)
+        self.gen_thread.start()
+
+    def on_update_done(self, success, result):
+        self.set_generating(False)
         if success:
             self.log(f"=== 頭像更新完畢 ===\n已更新檔案: {result}")
             messagebox.showinfo("成功", "頭像設定已更新至 index.html\n請重新整理網頁查看效果。")
@@ -702,6 +706,7 @@ class NogiBackupApp:
             messagebox.showerror("失敗", result)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包成 exe 後縮圖的子行程需要
     root = tk.Tk()
     app = NogiBackupApp(root)
     root.mainloop()
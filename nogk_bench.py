@@ -0,0 +1,285 @@
+"""
+NogkSaver 效能測試 (benchmark)
+
+產生 colmsg 格式的假資料 (成員資料夾 + 14 碼時間戳記檔名)，量測 nogk_core 的掃描、序列化、
+產生網頁、更新頭像的時間、輸出大小與記憶體峰值，結果以 JSON Lines 追加到結果檔，方便跨版本比較。
+
+    python nogk_bench.py --members 40 --messages 5000
+    python nogk_bench.py --members 40 --messages 5000 --layout split --search --compare
+    python nogk_bench.py --members 5 --messages 20000 --browser chrome   # 另外量測網頁 renderMessages
+    python nogk_bench.py --check   # 只檢查讀取媒體檔頭：被截斷的檔案不能讓產生網頁失敗
+
+未指定 --archive 時會在暫存資料夾產生假資料，測完自動刪除。
+測試會改寫 index.html、頭像設定與 .nogk_cache/，所以 --archive 只接受空資料夾或本程式產生的假資料 (有 .nogk_bench 標記檔)，不能指向真正的備份。
+"""
+import os
+import sys
+import json
+import time
+import random
+import struct
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+from nogk_core import ChatGenerator, DATA_DIR_NAME, SEARCH_DIR_NAME, AVATAR_DIR_NAME, CACHE_DIR_NAME, probe_media
+
+DEFAULT_MIX = "txt=70,jpg=20,mp4=4,m4a=6"
+KIND_CODES = {'txt': 0, 'jpg': 1, 'mp4': 2, 'm4a': 3}
+BENCH_MARKER = ".nogk_bench"  # 假資料的標記檔：有這個檔案的資料夾才能重複拿來測試
+TEXT_CHARS = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん今日明日写真撮影楽嬉最高緒配信見" + "abcdefg0123456789!?"
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip().lower()
+        if kind not in KIND_CODES: raise ValueError(f"不支援的類型: {kind}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+def make_synthetic_archive(group_dir, members=10, messages=1000, mix=DEFAULT_MIX, media_bytes=2048, seed=46):
+    """ 建立假的群組資料夾：每位成員 messages 則訊息，檔名為 <序號>_<類型>_<YYYYMMDDhhmmss>.<副檔名> """
+    rng = random.Random(seed)
+    weights = parse_mix(mix)
+    kinds, kind_weights = list(weights), list(weights.values())
+    media_blob = bytes(rng.getrandbits(8) for _ in range(media_bytes))
+    os.makedirs(group_dir, exist_ok=True)
+    with open(os.path.join(group_dir, BENCH_MARKER), 'w', encoding='utf-8') as f:
+        f.write("nogk_bench synthetic archive\n")
+    for m in range(members):
+        member_dir = os.path.join(group_dir, f"メンバー{m:03d}")
+        os.makedirs(member_dir, exist_ok=True)
+        ts = datetime(2018, 1, 1) + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        for i in range(messages):
+            ts += timedelta(minutes=rng.randint(1, 60 * 12))
+            kind = rng.choices(kinds, kind_weights)[0]
+            name = f"{i}_{KIND_CODES[kind]}_{ts.strftime('%Y%m%d%H%M%S')}.{kind}"
+            if kind == 'txt':
+                text = ''.join(rng.choice(TEXT_CHARS) for _ in range(rng.randint(10, 200)))
+                if rng.random() < 0.2: text = "%%%さん、" + text
+                with open(os.path.join(member_dir, name), 'w', encoding='utf-8') as f:
+                    f.write(text)
+            else:
+                with open(os.path.join(member_dir, name), 'wb') as f:
+                    f.write(media_blob)
+    return group_dir
+
+def _mp4_box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+def sample_media_headers():
+    """ 最小的合法媒體檔頭 {副檔名: (內容, probe_media 應得的結果)}，用來檢查截斷的檔案 """
+    tiff = b'II*\x00' + struct.pack('<IH', 8, 1) + struct.pack('<HHII', 0x0112, 3, 1, 6) + b'\x00' * 4  # EXIF 方向 6 (旋轉 90 度)
+    app1 = b'Exif\x00\x00' + tiff
+    jpeg = (b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, 480, 640, 1) + b'\x01\x11\x00' + b'\xff\xd9')
+    png = b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sIIBBBBB', 13, b'IHDR', 320, 200, 8, 2, 0, 0, 0) + b'\x00' * 4
+    mvhd = b'\x00' * 12 + struct.pack('>II', 1000, 12500) + b'\x00' * 80
+    tkhd = b'\x00' * 40 + struct.pack('>9i', 1 << 16, 0, 0, 0, 1 << 16, 0, 0, 0, 1 << 30) + struct.pack('>II', 1280 << 16, 720 << 16)
+    mp4 = _mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + _mp4_box(b'moov', _mp4_box(b'mvhd', mvhd) + _mp4_box(b'trak', _mp4_box(b'tkhd', tkhd)))
+    fmt = struct.pack('<HHIIHH', 1, 1, 8000, 16000, 2, 16)
+    wav = b'RIFF' + struct.pack('<I', 36 + 32000) + b'WAVE' + b'fmt ' + struct.pack('<I', 16) + fmt + b'data' + struct.pack('<I', 32000)
+    return {'.jpg': (jpeg, {'w': 480, 'h': 640}), '.png': (png, {'w': 320, 'h': 200}),
+            '.mp4': (mp4, {'w': 1280, 'h': 720, 'du': 12.5}), '.wav': (wav, {'du': 2.0})}
+
+def check_truncated_media():
+    """ 每種媒體檔頭的完整檔案要讀得出尺寸/長度，截斷在任何位置都只能回傳部分結果或 {}，不能丟出例外 """
+    failures = []
+    tmp_dir = tempfile.mkdtemp(prefix="nogk_check_")
+    try:
+        for ext, (data, expected) in sample_media_headers().items():
+            path = os.path.join(tmp_dir, "media" + ext)
+            for cut in range(len(data), -1, -1):
+                with open(path, 'wb') as f:
+                    f.write(data[:cut])
+                try:
+                    result = probe_media(path)
+                except Exception as e:
+                    failures.append(f"{ext} 截斷在 {cut} bytes: {type(e).__name__}: {e}")
+                    continue
+                if cut == len(data) and result != expected:
+                    failures.append(f"{ext} 完整檔案: {result} != {expected}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return failures
+
+def unsafe_archive_reason(group_dir):
+    """ 只接受不存在或空的資料夾，以及本程式產生的假資料；真正的備份會被蓋掉網頁、頭像與產生設定，回傳拒絕的原因 """
+    if not os.path.isdir(group_dir) or not os.listdir(group_dir): return None
+    if os.path.exists(os.path.join(group_dir, BENCH_MARKER)): return None
+    return (f"{group_dir} 不是 nogk_bench 產生的假資料；測試會改寫 index.html、{AVATAR_DIR_NAME}/ 與 {CACHE_DIR_NAME}/ (含產生設定)。"
+            "要測試真正的備份，請先複製一份成員資料夾到新的資料夾，並在其中建立空白的 " + BENCH_MARKER + " 檔")
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def output_size(group_dir):
+    total = os.path.getsize(os.path.join(group_dir, "index.html"))
+    for sub in (DATA_DIR_NAME, SEARCH_DIR_NAME):
+        if os.path.isdir(os.path.join(group_dir, sub)): total += dir_size(os.path.join(group_dir, sub))
+    return total
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows 沒有 resource 模組
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def measure_generate(group_dir, options):
+    """ 在獨立的子行程中完整產生一次網頁，記憶體峰值才不會受前面的測試影響 """
+    cmd = [sys.executable, os.path.abspath(__file__), "_generate", group_dir, json.dumps(options)]
+    out = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _generate_child(group_dir, options_json):
+    options = json.loads(options_json)
+    gen = ChatGenerator()
+    start = time.perf_counter()
+    success, result = gen.generate_single_index(group_dir, "bench", **options)
+    elapsed = time.perf_counter() - start
+    if not success: raise SystemExit(result)
+    print(json.dumps({'seconds': round(elapsed, 4), 'peak_rss_mb': peak_rss_mb(), 'stats': gen.last_stats,
+                      'phases': gen.last_profile.to_dict(members=False)['phases']}, ensure_ascii=False))
+
+def measure_scan(group_dir):
+    """ 只量測掃描 (不使用快取) 與序列化，兩者分開計時 """
+    gen = ChatGenerator()
+    members = gen.list_members(group_dir)
+    start = time.perf_counter()
+    scanned = [gen._scan_member(os.path.join(group_dir, m), None)[0]['msgs'] for m in members]
+    scan_s = time.perf_counter() - start
+    start = time.perf_counter()
+    json_bytes = sum(len(chunk.encode('utf-8')) for msgs in scanned for chunk in gen._iter_packed_json(msgs))
+    serialize_s = time.perf_counter() - start
+    # 舊格式 (每則訊息一個 {f, t, ts, d, hm, c} 物件) 的大小，用來比較精簡格式省下多少
+    legacy_bytes = sum(len(json.dumps(msgs, ensure_ascii=False).encode('utf-8')) for msgs in scanned)
+    return {'scan_s': round(scan_s, 4), 'serialize_s': round(serialize_s, 4), 'json_bytes': json_bytes,
+            'json_bytes_legacy': legacy_bytes, 'total_messages': sum(len(msgs) for msgs in scanned)}
+
+def measure_avatars(group_dir, members):
+    gen = ChatGenerator()
+    avatar_map = {m: f"avatars/{m}.jpg" for m in members}
+    start = time.perf_counter()
+    success, result = gen.update_html_avatars(group_dir, avatar_map)
+    return round(time.perf_counter() - start, 4) if success else None
+
+def measure_viewer(group_dir, browser):
+    """ 以無頭瀏覽器開啟 index.html#bench，讀回每位成員的顯示時間 """
+    url = "file://" + os.path.abspath(os.path.join(group_dir, "index.html")).replace(os.sep, '/') + "#bench"
+    cmd = [browser, "--headless", "--disable-gpu", "--allow-file-access-from-files", "--virtual-time-budget=120000", "--dump-dom", url]
+    dom = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', timeout=600).stdout
+    start = dom.find('<pre id="nogkBench">')
+    if start < 0: return None
+    body = dom[start + len('<pre id="nogkBench">'):dom.find('</pre>', start)]
+    results = json.loads(body.replace('&quot;', '"').replace('&amp;', '&'))
+    return {'render_ms_total': sum(r['ms'] for r in results), 'render_ms_max': max(r['ms'] for r in results),
+            'max_nodes': max(r['nodes'] for r in results)}
+
+def git_version():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+def run_benchmark(args):
+    tmp_root = None
+    group_dir = args.archive
+    if not group_dir:
+        tmp_root = tempfile.mkdtemp(prefix="nogk_bench_")
+        group_dir = os.path.join(tmp_root, "nogizaka")
+    try:
+        if not os.path.isdir(group_dir) or not os.listdir(group_dir):
+            start = time.perf_counter()
+            make_synthetic_archive(group_dir, args.members, args.messages, args.mix, args.media_bytes, args.seed)
+            print(f"產生假資料 {args.members} x {args.messages} ({time.perf_counter() - start:.1f}s): {group_dir}", file=sys.stderr)
+
+        options = {'layout': args.layout, 'search': args.search}
+        metrics = measure_scan(group_dir)
+        cold = measure_generate(group_dir, dict(options, force_rebuild=True))
+        warm = measure_generate(group_dir, options)
+        metrics.update({
+            'generate_cold_s': cold['seconds'], 'generate_warm_s': warm['seconds'],
+            'peak_rss_mb': cold['peak_rss_mb'], 'output_bytes': output_size(group_dir),
+            'phases_cold': cold['phases'], 'phases_warm': warm['phases'],
+        })
+        metrics['avatars_update_s'] = measure_avatars(group_dir, ChatGenerator().list_members(group_dir))
+        if args.browser:
+            metrics['viewer'] = measure_viewer(group_dir, args.browser)
+        return {
+            'time': datetime.now().isoformat(timespec='seconds'), 'version': git_version(),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'params': {'members': args.members, 'messages': args.messages, 'mix': args.mix, 'layout': args.layout,
+                       'search': args.search, 'archive': bool(args.archive)},
+            'metrics': metrics,
+        }
+    finally:
+        if tmp_root and not args.keep: shutil.rmtree(tmp_root, ignore_errors=True)
+
+def load_previous(results_path, params):
+    if not os.path.exists(results_path): return None
+    previous = None
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try: record = json.loads(line)
+            except ValueError: continue
+            if record.get('params') == params: previous = record
+    return previous
+
+def print_report(record, previous=None):
+    print(f"版本 {record['version']}  參數 {json.dumps(record['params'], ensure_ascii=False)}")
+    old = previous['metrics'] if previous else {}
+    for key, value in record['metrics'].items():
+        line = f"  {key:<18} {value}"
+        if isinstance(value, (int, float)) and isinstance(old.get(key), (int, float)) and old[key]:
+            line += f"   (前次 {previous['version']}: {old[key]}, {(value - old[key]) / old[key] * 100:+.1f}%)"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="nogk_bench", description="NogkSaver 效能測試")
+    parser.add_argument("--members", type=int, default=10, help="成員數")
+    parser.add_argument("--messages", type=int, default=2000, help="每位成員的訊息數")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"訊息類型比例 (預設 {DEFAULT_MIX})")
+    parser.add_argument("--media-bytes", type=int, default=2048, help="假媒體檔大小")
+    parser.add_argument("--seed", type=int, default=46)
+    parser.add_argument("--layout", choices=("inline", "split"), default="inline")
+    parser.add_argument("--search", action="store_true", help="同時建立全文搜尋索引")
+    parser.add_argument("--archive", help="使用 (或建立在) 指定的群組資料夾，而不是暫存資料夾 (只接受空資料夾或本程式產生的假資料)")
+    parser.add_argument("--keep", action="store_true", help="保留暫存的假資料")
+    parser.add_argument("--browser", help="Chrome/Chromium 執行檔，另外量測網頁顯示時間")
+    parser.add_argument("--results", default="bench_results.jsonl", help="結果檔 (JSON Lines，追加寫入)")
+    parser.add_argument("--compare", action="store_true", help="與結果檔中相同參數的前一次結果比較")
+    parser.add_argument("--check", action="store_true", help="只檢查讀取被截斷的媒體檔頭 (不量測效能)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check_truncated_media()
+        for line in failures: print(line)
+        print("媒體檔頭檢查: " + ("失敗" if failures else "通過"))
+        return 1 if failures else 0
+
+    reason = unsafe_archive_reason(args.archive) if args.archive else None
+    if reason: parser.error(reason)
+    record = run_benchmark(args)
+    previous = load_previous(args.results, record['params']) if args.compare else None
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print_report(record, previous)
+    return 0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_generate":
+        _generate_child(sys.argv[2], sys.argv[3])
+    else:
+        sys.exit(main())
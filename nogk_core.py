@@ -0,0 +1,2456 @@
+"""
+NogkSaver 網頁產生核心 (不依賴 tkinter)
+
+可直接匯入使用：
+    from nogk_core import ChatGenerator, run_batch
+
+也可以從命令列批次執行 (適合排程在伺服器上定時更新)：
+    python nogk_core.py generate D:/NogiBackup/nogizaka D:/NogiBackup/sakurazaka --workers 2 --json
+    python nogk_core.py generate --root D:/NogiBackup --nickname ann --search
+    python nogk_core.py avatars D:/NogiBackup/nogizaka --avatar-map avatars.json
+    python nogk_core.py watch --root D:/NogiBackup
+    python nogk_core.py serve D:/NogiBackup/nogizaka --open
+    python nogk_core.py query D:/NogiBackup/nogizaka --member 久保史緒里 --month 2023-05
+"""
+import os
+import re
+import json
+import time
+import gzip
+import stat
+import shutil
+import struct
+import sqlite3
+import hashlib
+import itertools
+import tempfile
+import threading
+import subprocess
+import unicodedata
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import unquote
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# --- HTML 生成器邏輯 (v31.1: 掃描快取 + 多執行緒 scandir 掃描成員) ---
+CACHE_DIR_NAME = ".nogk_cache"  # 放在群組資料夾內的快取資料夾
+CACHE_VERSION = 1
+DATA_DIR_NAME = "data"  # split 模式下每位成員一個資料檔
+THUMB_DIR_NAME = "thumbs"  # 圖片縮圖 thumbs/<成員>/<原檔名>.jpg
+THUMB_SIZE = 480  # 縮圖最長邊 (px)
+THUMB_EXTS = {'.jpg', '.jpeg', '.png'}
+SEARCH_DIR_NAME = "search"  # 全文搜尋索引分片
+SEARCH_SHARDS = 64
+AVATAR_DIR_NAME = "avatars"
+AVATAR_MAP_NAME = "avatar_map.js"  # avatars/avatar_map.js: 頭像設定，更新頭像時只改寫這個小檔案
+AVATAR_SIZE = 160  # 頭像縮小後的最長邊 (px)；畫面上只有 36~40px，保留高解析度螢幕的餘裕
+RESERVED_DIRS = {AVATAR_DIR_NAME, DATA_DIR_NAME, THUMB_DIR_NAME, SEARCH_DIR_NAME}
+DATA_PLACEHOLDER = "/*__NOGK_ALL_DATA__*/"  # 串流寫入時切開 HTML 樣板的位置
+PROFILE_JSON_NAME = "profile.json"  # 效能分析結果 (放在快取資料夾)
+PROFILE_STATS_NAME = "profile.pstats"
+SETTINGS_NAME = "settings.json"  # 上次產生網頁的設定，只更新部分成員時沿用
+INDEX_DB_NAME = "messages.db"  # 訊息索引 (SQLite，放在快取資料夾)
+THUMB_STATE_NAME = "thumbs.json"  # {成員: 上次縮圖全部完成時資料夾的修改時間}，quick_scan 時略過沒有變動的成員
+LEGACY_CACHE_DIR = "manifest"  # v31.8 以前每位成員一個 JSON 的掃描快取，第一次產生時轉進訊息索引
+MEDIA_ALIAS_NAME = "media_alias.js"  # data/media_alias.js: 重複媒體 {成員/檔名: 正本路徑}
+DIR_MTIME_SETTLE_NS = 2 * 10**9  # 成員資料夾修改超過 2 秒 (FAT 的時間精度) 才記錄為已掃描的時間
+MEDIA_LOOKAHEAD = 800  # 圖片、影片、語音距離畫面多少 px 內才開始載入
+DATA_FORMAT = 4  # 網頁資料格式 (2 = 精簡的平行陣列，3 = split 模式依月份分檔，4 = 加上媒體寬高與長度)；格式不同時不能沿用舊的資料檔
+
+LOCK_NAME = "generate.lock"  # .nogk_cache/generate.lock: 同一個群組同時只能有一個程序產生網頁
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def make_temp_path(path):
+    """ 在目標檔案的資料夾中建立唯一的暫存檔 (同時執行的程序不會寫到同一個暫存檔)，回傳路徑
+        mkstemp 建立的檔案只有擁有者能讀，改回一般新檔案的權限，換上後瀏覽器與網頁伺服器才讀得到 """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try: os.chmod(tmp_path, 0o666 & ~_UMASK)
+    except OSError: pass
+    return tmp_path
+
+@contextmanager
+def atomic_write(path, encoding='utf-8', mode='w'):
+    """ 先寫入暫存檔，完成後才以 os.replace 取代原檔；中途失敗時原檔保持不變 """
+    tmp_path = make_temp_path(path)
+    try:
+        with open(tmp_path, mode, encoding=None if 'b' in mode else encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+class PendingWrites:
+    """ 收集多個暫存檔，全部寫完後才一起換上；取消或失敗時全部丟棄，原本的檔案保持不變 """
+    def __init__(self):
+        self.items = []
+
+    @contextmanager
+    def open(self, path, encoding='utf-8'):
+        tmp_path = make_temp_path(path)
+        try:
+            with open(tmp_path, 'w', encoding=encoding) as f:
+                yield f
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+        self.items.append((tmp_path, path))
+
+    def written_size(self, path):
+        """ 已寫好、還沒換上的檔案大小 """
+        return next(os.path.getsize(tmp_path) for tmp_path, target in self.items if target == path)
+
+    def commit(self):
+        for tmp_path, path in self.items:
+            os.replace(tmp_path, path)
+        self.items = []
+
+    def discard(self):
+        for tmp_path, _ in self.items:
+            try: os.remove(tmp_path)
+            except OSError: pass
+        self.items = []
+
+class GenerationCancelled(Exception):
+    pass
+
+class GenerationBusy(Exception):
+    """ 同一個群組已經有另一個程序 (監看模式、另一個視窗或命令列) 在產生網頁 """
+
+def _lock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def _unlock_file(f):
+    if os.name == 'nt':
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def group_lock(group_folder_path):
+    """ 在 .nogk_cache/generate.lock 上取得獨占鎖，整個產生過程都持有；已被別的程序持有時丟出 GenerationBusy
+        鎖由作業系統管理，程序當掉時自動釋放，不會留下卡住的鎖檔 """
+    cache_dir = os.path.join(group_folder_path, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, LOCK_NAME), 'a+b') as f:
+        try:
+            _lock_file(f)
+        except OSError:
+            raise GenerationBusy("另一個程序正在更新這個群組的網頁 (監看模式、自動更新或命令列)，請稍後再試") from None
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+PHASE_LABELS = {
+    'list': "列出成員", 'thumbnails': "縮圖", 'cache_load': "讀取索引", 'scandir': "列出檔案",
+    'read': "讀取訊息", 'sort': "排序", 'cache_save': "寫入索引", 'scan_wait': "等待掃描",
+    'serialize': "JSON 序列化", 'write': "寫入輸出", 'template': "樣板", 'search_index': "建立搜尋索引",
+    'search_write': "寫入搜尋索引", 'commit': "換上檔案", 'dedup': "重複媒體", 'precompress': "壓縮",
+}
+
+class GenerationProfile:
+    """ 記錄一次生成各階段的耗時與每位成員讀寫的檔案數、位元組數
+        掃描階段 (cache_load / scandir / read / sort / cache_save) 在多個執行緒中累加，總和可能超過實際經過時間 """
+    def __init__(self):
+        self.phases = {}
+        self.members = {}
+        self.output_bytes = {}
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def iter_timed(self, name, iterable):
+        # 只計算取得下一個項目的時間 (例如等待掃描結果、產生 JSON 片段)，不含呼叫端處理的時間
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.add(name, time.perf_counter() - start)
+            yield item
+
+    def add_member(self, member, **counts):
+        with self.lock:
+            stats = self.members.setdefault(member, {})
+            for key, value in counts.items():
+                stats[key] = stats.get(key, 0) + value
+
+    def to_dict(self, members=True):
+        totals = {}
+        for stats in self.members.values():
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        data = {'total_s': round(self.total, 4), 'phases': {k: round(v, 4) for k, v in self.phases.items()},
+                'totals': totals, 'output_bytes': self.output_bytes}
+        if members: data['members'] = self.members
+        return data
+
+    def format_summary(self, top=6):
+        """ 給記錄視窗看的簡短摘要：最耗時的幾個階段與讀寫量 """
+        data = self.to_dict()
+        phases = sorted(data['phases'].items(), key=lambda kv: kv[1], reverse=True)[:top]
+        lines = [f"總耗時 {data['total_s']:.2f}s：" + " / ".join(f"{PHASE_LABELS.get(k, k)} {v:.2f}s" for k, v in phases)]
+        totals = data['totals']
+        if totals:
+            lines.append(f"讀取 {totals.get('files_read', 0)} 個檔案 ({totals.get('bytes_read', 0) / 1048576:.1f} MB)、"
+                         f"{totals.get('media_probed', 0)} 個媒體檔頭，"
+                         f"索引 {totals.get('cache_rows', 0)} 則訊息")
+        if self.output_bytes:
+            lines.append("輸出 " + " / ".join(f"{k} {v / 1048576:.1f} MB" for k, v in self.output_bytes.items()))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        with atomic_write(path) as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+
+def make_thumbnail(src_path, dest_path, size):
+    """ 在子行程中執行：把圖片縮小存成 JPEG 縮圖，成功回傳 None，失敗回傳錯誤訊息 """
+    try:
+        from PIL import Image, ImageOps
+        tmp_path = None
+        with Image.open(src_path) as img:
+            img.draft('RGB', (size, size))  # JPEG 可直接以較低解析度解碼，省下大部分時間
+            img = ImageOps.exif_transpose(img)  # 手機照片的旋轉資訊，縮圖不保留 EXIF 所以要先轉正
+            img.thumbnail((size, size))
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            tmp_path = make_temp_path(dest_path)
+            img.save(tmp_path, 'JPEG', quality=80)
+        os.replace(tmp_path, dest_path)
+        return None
+    except Exception as e:
+        if tmp_path is not None:
+            try: os.remove(tmp_path)
+            except OSError: pass
+        return f"{os.path.basename(src_path)}: {e}"
+
+def store_avatar(src_path, avatar_dir, size=None):
+    """ 以內容雜湊命名存到 avatars/ (內容不變檔名就不變，瀏覽器快取仍有效)；同名檔案已存在就略過
+        size 指定且有 Pillow 時縮小到最長邊 size px (GIF 維持原檔以保留動畫)
+        回傳 (相對路徑, "copied" / "resized" / "skipped") """
+    hasher = hashlib.sha1()
+    with open(src_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()[:16]
+    ext = os.path.splitext(src_path)[1].lower() or ".jpg"
+    if size and ext != '.gif':
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            size = None  # 沒有 Pillow 時照原檔複製
+    if size and ext != '.gif':
+        out_ext = ".png" if ext == ".png" else ".jpg"  # PNG 可能有透明背景
+        name = f"{digest}_{size}{out_ext}"
+    else:
+        name = digest + ext
+    dest_path = os.path.join(avatar_dir, name)
+    rel_path = f"{AVATAR_DIR_NAME}/{name}"
+    if os.path.exists(dest_path): return rel_path, "skipped"
+
+    tmp_path = make_temp_path(dest_path)
+    try:
+        if size and ext != '.gif':
+            with Image.open(src_path) as img:
+                img.draft('RGB', (size, size))
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((size, size))
+                if out_ext == ".png":
+                    img.save(tmp_path, 'PNG', optimize=True)
+                else:
+                    img.convert('RGB').save(tmp_path, 'JPEG', quality=85)
+            action = "resized"
+        else:
+            shutil.copyfile(src_path, tmp_path)
+            action = "copied"
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    return rel_path, action
+
+# --- 全文搜尋索引 (v31.3) ---
+class SearchIndexBuilder:
+    """ 文字正規化 (NFKC + 小寫) 後切成字元 bigram，每個詞的最後一個字另外當作單字元索引，
+        依第一個字的字碼分到固定數量的分片，瀏覽器只需載入查詢字所在的分片 """
+    MAX_MEMBERS = 1 << 12
+    MAX_MSGS = 1 << 20  # 訊息編號 = 成員序號 << 20 | 訊息序號
+
+    def __init__(self, shard_count=SEARCH_SHARDS):
+        self.shard_count = shard_count
+        self.members = []
+        self.postings = {}  # key -> array('I') 依序遞增的訊息編號
+
+    @staticmethod
+    def tokenize(text):
+        keys = set()
+        for run in unicodedata.normalize('NFKC', text).lower().split():
+            for a, b in zip(run, run[1:]):
+                keys.add(a + b)
+            keys.add(run[-1])
+        return keys
+
+    def add_member(self, member, msgs):
+        if len(self.members) >= self.MAX_MEMBERS: return
+        base = len(self.members) << 20
+        self.members.append(member)
+        postings = self.postings
+        for i, msg in enumerate(msgs[:self.MAX_MSGS]):
+            if msg['t'] != '.txt' or not msg['c']: continue
+            doc = base | i
+            for key in self.tokenize(msg['c']):
+                docs = postings.get(key)
+                if docs is None: postings[key] = docs = array('I')
+                docs.append(doc)
+
+    def _encode(self, docs):
+        # [成員序號, 筆數, 差值...] 重複，差值編碼讓 JSON 保持短小
+        flat = []
+        i = 0
+        while i < len(docs):
+            m = docs[i] >> 20
+            j = i
+            while j < len(docs) and docs[j] >> 20 == m: j += 1
+            flat.append(m)
+            flat.append(j - i)
+            prev = 0
+            for doc in docs[i:j]:
+                idx = doc & (self.MAX_MSGS - 1)
+                flat.append(idx - prev)
+                prev = idx
+            i = j
+        return flat
+
+    def write(self, search_dir, pending):
+        """ 寫出 search/s<n>.js 分片與 search/meta.js (由 pending 統一換上)，回傳統計 """
+        os.makedirs(search_dir, exist_ok=True)
+        by_shard = [[] for _ in range(self.shard_count)]
+        for key in self.postings:
+            by_shard[ord(key[0]) % self.shard_count].append(key)
+        total_bytes = 0
+        hasher = hashlib.sha1()  # 分片網址的版本：內容沒變時維持相同，瀏覽器可以繼續使用快取
+        for shard_id, keys in enumerate(by_shard):
+            shard = {key: self._encode(self.postings[key]) for key in sorted(keys)}  # tokenize 回傳 set，排序後每次輸出相同
+            content = f"nogkSearchShard({shard_id}, {json.dumps(shard, ensure_ascii=False, separators=(',', ':'))});\n"
+            with pending.open(os.path.join(search_dir, f"s{shard_id}.js")) as f:
+                f.write(content)
+            data = content.encode('utf-8')
+            hasher.update(data)
+            total_bytes += len(data)
+        meta = {'dir': SEARCH_DIR_NAME, 'shards': self.shard_count, 'members': self.members, 'v': hasher.hexdigest()[:8]}
+        with pending.open(os.path.join(search_dir, "meta.js")) as f:
+            f.write(f"window.nogkSearchMeta = {json.dumps(meta, ensure_ascii=False)};\n")
+        return {'keys': len(self.postings), 'postings': sum(len(d) for d in self.postings.values()), 'bytes': total_bytes}
+
+# --- 媒體資訊 (v32.0: 只讀檔頭取得尺寸與長度) ---
+MEDIA_EXTS = {'.jpg', '.jpeg', '.png', '.mp4', '.m4a', '.wav'}  # 讀得到尺寸或長度的格式 (mp3 沒有固定的檔頭可讀)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts'}
+
+def probe_media(path):
+    """ 讀取媒體檔頭，回傳 {'w', 'h', 'du'} 中讀得到的項目 (寬高為實際顯示方向，du 為秒數)；讀不到時回傳 {} """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            if ext in ('.jpg', '.jpeg'): return _probe_jpeg(f)
+            if ext == '.png': return _probe_png(f)
+            if ext in ('.mp4', '.m4a'): return _probe_mp4(f)
+            if ext == '.wav': return _probe_wav(f)
+    except (OSError, struct.error, ValueError, IndexError):
+        pass  # 檔頭被截斷或格式不符：照常產生網頁，只是沒有尺寸
+    return {}
+
+def _probe_png(f):
+    head = f.read(24)
+    if head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b'IHDR': return {}
+    w, h = struct.unpack('>II', head[16:24])
+    return {'w': w, 'h': h}
+
+def _probe_jpeg(f):
+    if f.read(2) != b'\xff\xd8': return {}
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte == b'\xff': byte = f.read(1)  # 標記前可以有多個填充的 0xFF
+        if not byte: return {}
+        marker = byte[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7: continue  # 沒有長度欄位的標記
+        if marker in (0xD9, 0xDA): return {}  # 影像資料開始前都沒找到 SOF
+        length = struct.unpack('>H', f.read(2))[0]
+        if length < 2: return {}  # 長度欄位包含自己的 2 bytes，更小代表檔案損壞 (往回跳會無限迴圈)
+        if marker in JPEG_SOF_MARKERS:
+            h, w = struct.unpack('>xHH', f.read(5))
+            # EXIF 方向 5~8 代表旋轉 90 度，瀏覽器會轉正顯示
+            return {'w': h, 'h': w} if orientation >= 5 else {'w': w, 'h': h}
+        if marker == 0xE1 and orientation == 1:
+            data = f.read(length - 2)
+            if data[:6] == b'Exif\x00\x00': orientation = _exif_orientation(data[6:])
+        else:
+            f.seek(length - 2, 1)
+
+def _exif_orientation(tiff):
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None: return 1
+    ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+    count = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+    for i in range(count):
+        entry = tiff[ifd + 2 + i * 12:ifd + 14 + i * 12]
+        if len(entry) < 12: break
+        if struct.unpack(endian + 'H', entry[:2])[0] == 0x0112:
+            return struct.unpack(endian + 'H', entry[8:10])[0]
+    return 1
+
+def _iter_mp4_boxes(f, end):
+    # 依序走過 [開始, end) 之間的 box，回傳 (類型, 內容開始位置, 內容長度)，不讀內容
+    pos = f.tell()
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header: return
+        yield kind, pos + header, size - header
+        pos += size
+
+def _probe_mp4(f):
+    end = f.seek(0, 2)
+    f.seek(0)
+    info = {}
+    # moov 可能在檔尾 (未最佳化的影片)，只讀 box 標頭跳過 mdat，不讀影像資料
+    stack = [(0, end)]
+    while stack:
+        start, stop = stack.pop()
+        f.seek(start)
+        for kind, body, length in _iter_mp4_boxes(f, stop):
+            if kind in MP4_CONTAINERS:
+                stack.append((body, body + length))
+            elif kind == b'mvhd':
+                f.seek(body)
+                data = f.read(32)
+                if len(data) < (32 if data[:1] == b'\x01' else 20): return info  # 檔案被截斷
+                if data[0] == 1: timescale, duration = struct.unpack('>IQ', data[20:32])
+                else: timescale, duration = struct.unpack('>II', data[12:20])
+                if timescale: info['du'] = round(duration / timescale, 1)
+            elif kind == b'tkhd' and 'w' not in info:
+                f.seek(body)
+                data = f.read(96)
+                offset = 52 if data[:1] == b'\x01' else 40  # 變換矩陣的位置 (version 1 的時間欄位是 64 位元)
+                if len(data) < offset + 44: return info  # 檔案被截斷
+                a, b = struct.unpack('>ii', data[offset:offset + 8])
+                w, h = (v >> 16 for v in struct.unpack('>II', data[offset + 36:offset + 44]))
+                if w and h:  # 音軌的寬高是 0
+                    info.update({'w': h, 'h': w} if a == 0 and b != 0 else {'w': w, 'h': h})  # 直拍影片以矩陣旋轉 90 度
+            if 'du' in info and 'w' in info: return info
+    return info
+
+def _probe_wav(f):
+    head = f.read(12)
+    if head[:4] != b'RIFF' or head[8:12] != b'WAVE': return {}
+    byte_rate = 0
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8: return {}
+        kind, size = struct.unpack('<4sI', chunk)
+        if kind == b'fmt ':
+            if size < 16: return {}  # fmt 至少 16 bytes；更小代表檔案損壞 (往回跳會無限迴圈)
+            byte_rate = struct.unpack('<8xI', f.read(12))[0]
+            f.seek(size - 12 + (size & 1), 1)
+        elif kind == b'data':
+            return {'du': round(size / byte_rate, 1)} if byte_rate else {}
+        else:
+            f.seek(size + (size & 1), 1)
+
+# --- 重複媒體 (v32.1: 內容雜湊) ---
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def replace_with_hardlink(src_path, dest_path):
+    """ 把 dest_path 換成指向 src_path 的硬連結；先建立暫存連結再 os.replace，失敗時原檔保持不變 """
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.nogk_link"  # 每個執行緒各自的名稱
+    try: os.remove(tmp_path)
+    except OSError: pass
+    os.link(src_path, tmp_path)
+    try:
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+
+# --- 訊息索引 (v31.9: SQLite) ---
+def message_sort_key(msg):
+    # 同一秒的訊息依 colmsg 檔名開頭的流水號排序 (資料夾列出的順序依系統而異)
+    head = msg['f'].split('_', 1)[0]
+    return msg['ts'], int(head) if head.isdigit() else -1, msg['f']
+
+class MessageIndex:
+    """ 群組的訊息索引 (.nogk_cache/messages.db)：每則訊息的時間、類型、檔名、大小、修改時間與文字
+        由資料夾掃描逐位成員增量更新，產生網頁與查詢都從這裡讀取，不必再碰檔案系統
+        可在多個執行緒間共用 (內部以 lock 排隊)；用完呼叫 close() 或以 with 使用 """
+    SCHEMA_VERSION = 4  # 2: 加上媒體的寬高與長度；3: 加上媒體內容雜湊 (找重複檔案用)；4: 記錄成員資料夾的修改時間
+    MIGRATIONS = {
+        # v1 沒有媒體資訊：加上欄位並刪除媒體的紀錄，下次掃描時只重新讀取媒體檔頭，文字訊息照常沿用
+        1: ("ALTER TABLE messages ADD COLUMN width INTEGER", "ALTER TABLE messages ADD COLUMN height INTEGER",
+            "ALTER TABLE messages ADD COLUMN duration REAL", "DELETE FROM messages WHERE type != '.txt'"),
+        2: ("ALTER TABLE messages ADD COLUMN hash TEXT",),
+        3: ("ALTER TABLE members ADD COLUMN dir_mtime_ns INTEGER",),
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS members (name TEXT PRIMARY KEY, scanned_ns INTEGER NOT NULL, dir_mtime_ns INTEGER);
+        CREATE TABLE IF NOT EXISTS messages (
+            member TEXT NOT NULL, file TEXT NOT NULL, ts TEXT NOT NULL, type TEXT NOT NULL,
+            size INTEGER, mtime_ns INTEGER, text TEXT NOT NULL DEFAULT '',
+            width INTEGER, height INTEGER, duration REAL, hash TEXT,
+            PRIMARY KEY (member, file)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS messages_ts ON messages (member, ts);
+    """
+
+    def __init__(self, group_folder_path):
+        self.path = os.path.join(group_folder_path, CACHE_DIR_NAME, INDEX_DB_NAME)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            self.conn = self._connect()
+        except sqlite3.OperationalError:
+            raise  # 資料庫被鎖定 (例如監看模式與介面同時更新同一個群組) 等暫時性錯誤：別的連線還在使用，不能刪除
+        except sqlite3.DatabaseError:
+            # 索引檔損毀或版本不符：內容都能從資料夾重建，直接換一個新的
+            for suffix in ("", "-journal"):
+                try: os.remove(self.path + suffix)
+                except OSError: pass
+            self.conn = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            row = conn.execute("SELECT value FROM meta WHERE key='schema'").fetchone() if self._has_table(conn, "meta") else None
+            version = self.SCHEMA_VERSION if row is None else int(row[0]) if row[0].isdigit() else 0
+            if version != self.SCHEMA_VERSION and version not in self.MIGRATIONS:
+                raise sqlite3.DatabaseError("schema version mismatch")
+            if version != self.SCHEMA_VERSION:
+                # 升級和新的版本號在同一個交易中完成，中途中斷時下次會從原本的版本重新升級
+                conn.execute("BEGIN")
+                with conn:
+                    for v in range(version, self.SCHEMA_VERSION):
+                        for sql in self.MIGRATIONS[v]: conn.execute(sql)
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(self.SCHEMA_VERSION),))
+            conn.executescript(self.SCHEMA)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(self.SCHEMA_VERSION),))
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def _has_table(conn, name):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+    def close(self):
+        with self.lock: self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_member(self, member):
+        """ 讀回掃描快取格式 {files, msgs}；沒有這位成員時回傳 None """
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM members WHERE name=?", (member,)).fetchone() is None: return None
+            rows = self.conn.execute("SELECT file, ts, type, size, mtime_ns, text, width, height, duration FROM messages WHERE member=?",
+                                     (member,)).fetchall()
+        # 讀取失敗的檔案沒有記錄大小，下次掃描時會重新讀取
+        files = {row[0]: [row[3], row[4]] for row in rows if row[3] is not None}
+        msgs = sorted((self._row_to_msg(row) for row in rows), key=message_sort_key)
+        return {'v': CACHE_VERSION, 'files': files, 'msgs': msgs}
+
+    @staticmethod
+    def _row_to_msg(row):
+        f, ts, t, _, _, c, w, h, du = row
+        msg = {'f': f, 't': t, 'ts': ts, 'c': c}
+        if w is not None: msg.update(w=w, h=h)
+        if du is not None: msg['du'] = du
+        return msg
+
+    def update_member(self, member, entry, previous=None):
+        """ 寫入一位成員的掃描結果；previous 為索引中原本的內容 (load_member)，
+            有的話只新增/更新變動的檔案並刪除已不存在的檔案，否則整位成員重寫
+            掃描時間要等網頁輸出檔換上之後才用 mark_scanned 記錄 """
+        files = entry['files']
+        old_files = previous['files'] if previous is not None else {}
+        rows = []
+        for m in entry['msgs']:
+            stat_key = files.get(m['f'])
+            if stat_key is not None and old_files.get(m['f']) == stat_key: continue
+            size, mtime = stat_key if stat_key is not None else (None, None)
+            rows.append((member, m['f'], m['ts'], m['t'], size, mtime, m['c'], m.get('w'), m.get('h'), m.get('du')))
+        with self.lock, self.conn:
+            if previous is None:
+                self.conn.execute("DELETE FROM messages WHERE member=?", (member,))
+            else:
+                current = {m['f'] for m in entry['msgs']}
+                self.conn.executemany("DELETE FROM messages WHERE member=? AND file=?",
+                                      ((member, m['f']) for m in previous['msgs'] if m['f'] not in current))
+            # 變動的檔案連同雜湊一起換掉 (hash 留空，找重複檔案時再重新計算)
+            self.conn.executemany("INSERT OR REPLACE INTO messages (member, file, ts, type, size, mtime_ns, text, width, height, duration) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def mark_scanned(self, scanned):
+        """ scanned: {成員: (掃描開始時間 ns, 掃描前資料夾的修改時間 ns 或 None)}
+            只在輸出檔換上之後呼叫：scanned_ns 代表網頁已經包含這個時間之前的檔案 (stale_members 依此判斷) """
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO members VALUES (?, ?, ?)",
+                                  ((member, scanned_ns, dir_mtime) for member, (scanned_ns, dir_mtime) in scanned.items()))
+
+    def prune_members(self, keep):
+        """ 刪除不在 keep 中的成員 (資料夾已刪除或已清空)，包含寫入訊息後還沒記錄掃描時間的成員 """
+        keep = set(keep)
+        with self.lock, self.conn:
+            gone = [m for (m,) in self.conn.execute("SELECT name FROM members UNION SELECT DISTINCT member FROM messages") if m not in keep]
+            for member in gone:
+                self.conn.execute("DELETE FROM messages WHERE member=?", (member,))
+                self.conn.execute("DELETE FROM members WHERE name=?", (member,))
+        return gone
+
+    def scanned_times(self):
+        """ {成員: 最後一次寫入索引的時間 (ns)} """
+        with self.lock:
+            return dict(self.conn.execute("SELECT name, scanned_ns FROM members"))
+
+    def dir_mtimes(self):
+        """ {成員: 上次掃描時資料夾的修改時間 (ns) 或 None}；資料夾時間相同代表沒有新增、刪除或改名的檔案 """
+        with self.lock:
+            return dict(self.conn.execute("SELECT name, dir_mtime_ns FROM members"))
+
+    # 查詢：month 為 "YYYY-MM" 或 "YYYYMM"
+    @staticmethod
+    def _month_range(month):
+        digits = month.replace("-", "").replace("/", "")
+        if len(digits) != 6 or not digits.isdigit(): raise ValueError(f"月份格式應為 YYYY-MM: {month}")
+        year, mon = int(digits[:4]), int(digits[4:])
+        if not 1 <= mon <= 12: raise ValueError(f"月份格式應為 YYYY-MM: {month}")
+        return digits, f"{year + mon // 12:04d}{mon % 12 + 1:02d}"
+
+    def members(self):
+        """ [(成員, 訊息數)]，依名稱排序 """
+        with self.lock:
+            return self.conn.execute("SELECT m.name, COUNT(g.file) FROM members m LEFT JOIN messages g ON g.member = m.name "
+                                     "GROUP BY m.name ORDER BY m.name").fetchall()
+
+    def messages(self, member, month=None, types=None):
+        """ 某位成員 (某個月份) 的訊息，依時間排序；types 可限制副檔名，例如 ('.txt',) """
+        sql = "SELECT file, ts, type, size, text, width, height, duration FROM messages WHERE member=?"
+        params = [member]
+        if month:
+            sql += " AND ts >= ? AND ts < ?"
+            params.extend(self._month_range(month))
+        if types:
+            sql += f" AND type IN ({','.join('?' * len(types))})"
+            params.extend(types)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        msgs = [{'f': f, 'ts': ts, 't': t, 'size': size, 'c': c, 'w': w, 'h': h, 'du': du} for f, ts, t, size, c, w, h, du in rows]
+        return sorted(msgs, key=message_sort_key)
+
+    def month_counts(self, member=None):
+        """ {"YYYY-MM": 訊息數}；未指定成員時統計整個群組 """
+        sql = "SELECT substr(ts, 1, 6) AS ym, COUNT(*) FROM messages"
+        params = ()
+        if member is not None:
+            sql += " WHERE member=?"
+            params = (member,)
+        with self.lock:
+            rows = self.conn.execute(sql + " GROUP BY ym ORDER BY ym", params).fetchall()
+        return {f"{ym[:4]}-{ym[4:]}": n for ym, n in rows}
+
+    def media_candidates(self):
+        """ 和其他同類型媒體檔大小相同 (可能重複) 的媒體 [(成員, 檔名, 類型, 大小, 修改時間, 雜湊或 None)]，依類型、大小、時間排序 """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT member, file, type, size, mtime_ns, hash FROM messages WHERE type != '.txt' AND (type, size) IN "
+                "(SELECT type, size FROM messages WHERE type != '.txt' AND size > 0 GROUP BY type, size HAVING COUNT(*) > 1) "
+                "ORDER BY type, size, ts, member, file").fetchall()
+
+    def set_hashes(self, rows):
+        """ rows: [(雜湊, 成員, 檔名, 大小, 修改時間)]；計算期間檔案又被重新掃描 (大小或時間不同) 時不寫入 """
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE messages SET hash=? WHERE member=? AND file=? AND size=? AND mtime_ns=?", rows)
+
+    def set_mtimes(self, rows):
+        """ rows: [(修改時間, 成員, 檔名)]；檔案換成硬連結後修改時間會變，記下新的時間以免下次掃描重新讀取 """
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE messages SET mtime_ns=? WHERE member=? AND file=?", rows)
+
+class ChatGenerator:
+    valid_exts = {'.txt', '.jpg', '.jpeg', '.png', '.mp4', '.m4a', '.mp3', '.wav'}
+    time_pattern = re.compile(r'(\d{14})')
+
+    def __init__(self, max_workers=None):
+        # max_workers: 同時掃描的成員數上限 (None = 依 CPU 數自動決定，1 = 單執行緒)
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.last_stats = {}  # 最近一次生成的統計 (讀取/沿用檔案數)
+        self.last_profile = None  # 最近一次生成的 GenerationProfile (各階段耗時)
+        self.last_error = None  # 最近一次生成失敗時的例外 (監看模式用來判斷是否值得重試)
+
+    def _candidate_members(self, group_folder_path):
+        # scandir 的 DirEntry 會快取檔案類型，不需要再對每個項目呼叫 isdir
+        with os.scandir(group_folder_path) as it:
+            return sorted(e.name for e in it if e.is_dir() and e.name not in RESERVED_DIRS and not e.name.startswith('.'))
+
+    def list_members(self, group_folder_path):
+        """ 列出群組資料夾中有內容的成員資料夾 (略過 avatars、data 與隱藏資料夾) """
+        members = []
+        for member in self._candidate_members(group_folder_path):
+            with os.scandir(os.path.join(group_folder_path, member)) as it:
+                if next(it, None) is not None:
+                    members.append(member)
+        return members
+
+    def generate_single_index(self, group_folder_path, nickname="", avatar_map=None, force_rebuild=False, layout="inline", thumbnails=False, search=False,
+                              progress_callback=None, cancel_event=None, profile=False, cprofile=False, only_members=None, precompress=False,
+                              media_lookahead=MEDIA_LOOKAHEAD, dedup=False, quick_scan=False):
+        # quick_scan: 資料夾修改時間和上次掃描時相同的成員不逐一檢查檔案 (網路磁碟上較快；就地修改檔案內容時不會發現，需要 force_rebuild)
+        # dedup: 找出內容相同的媒體，網頁中都改用同一份檔案 (見 dedup_media)
+        # media_lookahead: 網頁中媒體距離畫面多少 px 內才載入 (越大捲動時越不容易看到空白，但同時載入的檔案越多)
+        # precompress: 另外產生 .gz 壓縮檔，供 serve (本機伺服器) 直接送出
+        # only_members: 只重新掃描這些成員；其他成員直接沿用快取 (split 模式且沒有搜尋索引時連資料檔都不重寫)
+        # profile: 另外把各階段耗時與每位成員的讀寫量寫到 .nogk_cache/profile.json (摘要一律記在 last_profile)
+        # cprofile: 以 cProfile 包住整次生成並存成 .nogk_cache/profile.pstats；為了讓統計涵蓋掃描，會改成單執行緒掃描
+        self.last_profile = prof = GenerationProfile()
+        self.last_error = None
+        profile_dir = os.path.join(group_folder_path, CACHE_DIR_NAME)
+        args = (group_folder_path, nickname, avatar_map, force_rebuild, layout, thumbnails, search, progress_callback, cancel_event, prof,
+                None if only_members is None else set(only_members), precompress, max(0, int(media_lookahead)), dedup, quick_scan)
+        start = time.perf_counter()
+        if cprofile and os.path.isdir(group_folder_path):
+            import cProfile
+            profiler = cProfile.Profile()
+            max_workers, self.max_workers = self.max_workers, 1
+            try:
+                success, result = profiler.runcall(self._generate_single_index, *args)
+            finally:
+                self.max_workers = max_workers
+                prof.total = time.perf_counter() - start
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, PROFILE_STATS_NAME))
+        else:
+            success, result = self._generate_single_index(*args)
+            prof.total = time.perf_counter() - start
+        if profile and success:
+            try: prof.dump(os.path.join(profile_dir, PROFILE_JSON_NAME))
+            except OSError as e: self.last_stats.setdefault('warnings', []).append(f"寫入效能分析失敗: {e}")
+        return success, result
+
+    def _generate_single_index(self, group_folder_path, *args, **kwargs):
+        # 同一個群組同時只能有一個程序寫入 (暫存檔、訊息索引、換上輸出檔)；忙碌時直接回報，由呼叫端決定是否重試
+        if not os.path.isdir(group_folder_path): return False, "找不到資料夾"
+        try:
+            with group_lock(group_folder_path):
+                return self._generate_locked(group_folder_path, *args, **kwargs)
+        except GenerationBusy as e:
+            self.last_error = e
+            return False, str(e)
+
+    def _generate_locked(self, group_folder_path, nickname, avatar_map, force_rebuild, layout, thumbnails, search, progress_callback, cancel_event, prof,
+                               only_members=None, precompress=False, media_lookahead=MEDIA_LOOKAHEAD, dedup=False, quick_scan=False):
+        # layout: "inline" = 全部訊息內嵌在 index.html；"split" = 每位成員一個 data/*.js，點選時才載入
+        # thumbnails: 先產生圖片縮圖，聊天畫面顯示縮圖，點開燈箱才載入原圖
+        # search: 建立全文搜尋索引 (search/*.js)，網頁上方會出現搜尋框
+        # progress_callback(已完成, 總數, 成員): 每處理完一位成員呼叫一次 (在工作執行緒中呼叫)
+        # cancel_event: threading.Event，設定後中止生成，所有輸出檔維持原狀
+        if avatar_map is None: avatar_map = {}
+        if not os.path.exists(group_folder_path): return False, "找不到資料夾"
+
+        legacy_dir = os.path.join(group_folder_path, CACHE_DIR_NAME, LEGACY_CACHE_DIR)
+        with prof.phase('list'):
+            candidates = self._candidate_members(group_folder_path)
+        self.last_stats = {'members': 0, 'parsed': 0, 'reused': 0, 'cached_members': 0}
+        if thumbnails:
+            thumb_members = candidates if only_members is None else [m for m in candidates if m in only_members]
+            with prof.phase('thumbnails'):
+                ok, result = self.generate_thumbnails(group_folder_path, thumb_members, cancel_event=cancel_event,
+                                                      quick=quick_scan and not force_rebuild)
+            self.last_stats['thumbs'] = result
+            thumbnails = ok  # 沒有 Pillow 時照常產生網頁，只是不使用縮圖
+        if cancel_event is not None and cancel_event.is_set():
+            return False, "已取消，原本的網頁檔案未變更"
+
+        data_dir = os.path.join(group_folder_path, DATA_DIR_NAME)
+        old_manifest = {}
+        if layout == "split" and not force_rebuild:
+            old_manifest = self._read_js_value(os.path.join(data_dir, "manifest.js"), "window.nogkManifest = ") or {}
+        keep_shard = object()
+        scanned = {}  # {成員: (掃描開始時間, 資料夾修改時間)}，輸出檔換上後才寫進索引
+
+        def scan(member):
+            member_path = os.path.join(group_folder_path, member)
+            # 上次輸出之後資料夾又有變動 (例如上次更新失敗或被取消) 的成員，即使不在 only_members 中也照常掃描
+            if only_members is not None and member not in only_members and not self._changed_since(member_path, scanned_times.get(member)):
+                # 沒有變動的成員：不掃描資料夾，直接沿用上次的資料檔或索引
+                if not search and 'mo' in old_manifest.get(member, {}): return keep_shard
+                with prof.phase('cache_load'):
+                    cached = self._load_member_cache(index, legacy_dir, member, prof)
+                if cached is not None and not cached.get('legacy'):
+                    return cached, 0, len(cached['files']), True
+            scan_start = time.time_ns()
+            dir_mtime = self._stable_dir_mtime(member_path)
+            if quick_scan and not force_rebuild and dir_mtime is not None and dir_mtimes.get(member) == dir_mtime:
+                # 資料夾沒有新增、刪除或改名的檔案：不列出、不 stat 每個檔案，直接沿用索引
+                with prof.phase('cache_load'):
+                    cached = index.load_member(member)
+                if cached is not None:
+                    prof.add_member(member, cache_rows=len(cached['msgs']))
+                    return cached, 0, len(cached['files']), True
+            cached = None
+            if not force_rebuild:
+                with prof.phase('cache_load'):
+                    cached = self._load_member_cache(index, legacy_dir, member, prof)
+            previous = None if cached is None or cached.get('legacy') else cached  # 舊版快取要整位成員寫進索引
+            result = self._scan_member(member_path, cached, prof)
+            if result is None: return None
+            if result[0] is not previous:
+                with prof.phase('cache_save'):
+                    index.update_member(member, result[0], previous)
+            scanned[member] = (scan_start, dir_mtime)
+            return result + (result[0] is cached,)
+
+        # 逐位成員串流寫入：掃描結果寫出後就釋放，記憶體只保留少數成員的訊息
+        json_avatars = json.dumps(avatar_map, ensure_ascii=False)
+        output_path = os.path.join(group_folder_path, "index.html")
+        with prof.phase('template'):
+            prefix, suffix = self._get_html_template(DATA_PLACEHOLDER, json_avatars, layout, search, media_lookahead, dedup).split(DATA_PLACEHOLDER, 1)
+        members = []
+        manifest = {}
+        search_builder = SearchIndexBuilder() if search else None
+        pending = PendingWrites()  # 所有輸出檔最後才一起換上，取消或失敗時保留上一版
+        try:
+            index = MessageIndex(group_folder_path)
+            dir_mtimes = index.dir_mtimes()
+            scanned_times = index.scanned_times()
+        except (OSError, sqlite3.Error) as e:
+            self.last_error = e
+            return False, f"無法開啟訊息索引: {e}"
+        try:
+            with pending.open(output_path) as out:
+                out.write(prefix)
+                out.write("{}" if layout == "split" else "{")
+                if layout == "split": os.makedirs(data_dir, exist_ok=True)
+                for done, (member, result) in enumerate(zip(candidates, prof.iter_timed('scan_wait', self._iter_members(scan, candidates))), 1):
+                    if cancel_event is not None and cancel_event.is_set(): raise GenerationCancelled()
+                    if progress_callback: progress_callback(done, len(candidates), member)
+                    if result is None: continue  # 空資料夾不算成員
+                    if result is keep_shard:
+                        manifest[member] = old_manifest[member]
+                        base = self._shard_name(member)
+                        for ym, _, _ in manifest[member]['mo']:
+                            try: prof.add_member(member, output_bytes=os.path.getsize(os.path.join(data_dir, f"{base}_{ym}.js")))
+                            except OSError: pass
+                        members.append(member)
+                        self.last_stats['members'] += 1
+                        self.last_stats['cached_members'] += 1
+                        continue
+                    entry, parsed, reused, unchanged = result
+                    msgs = self._apply_nickname(entry['msgs'], nickname)
+                    if thumbnails: msgs = self._apply_thumbs(msgs, self._existing_thumbs(group_folder_path, member))
+                    if layout == "split":
+                        manifest[member] = self._write_member_shard(data_dir, member, msgs, pending, old_manifest.get(member), prof)
+                    else:
+                        if members: out.write(", ")
+                        out.write(json.dumps(member, ensure_ascii=False) + ": ")
+                        written = 0
+                        for chunk in prof.iter_timed('serialize', self._iter_packed_json(msgs, months=True)):
+                            with prof.phase('write'): out.write(chunk)
+                            written += len(chunk.encode('utf-8'))
+                        prof.add_member(member, output_bytes=written)
+                    if search_builder:
+                        with prof.phase('search_index'): search_builder.add_member(member, msgs)
+                    members.append(member)
+                    self.last_stats['members'] += 1
+                    self.last_stats['parsed'] += parsed
+                    self.last_stats['reused'] += reused
+                    self.last_stats['cached_members'] += unchanged
+                    del entry, msgs
+
+                if not members: raise ValueError("找不到成員資料夾")  # 中止寫入，保留原本的 index.html
+                self._write_avatar_sidecar(group_folder_path, avatar_map, pending)
+                if layout == "split": self._write_shard_manifest(data_dir, manifest, pending)
+                else: out.write("}")
+                out.write(suffix)
+                if search_builder:
+                    with prof.phase('search_write'):
+                        self.last_stats['search'] = search_builder.write(os.path.join(group_folder_path, SEARCH_DIR_NAME), pending)
+            # 輸出大小在換上檔案前算好：換上之後再失敗，呼叫端會誤以為網頁沒有更新
+            prof.output_bytes['index.html'] = pending.written_size(output_path)
+            if layout == "split": prof.output_bytes[DATA_DIR_NAME] = sum(prof.members.get(m, {}).get('output_bytes', 0) for m in members)
+            if search_builder: prof.output_bytes[SEARCH_DIR_NAME] = self.last_stats['search']['bytes']
+            with prof.phase('commit'):
+                pending.commit()
+                if layout == "split": self._prune_shards(data_dir, manifest)
+                index.mark_scanned(scanned)
+                index.prune_members(members)
+                if os.path.isdir(legacy_dir): self._prune_legacy_cache(legacy_dir, set(members) - set(index.scanned_times()))
+            alias_path = os.path.join(data_dir, MEDIA_ALIAS_NAME)
+            if dedup:
+                with prof.phase('dedup'):
+                    ok, result = self._dedup_media(group_folder_path, write_alias=True, cancel_event=cancel_event)
+                self.last_stats['dedup'] = result
+                if not ok: self._write_media_alias(group_folder_path, {})  # 網頁照常使用各自的檔案
+            elif os.path.exists(alias_path):
+                try: os.remove(alias_path)
+                except OSError: pass
+            if precompress:
+                with prof.phase('precompress'):
+                    self.last_stats['precompress'] = self.precompress_outputs(group_folder_path)
+            self._save_generation_settings(group_folder_path, {'nickname': nickname, 'layout': layout, 'thumbnails': thumbnails, 'search': search,
+                                                               'precompress': precompress, 'media_lookahead': media_lookahead, 'dedup': dedup, 'quick_scan': quick_scan,
+                                                               'format': DATA_FORMAT})
+            return True, output_path
+        except GenerationCancelled:
+            pending.discard()
+            return False, "已取消，原本的網頁檔案未變更"
+        except Exception as e:
+            pending.discard()
+            self.last_error = e
+            return False, str(e)
+        finally:
+            index.close()
+
+    def _prune_legacy_cache(self, legacy_dir, keep):
+        # 舊版 JSON 快取只留下還沒轉進訊息索引的成員 (沿用資料檔而沒有掃描的成員，等下次掃描時才轉)，全部轉完後刪除資料夾
+        for name in os.listdir(legacy_dir):
+            if not (name.endswith(".json") and name[:-5] in keep):
+                try: os.remove(os.path.join(legacy_dir, name))
+                except OSError: pass
+        try: os.rmdir(legacy_dir)
+        except OSError: pass
+
+    def _month_index(self, msgs):
+        """ 每月訊息數 [[YYYYMM, 筆數], ...]，依時間排序 (msgs 已依時間排序) """
+        months = []
+        for ym, group in itertools.groupby(msgs, key=lambda m: m['ts'][:6]):
+            months.append([ym, sum(1 for _ in group)])
+        return months
+
+    def _pack_member(self, msgs, months=False):
+        """ 精簡格式：各欄位分開存成平行陣列；副檔名 (t) 由檔名推得，日期 (d)、時間 (hm) 由網頁從 ts 格式化
+            months: 另外附上月份索引 (mo)，網頁建立年月選單時不必掃描每則訊息 """
+        packed = {'f': [m['f'] for m in msgs], 'ts': [int(m['ts']) for m in msgs], 'c': [m['c'] for m in msgs]}
+        th = [i for i, m in enumerate(msgs) if m.get('th')]
+        if th: packed['th'] = th
+        # 媒體資訊只有少數訊息有，以 [序號, 寬, 高, ...] / [序號, 秒數, ...] 攤平存放
+        dim = [v for i, m in enumerate(msgs) if m.get('w') for v in (i, m['w'], m['h'])]
+        if dim: packed['dim'] = dim
+        du = [v for i, m in enumerate(msgs) if m.get('du') is not None for v in (i, m['du'])]
+        if du: packed['du'] = du
+        if months: packed['mo'] = self._month_index(msgs)
+        return packed
+
+    def _iter_packed_json(self, msgs, batch_size=2000, months=False):
+        # 分批序列化每個欄位，避免一次產生整個成員的 JSON 字串
+        yield "{"
+        for n, (key, values) in enumerate(self._pack_member(msgs, months).items()):
+            yield ("," if n else "") + f'"{key}":['
+            for i in range(0, len(values), batch_size):
+                if i: yield ","
+                yield json.dumps(values[i:i + batch_size], ensure_ascii=False, separators=(',', ':'))[1:-1]
+            yield "]"
+        yield "}"
+
+    def _shard_name(self, member):
+        # 成員名稱可能含有網址不安全的字元，用雜湊命名讓檔名固定又安全；各月份的資料檔為 <前綴>_YYYYMM.js
+        return "m_" + hashlib.sha1(member.encode('utf-8')).hexdigest()[:12]
+
+    def _write_member_shard(self, data_dir, member, msgs, pending, old_entry=None, prof=None):
+        """ split 模式: 每個月一個 data/m_xxx_YYYYMM.js，以 JSONP 形式呼叫 nogkMonth()，file:// 也能用 <script> 載入
+            網頁只載入正在看的月份與前後月份；內容與上次相同的月份 (old_entry 中的雜湊相同) 不重寫 """
+        prof = prof or GenerationProfile()
+        base = self._shard_name(member)
+        old_hashes = {ym: v for ym, _, v in (old_entry or {}).get('mo', [])}
+        name_json = json.dumps(member, ensure_ascii=False)
+        months = []
+        size = start = 0
+        for ym, count in self._month_index(msgs):
+            with prof.phase('serialize'):
+                content = f'nogkMonth({name_json}, "{ym}", {"".join(self._iter_packed_json(msgs[start:start + count]))});\n'
+                data = content.encode('utf-8')
+                v = hashlib.sha1(data).hexdigest()[:8]
+            path = os.path.join(data_dir, f"{base}_{ym}.js")
+            if old_hashes.get(ym) != v or not os.path.exists(path):
+                with prof.phase('write'), pending.open(path) as f:
+                    f.write(content)
+            months.append([ym, count, v])
+            size += len(data)
+            start += count
+        prof.add_member(member, output_bytes=size)
+        return {'n': len(msgs), 'src': f"{DATA_DIR_NAME}/{base}", 'mo': months}
+
+    def _write_shard_manifest(self, data_dir, manifest, pending):
+        """ data/manifest.js 記錄成員名稱、訊息數、資料檔前綴與月份索引 [[YYYYMM, 筆數, 雜湊], ...] """
+        with pending.open(os.path.join(data_dir, "manifest.js")) as f:
+            f.write(f"window.nogkManifest = {json.dumps(manifest, ensure_ascii=False)};\n")
+
+    def _prune_shards(self, data_dir, manifest):
+        # 清除已不存在的成員與月份 (以及舊版每位成員一個檔案) 的資料檔
+        keep = {f"{self._shard_name(m)}_{ym}.js" for m, entry in manifest.items() for ym, _, _ in entry['mo']}
+        for name in os.listdir(data_dir):
+            base = name[:-3] if name.endswith(".gz") else name  # 壓縮檔跟著原檔
+            if base not in keep and base.startswith("m_"):
+                try: os.remove(os.path.join(data_dir, name))
+                except OSError: pass
+
+    def precompress_outputs(self, group_folder_path):
+        """ 為 index.html、data/、search/ 與頭像設定產生 gzip 壓縮檔 (xxx.gz)；比原檔新的壓縮檔直接略過
+            回傳 {'files', 'compressed', 'bytes_in', 'bytes_out'} """
+        paths = [os.path.join(group_folder_path, "index.html"), os.path.join(group_folder_path, AVATAR_DIR_NAME, AVATAR_MAP_NAME)]
+        for sub in (DATA_DIR_NAME, SEARCH_DIR_NAME):
+            sub_dir = os.path.join(group_folder_path, sub)
+            if not os.path.isdir(sub_dir): continue
+            with os.scandir(sub_dir) as it:
+                for e in it:
+                    if e.name.endswith(".gz") and not os.path.exists(e.path[:-3]):
+                        try: os.remove(e.path)  # 原檔已刪除
+                        except OSError: pass
+                    elif e.name.endswith(".js"):
+                        paths.append(e.path)
+        stats = {'files': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+        def compress(path):
+            try:
+                src_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+            try:
+                if os.stat(path + ".gz").st_mtime_ns >= src_mtime: return False
+            except OSError:
+                pass
+            # mtime=0 讓相同內容產生相同的壓縮檔
+            with open(path, 'rb') as src, atomic_write(path + ".gz", mode='wb') as dst:
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, 1 << 20)
+            return True
+
+        # zlib 壓縮時會釋放 GIL，多執行緒就能同時使用多核心
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for path, done in zip(paths, pool.map(compress, paths)):
+                if done is None: continue
+                stats['files'] += 1
+                if done: stats['compressed'] += 1
+                stats['bytes_in'] += os.path.getsize(path)
+                stats['bytes_out'] += os.path.getsize(path + ".gz")
+        return stats
+
+    def _iter_members(self, func, members):
+        # 依成員平行掃描，結果維持原本的成員順序；最多只預先掃描 2 倍 max_workers 位成員，限制記憶體用量
+        if self.max_workers <= 1 or len(members) <= 1:
+            yield from map(func, members)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = deque()
+            try:
+                for member in members:
+                    pending.append(pool.submit(func, member))
+                    if len(pending) >= self.max_workers * 2:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending: future.cancel()  # 取消或出錯時不再掃描剩下的成員
+
+    def _scan_member(self, member_path, cached, prof=None):
+        """ 掃描單一成員資料夾；檔名、大小、修改時間都沒變的訊息直接沿用快取
+            回傳 (快取項目, 讀取檔案數, 沿用檔案數)，資料夾為空時回傳 None """
+        prof = prof or GenerationProfile()
+        member = os.path.basename(member_path)
+        files = {}
+        has_entries = False
+        with prof.phase('scandir'), os.scandir(member_path) as it:
+            for entry in it:
+                has_entries = True
+                ext = os.path.splitext(entry.name)[1].lower()
+                if ext in self.valid_exts and entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = [st.st_size, st.st_mtime_ns]
+        if not has_entries: return None
+        prof.add_member(member, files=len(files))
+
+        if cached is not None and cached['files'] == files:
+            return cached, 0, len(files)  # 整個成員沒有變動，訊息列表原封不動沿用
+
+        old_files = cached['files'] if cached else {}
+        old_msgs = {m['f']: m for m in cached['msgs']} if cached else {}
+        member_msgs = []
+        parsed = reused = files_read = bytes_read = media_probed = 0
+        with prof.phase('read'):
+            for f, stat_key in list(files.items()):
+                if old_files.get(f) == stat_key and f in old_msgs:
+                    member_msgs.append(old_msgs[f])
+                    reused += 1
+                    continue
+                msg_obj, ok = self._parse_file(member_path, f)
+                if not ok: del files[f]  # 讀取失敗的檔案不記錄，下次重新讀取
+                if msg_obj['t'] == '.txt':
+                    files_read += 1
+                    bytes_read += stat_key[0]
+                elif msg_obj['t'] in MEDIA_EXTS:  # 媒體檔只讀檔頭
+                    media_probed += 1
+                member_msgs.append(msg_obj)
+                parsed += 1
+        prof.add_member(member, files_read=files_read, bytes_read=bytes_read, media_probed=media_probed)
+        with prof.phase('sort'):
+            member_msgs.sort(key=message_sort_key)
+        return {'v': CACHE_VERSION, 'files': files, 'msgs': member_msgs}, parsed, reused
+
+    @staticmethod
+    def _changed_since(member_path, scanned_ns):
+        # 和 stale_members 相同的判斷：資料夾在上次寫入網頁的掃描之後又有變動
+        try:
+            return scanned_ns is None or os.stat(member_path).st_mtime_ns > scanned_ns
+        except OSError:
+            return True
+
+    def _stable_dir_mtime(self, member_path):
+        # 掃描前資料夾的修改時間；剛變動過的不記錄 (時間精度粗的檔案系統上，掃描期間新增的檔案可能不會再改變資料夾時間)
+        try:
+            mtime = os.stat(member_path).st_mtime_ns
+        except OSError:
+            return None
+        return mtime if time.time_ns() - mtime > DIR_MTIME_SETTLE_NS else None
+
+    def _parse_file(self, member_path, f):
+        ext = os.path.splitext(f)[1].lower()
+        match = self.time_pattern.search(f)
+        timestamp_str = match.group(1) if match else "00000000000000"
+        msg_obj = {'f': f, 't': ext, 'ts': timestamp_str, 'd': self._format_date(timestamp_str), 'hm': self._format_time(timestamp_str), 'c': ''}
+        if ext == '.txt':
+            try:
+                with open(os.path.join(member_path, f), 'r', encoding='utf-8') as tf:
+                    msg_obj['c'] = tf.read()
+            except:
+                msg_obj['c'] = "(Error)"
+                return msg_obj, False
+        elif ext in MEDIA_EXTS:
+            msg_obj.update(probe_media(os.path.join(member_path, f)))  # 寬高 (w, h) 與長度 (du)，網頁不必等載入就能排版
+        return msg_obj, True
+
+    def generate_thumbnails(self, group_folder_path, members=None, size=THUMB_SIZE, cancel_event=None, quick=False):
+        """ 以多行程為圖片產生縮圖到 thumbs/<成員>/，比原圖新的縮圖直接略過
+            quick: 成員資料夾的修改時間和上次縮圖全部完成時相同就不列出檔案 (和 quick_scan 相同的判斷)
+            回傳 (成功與否, 統計 dict 或錯誤訊息)；失敗的檔案與原因記在統計的 errors """
+        try:
+            import PIL
+        except ImportError:
+            return False, "需要安裝 Pillow 才能產生縮圖 (pip install Pillow)"
+        if members is None: members = self.list_members(group_folder_path)
+
+        stats = {'images': 0, 'made': 0, 'skipped': 0, 'failed': 0, 'removed': 0, 'unchanged_members': 0, 'errors': []}
+        state_path = os.path.join(group_folder_path, CACHE_DIR_NAME, THUMB_STATE_NAME)
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                done_mtimes = json.load(f)
+        except (OSError, ValueError):
+            done_mtimes = {}
+        if not os.path.isdir(os.path.join(group_folder_path, THUMB_DIR_NAME)): done_mtimes = {}  # 縮圖資料夾被刪除：全部重新檢查
+        jobs = []
+        scanned = {}  # 這次列出的成員 {成員: 列出前資料夾的修改時間}
+        for member in members:
+            src_dir = os.path.join(group_folder_path, member)
+            dest_dir = os.path.join(group_folder_path, THUMB_DIR_NAME, member)
+            dir_mtime = self._stable_dir_mtime(src_dir)
+            if quick and dir_mtime is not None and done_mtimes.get(member) == dir_mtime:
+                stats['unchanged_members'] += 1
+                continue
+            scanned[member] = dir_mtime
+            existing = {}
+            if os.path.isdir(dest_dir):
+                with os.scandir(dest_dir) as it:
+                    existing = {e.name: e.stat().st_mtime_ns for e in it if e.name.endswith(".jpg")}
+            wanted = set()
+            with os.scandir(src_dir) as it:
+                for e in it:
+                    if os.path.splitext(e.name)[1].lower() not in THUMB_EXTS or not e.is_file(): continue
+                    thumb_name = e.name + ".jpg"
+                    wanted.add(thumb_name)
+                    stats['images'] += 1
+                    if existing.get(thumb_name, -1) >= e.stat().st_mtime_ns:
+                        stats['skipped'] += 1
+                    else:
+                        jobs.append((member, e.path, os.path.join(dest_dir, thumb_name)))
+            for name in existing.keys() - wanted:  # 原圖已刪除的縮圖
+                try:
+                    os.remove(os.path.join(dest_dir, name))
+                    stats['removed'] += 1
+                except OSError: pass
+            if wanted: os.makedirs(dest_dir, exist_ok=True)
+
+        if jobs:
+            # 縮圖是 CPU 密集工作，用多行程才能同時使用多核心
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, os.cpu_count() or 1)) as pool:
+                job_members, srcs, dests = zip(*jobs)
+                for member, err in zip(job_members, pool.map(make_thumbnail, srcs, dests, itertools.repeat(size), chunksize=16)):
+                    if cancel_event is not None and cancel_event.is_set():
+                        pool.shutdown(cancel_futures=True)
+                        return False, "已取消"
+                    if err is None: stats['made'] += 1
+                    else:
+                        stats['failed'] += 1
+                        stats['errors'].append(err)
+                        scanned[member] = None  # 有失敗的檔案：下次仍要列出這位成員重試
+        # 只記錄全部完成的成員；剛修改過的資料夾 (None) 不記錄
+        new_mtimes = dict(done_mtimes)
+        for member, dir_mtime in scanned.items():
+            if dir_mtime is None: new_mtimes.pop(member, None)
+            else: new_mtimes[member] = dir_mtime
+        if new_mtimes != done_mtimes:
+            try:
+                os.makedirs(os.path.dirname(state_path), exist_ok=True)
+                with atomic_write(state_path) as f:
+                    json.dump(new_mtimes, f, ensure_ascii=False)
+            except OSError:
+                pass  # 只是少了略過的依據，下次會重新列出
+        return True, stats
+
+    def dedup_media(self, group_folder_path, link=False, write_alias=False, cancel_event=None):
+        """ 找出內容相同的媒體檔 (同一張圖片傳給多位成員、colmsg 重新下載)：只為大小和其他檔案相同的媒體計算雜湊，
+            雜湊記在訊息索引中，之後只算新的或變動的檔案；需要先產生過一次網頁
+            link: 把重複的檔案換成指向最早那一份的硬連結，節省磁碟空間
+            write_alias: 寫出 data/media_alias.js，網頁中重複的媒體都改用最早那一份的路徑，瀏覽器只需下載、快取一次
+            回傳 (成功與否, 統計 dict 或錯誤訊息)；無法建立硬連結的檔案與原因記在統計的 errors """
+        if not os.path.exists(os.path.join(group_folder_path, CACHE_DIR_NAME, INDEX_DB_NAME)):
+            return False, "找不到訊息索引，請先產生一次網頁"
+        try:
+            with group_lock(group_folder_path):
+                return self._dedup_media(group_folder_path, link, write_alias, cancel_event)
+        except GenerationBusy as e:
+            return False, str(e)
+
+    def _dedup_media(self, group_folder_path, link=False, write_alias=False, cancel_event=None):
+        # 產生網頁時已經持有群組的鎖，直接呼叫這裡
+        stats = {'candidates': 0, 'hashed': 0, 'groups': 0, 'duplicates': 0, 'duplicate_bytes': 0,
+                 'linked': 0, 'already_linked': 0, 'failed': 0, 'errors': []}
+
+        def hash_one(row):
+            member, f, _, size, mtime, _ = row
+            path = os.path.join(group_folder_path, member, f)
+            try:
+                st = os.stat(path)
+                if st.st_size != size or st.st_mtime_ns != mtime: return None  # 索引之後又變動過，下次產生網頁後再算
+                return file_sha256(path)
+            except OSError:
+                return None
+
+        try:
+            with MessageIndex(group_folder_path) as index:
+                rows = index.media_candidates()
+                stats['candidates'] = len(rows)
+                todo = [row for row in rows if row[5] is None]
+                if todo:
+                    hashed = []
+                    with ThreadPoolExecutor(max_workers=min(self.max_workers, 8)) as pool:
+                        for row, digest in zip(todo, pool.map(hash_one, todo)):
+                            if cancel_event is not None and cancel_event.is_set():
+                                pool.shutdown(cancel_futures=True)
+                                break
+                            if digest is not None: hashed.append((digest,) + row[:2] + row[3:5])
+                    index.set_hashes(hashed)  # 取消時也保留已算好的雜湊
+                    stats['hashed'] = len(hashed)
+                    if cancel_event is not None and cancel_event.is_set(): return False, "已取消"
+                    rows = index.media_candidates()
+
+                groups = {}
+                for member, f, ext, size, mtime, digest in rows:
+                    # 類型也要相同：網頁依副檔名決定以圖片、影片或語音顯示
+                    if digest is not None: groups.setdefault((ext, size, digest), []).append((member, f, mtime))
+                alias = {}
+                relinked = []
+                for (_, size, _), files in groups.items():
+                    if len(files) < 2: continue
+                    stats['groups'] += 1
+                    (canon_member, canon_file, canon_mtime), dups = files[0], files[1:]  # 最早的一則訊息為正本
+                    canon_path = os.path.join(group_folder_path, canon_member, canon_file)
+                    try:
+                        canon_st = os.stat(canon_path)
+                    except OSError:
+                        continue
+                    if canon_st.st_size != size or canon_st.st_mtime_ns != canon_mtime: continue  # 正本已變動，等下次重新計算
+                    for member, f, mtime in dups:
+                        path = os.path.join(group_folder_path, member, f)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        if st.st_size != size or st.st_mtime_ns != mtime: continue
+                        alias[f"{member}/{f}"] = f"{canon_member}/{canon_file}"
+                        stats['duplicates'] += 1
+                        if (st.st_dev, st.st_ino) == (canon_st.st_dev, canon_st.st_ino):
+                            stats['already_linked'] += 1
+                            continue
+                        stats['duplicate_bytes'] += size
+                        if not link: continue
+                        try:
+                            replace_with_hardlink(canon_path, path)
+                        except OSError as e:
+                            stats['failed'] += 1  # 不同磁碟或檔案系統不支援硬連結
+                            stats['errors'].append(f"{member}/{f}: {e}")
+                            continue
+                        stats['linked'] += 1
+                        relinked.append((canon_st.st_mtime_ns, member, f))
+                index.set_mtimes(relinked)
+        except (OSError, sqlite3.Error) as e:
+            return False, f"無法讀取訊息索引: {e}"
+        if write_alias: self._write_media_alias(group_folder_path, alias)
+        return True, stats
+
+    def _write_media_alias(self, group_folder_path, alias):
+        data_dir = os.path.join(group_folder_path, DATA_DIR_NAME)
+        os.makedirs(data_dir, exist_ok=True)
+        with atomic_write(os.path.join(data_dir, MEDIA_ALIAS_NAME)) as f:
+            f.write(f"window.nogkMediaAlias = {json.dumps(alias, ensure_ascii=False)};\n")
+
+    def _existing_thumbs(self, group_folder_path, member):
+        thumb_dir = os.path.join(group_folder_path, THUMB_DIR_NAME, member)
+        if not os.path.isdir(thumb_dir): return set()
+        with os.scandir(thumb_dir) as it:
+            return {e.name[:-4] for e in it if e.name.endswith(".jpg")}
+
+    def _apply_thumbs(self, msgs, thumb_set):
+        # th: 1 代表 thumbs/<成員>/<檔名>.jpg 存在
+        return [dict(m, th=1) if m['f'] in thumb_set else m for m in msgs]
+
+    def _apply_nickname(self, msgs, nickname):
+        # 快取中保存原始文字，暱稱在輸出時才替換，改暱稱不需重新讀檔
+        if not nickname: return msgs
+        return [dict(m, c=m['c'].replace('%%%', nickname)) if '%%%' in m['c'] else m for m in msgs]
+
+    def _load_member_cache(self, index, legacy_dir, member, prof=None):
+        # 先讀訊息索引；索引中還沒有這位成員時，改讀舊版的 JSON 掃描快取 (標記 legacy，之後寫進索引)
+        cached = index.load_member(member)
+        if cached is None:
+            try:
+                with open(os.path.join(legacy_dir, member + ".json"), 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if cached.get('v') != CACHE_VERSION: return None
+                cached['legacy'] = True
+                # 舊版快取沒有媒體資訊：只沿用文字訊息，媒體檔重新讀取檔頭
+                cached['msgs'] = [m for m in cached['msgs'] if m['t'] == '.txt']
+                kept = {m['f'] for m in cached['msgs']}
+                cached['files'] = {f: st for f, st in cached['files'].items() if f in kept}
+            except (OSError, ValueError):
+                return None
+        if prof is not None: prof.add_member(member, cache_rows=len(cached['msgs']))
+        return cached
+
+    def _save_generation_settings(self, group_folder_path, settings):
+        try:
+            with atomic_write(os.path.join(group_folder_path, CACHE_DIR_NAME, SETTINGS_NAME)) as f:
+                json.dump(dict(settings, v=CACHE_VERSION), f, ensure_ascii=False)
+        except OSError as e:
+            # 網頁已經換上，不算失敗，只記下警告 (之後的自動更新會沿用舊設定或要求手動產生)
+            self.last_stats.setdefault('warnings', []).append(f"寫入產生設定失敗: {e}")
+
+    def load_generation_settings(self, group_folder_path):
+        """ 上次產生網頁時的設定 {nickname, layout, thumbnails, search}；沒有紀錄時回傳 None """
+        try:
+            with open(os.path.join(group_folder_path, CACHE_DIR_NAME, SETTINGS_NAME), 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if settings.pop('v', None) != CACHE_VERSION: return None
+        return settings
+
+    def _read_js_value(self, path, prefix):
+        # 讀回 "prefix{...};" 形式的小型 JS 資料檔 (manifest.js、avatar_map.js)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read().strip()
+            if text.startswith(prefix): return json.loads(text[len(prefix):].rstrip(';'))
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def regenerate_members(self, group_folder_path, members, progress_callback=None, cancel_event=None):
+        """ 備份後只更新有變動的成員：沿用上次產生網頁的設定與目前的頭像設定
+            members 為空時不做任何事，回傳 (True, None) """
+        if not os.path.exists(os.path.join(group_folder_path, "index.html")):
+            return False, "尚未產生網頁，請先執行「產生入口網頁」。"
+        settings = self.load_generation_settings(group_folder_path)
+        if settings is None:
+            return False, "找不到上次的產生設定，請先手動產生一次網頁。"
+        if not members: return True, None
+        # 舊版程式產生的資料檔格式不同，這次所有成員都要重寫 (仍會沿用掃描快取)
+        only_members = members if settings.pop('format', None) == DATA_FORMAT else None
+        avatar_map = self._read_js_value(os.path.join(group_folder_path, AVATAR_DIR_NAME, AVATAR_MAP_NAME), "window.nogkAvatars = ") or {}
+        return self.generate_single_index(group_folder_path, avatar_map=avatar_map, only_members=only_members,
+                                          progress_callback=progress_callback, cancel_event=cancel_event, **settings)
+
+    def update_html_avatars(self, group_folder_path, avatar_map):
+        """ 只改寫 avatars/avatar_map.js，不必重寫整個 index.html
+            舊版網頁 (avatarMap 直接寫在 HTML 中) 會先轉換一次，之後就和新版一樣 """
+        html_path = os.path.join(group_folder_path, "index.html")
+        if not os.path.exists(html_path):
+            return False, "找不到 index.html，請先執行「產生入口網頁」。"
+
+        try:
+            with group_lock(group_folder_path):  # 轉換舊版網頁時會改寫 index.html，不能和產生網頁同時進行
+                if not self._html_uses_avatar_sidecar(html_path):
+                    if not self._migrate_html_avatars(html_path):
+                        return False, "無法在 index.html 中找到 avatarMap 設定，可能檔案已損壞或版本過舊。"
+                self._write_avatar_sidecar(group_folder_path, avatar_map)
+            return True, html_path
+        except Exception as e:
+            return False, str(e)
+
+    def copy_avatars(self, group_folder_path, sources, size=None, progress_callback=None):
+        """ 把 {成員: 圖片路徑} 平行複製 (或縮小) 到 avatars/，回傳 (avatar_map, 統計)
+            avatar_map 可直接交給 generate_single_index 或 update_html_avatars；失敗的成員與原因記在統計的 errors """
+        avatar_dir = os.path.join(group_folder_path, AVATAR_DIR_NAME)
+        os.makedirs(avatar_dir, exist_ok=True)
+        avatar_map = {}
+        stats = {'copied': 0, 'resized': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, 8)) as pool:
+            by_src = {}  # 同一張圖片只處理一次，也避免兩個執行緒寫同一個檔案
+            for src in sources.values():
+                if src not in by_src: by_src[src] = pool.submit(store_avatar, src, avatar_dir, size)
+            futures = {member: by_src[src] for member, src in sources.items()}
+            for done, (member, future) in enumerate(futures.items(), 1):
+                try:
+                    avatar_map[member], action = future.result()
+                    stats[action] += 1
+                except Exception as e:
+                    stats['failed'] += 1
+                    stats['errors'].append(f"{member}: {e}")
+                if progress_callback: progress_callback(done, len(futures), member)
+        return avatar_map, stats
+
+    def _avatar_script_tag(self):
+        return f'<script src="{AVATAR_DIR_NAME}/{AVATAR_MAP_NAME}"></script>'
+
+    def _write_avatar_sidecar(self, group_folder_path, avatar_map, pending=None):
+        avatar_dir = os.path.join(group_folder_path, AVATAR_DIR_NAME)
+        os.makedirs(avatar_dir, exist_ok=True)
+        path = os.path.join(avatar_dir, AVATAR_MAP_NAME)
+        with (pending.open(path) if pending is not None else atomic_write(path)) as f:
+            f.write(f"window.nogkAvatars = {json.dumps(avatar_map, ensure_ascii=False)};\n")
+
+    def _html_uses_avatar_sidecar(self, html_path):
+        # 載入頭像檔的 <script> 在 <head> 裡，只需要讀檔案開頭
+        with open(html_path, 'rb') as f:
+            head = f.read(65536)
+        return self._avatar_script_tag().encode('utf-8') in head
+
+    def _migrate_html_avatars(self, html_path):
+        """ 舊版網頁轉換一次：在 </head> 前加入頭像檔的 <script>，avatarMap 改為優先讀取 window.nogkAvatars
+            逐段串流複製，不會把整個 HTML 讀進記憶體 """
+        tag_inserted = map_replaced = False
+        at_line_start = True
+        try:
+            with open(html_path, 'rb') as src, atomic_write(html_path, mode='wb') as dst:
+                while True:
+                    piece = src.readline(1 << 20)  # 訊息資料可能是一整行很長的 JSON，分段讀取
+                    if not piece: break
+                    if at_line_start and not map_replaced and piece.startswith(b'const avatarMap = '):
+                        if not piece.endswith(b'\n'): raise ValueError("avatarMap 設定過長")
+                        old_json = piece[len(b'const avatarMap = '):].rstrip().rstrip(b';').decode('utf-8')
+                        piece = f"const avatarMap = window.nogkAvatars || {old_json};\n".encode('utf-8')
+                        map_replaced = True
+                    elif at_line_start and not tag_inserted and piece.lstrip().startswith(b'</head>'):
+                        dst.write(self._avatar_script_tag().encode('utf-8') + b'\n')
+                        tag_inserted = True
+                    dst.write(piece)
+                    at_line_start = piece.endswith(b'\n')
+                if not (tag_inserted and map_replaced):
+                    raise LookupError()  # 找不到要替換的位置，保留原檔
+        except LookupError:
+            return False
+        return True
+
+    def _format_time(self, ts):
+        if len(ts) >= 12: return f"{ts[8:10]}:{ts[10:12]}"
+        return ""
+    def _format_date(self, ts):
+        if len(ts) >= 8: return f"{ts[0:4]}/{ts[4:6]}/{ts[6:8]}"
+        return ""
+
+    def _get_html_template(self, json_data, json_avatars, layout="inline", search=False, media_lookahead=MEDIA_LOOKAHEAD, dedup=False):
+        # 為了縮減程式碼長度，這裡直接回傳 v24 的 HTML 字串
+        # 實務上建議把 HTML 放在單獨檔案讀取，但為了單一執行檔方便，這裡維持字串形式
+        data_scripts = f'<script src="{DATA_DIR_NAME}/manifest.js"></script>\n' if layout == "split" else ""
+        if search: data_scripts += f'<script src="{SEARCH_DIR_NAME}/meta.js"></script>\n'
+        if dedup: data_scripts += f'<script src="{DATA_DIR_NAME}/{MEDIA_ALIAS_NAME}"></script>\n'
+        return f"""<!DOCTYPE html>
+<html lang="zh-TW">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Nogi MSG Viewer</title>
+<style>
+body {{ background-color: #f2f3f7; font-family: "Helvetica Neue", Arial, sans-serif; margin: 0; padding: 0; display: flex; height: 100vh; overflow: hidden; }}
+.sidebar {{ width: 220px; background-color: #fff; border-right: 1px solid #ddd; display: flex; flex-direction: column; flex-shrink: 0; }}
+.sidebar-header {{ padding: 15px; background-color: #6a0d6e; color: white; font-weight: bold; text-align: center; }}
+.sidebar-sort-info {{ background-color: #f8f0fc; padding: 5px 10px; font-size: 12px; color: #666; display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid #eee; }}
+.reset-btn {{ font-size: 10px; background: #ddd; border: none; padding: 2px 6px; cursor: pointer; border-radius: 4px; color: #333; display: none; }}
+.reset-btn:hover {{ background: #ccc; }}
+.member-list {{ overflow-y: auto; flex-grow: 1; }}
+.member-item {{ padding: 12px 20px; cursor: grab; border-bottom: 1px solid #f0f0f0; display: flex; align-items: center; gap: 10px; transition: background 0.1s; user-select: none; }}
+.member-item:hover {{ background-color: #f9f9f9; }}
+.member-item.active {{ background-color: #f3e5f5; color: #7e1083; font-weight: bold; border-left: 4px solid #7e1083; }}
+.member-item.dragging {{ opacity: 0.5; background-color: #eee; }}
+.member-avatar-icon {{ width: 32px; height: 32px; background: #ddd; border-radius: 50%; display: flex; justify-content: center; align-items: center; font-size: 12px; color: #fff; overflow: hidden; flex-shrink: 0; }}
+.member-avatar-icon img {{ width: 100%; height: 100%; object-fit: cover; transition: transform 0.2s; }}
+.member-avatar-icon.clickable {{ cursor: zoom-in; }} 
+.member-avatar-icon.clickable:hover img {{ transform: scale(1.1); }}
+.main-area {{ flex-grow: 1; display: flex; flex-direction: column; height: 100%; position: relative; }}
+.header {{ background-color: #7e1083; color: white; height: 50px; display: flex; align-items: center; justify-content: center; padding: 0 20px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); flex-shrink: 0; position: relative; }}
+.header-center-group {{ display: flex; align-items: center; gap: 10px; }}
+.header-title {{ font-size: 18px; font-weight: bold; margin-right: 5px; }}
+select {{ padding: 3px 8px; border-radius: 12px; border: none; outline: none; background: rgba(255,255,255,0.9); color: #7e1083; font-weight: bold; cursor: pointer; font-size: 13px; }}
+#scaleSelect {{ background: rgba(255,255,255,0.7); color: #333; }}
+.chat-container {{ flex-grow: 1; padding: 20px; overflow-y: auto; display: flex; flex-direction: column; gap: 10px; opacity: 0; transition: opacity 0.15s ease-out; position: relative; overflow-anchor: none; }}
+.msg-block {{ display: flex; flex-direction: column; gap: 10px; flex-shrink: 0; }}
+.empty-state {{ text-align: center; color: #999; margin-top: 100px; }}
+.timestamp-separator {{ text-align: center; color: #888; font-size: 12px; margin: 15px 0; background-color: rgba(0,0,0,0.05); padding: 4px 10px; border-radius: 12px; align-self: center; }}
+.msg-row {{ display: flex; align-items: flex-start; gap: 8px; margin-bottom: 10px; }}
+.avatar {{ width: 40px; height: 40px; background-color: #ccc; border-radius: 50%; display: flex; align-items: center; justify-content: center; color: white; font-size: 16px; flex-shrink: 0; overflow: hidden; }}
+.avatar img {{ width: 100%; height: 100%; object-fit: cover; transition: opacity 0.2s; }}
+.avatar.clickable {{ cursor: zoom-in; }}
+.avatar.clickable:hover {{ opacity: 0.8; }}
+.bubble-wrapper {{ display: flex; flex-direction: column; max-width: 80%; }}
+.bubble a {{ color: #0066cc; text-decoration: underline; word-break: break-all; }}
+.bubble {{ background-color: white; padding: 10px 14px; border-radius: 18px; border-top-left-radius: 4px; box-shadow: 0 1px 2px rgba(0,0,0,0.1); word-wrap: break-word; line-height: 1.5; color: #333; font-size: 15px; white-space: pre-wrap; }}
+.media-bubble {{ background: transparent; box-shadow: none; padding: 0; border-radius: 12px; overflow: hidden; display: inline-block; }}
+:root {{ --img-scale: 25%; --video-scale: 65%; }}
+.chat-img {{ width: var(--img-scale); height: auto; border-radius: 12px; display: block; cursor: zoom-in; border: 1px solid #eee; transition: width 0.3s; }}
+.chat-video {{ width: 100%; height: auto; border-radius: 12px; max-height: 400px; display: block; margin: 0; }}
+.video-container {{ display: flex; align-items: center; gap: 8px; }}
+.video-wrapper {{ width: var(--video-scale); line-height: 0; }}
+.video-expand-btn {{ width: 30px; height: 30px; border-radius: 50%; border: none; background-color: #ddd; color: #555; font-size: 16px; cursor: pointer; display: flex; align-items: center; justify-content: center; transition: background 0.2s; }}
+.video-expand-btn:hover {{ background-color: #bbb; color: #000; }}
+.chat-audio {{ width: 240px; }}
+.time-label {{ font-size: 11px; color: #999; margin-left: 4px; margin-top: 5px; min-width: 35px; }}
+.nav-buttons {{ position: fixed; bottom: 30px; right: 30px; display: flex; flex-direction: column; gap: 10px; z-index: 500; }}
+.nav-btn {{ width: 40px; height: 40px; border-radius: 50%; background: rgba(126, 16, 131, 0.8); color: white; border: none; font-size: 20px; cursor: pointer; box-shadow: 0 2px 5px rgba(0,0,0,0.3); display: flex; align-items: center; justify-content: center; opacity: 0.7; transition: opacity 0.2s, transform 0.2s; }}
+.nav-btn:hover {{ opacity: 1; transform: scale(1.1); }}
+#lightbox {{ display: none; position: fixed; z-index: 1000; left: 0; top: 0; width: 100%; height: 100%; overflow: auto; background-color: rgba(0,0,0,0.9); align-items: center; justify-content: center; }}
+#lightbox-img {{ max-width: 90%; max-height: 90%; border-radius: 5px; box-shadow: 0 0 20px rgba(0,0,0,0.5); object-fit: contain; cursor: default; }}
+#lightbox-video {{ max-width: 90%; max-height: 90%; outline: none; }}
+.search-input {{ padding: 3px 10px; border-radius: 12px; border: none; outline: none; font-size: 13px; width: 140px; }}
+.search-results {{ display: none; position: absolute; top: 50px; right: 20px; width: 360px; max-height: 60vh; overflow-y: auto; background: #fff; border-radius: 8px; box-shadow: 0 4px 12px rgba(0,0,0,0.25); z-index: 600; color: #333; }}
+.search-summary {{ padding: 6px 12px; font-size: 12px; color: #888; border-bottom: 1px solid #eee; }}
+.search-item {{ padding: 8px 12px; border-bottom: 1px solid #f0f0f0; cursor: pointer; font-size: 13px; }}
+.search-item:hover {{ background: #f8f0fc; }}
+.search-item-head {{ font-weight: bold; color: #7e1083; }}
+.search-item-head span {{ font-weight: normal; color: #999; font-size: 11px; margin-left: 6px; }}
+.search-item-text {{ color: #555; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
+.msg-row.search-hit .bubble {{ box-shadow: 0 0 0 3px #f0c040; }}
+@media (max-width: 768px) {{ .sidebar {{ display: none; }} .header-center-group {{ flex-wrap: wrap; justify-content: center; }} }}
+</style>
+{self._avatar_script_tag()}
+</head>
+<body>
+<div id="lightbox" onclick="closeLightbox(event)">
+<img id="lightbox-img" src="" alt="Full size" style="display:none;" onclick="event.stopPropagation()">
+<video id="lightbox-video" controls style="display:none;" onclick="event.stopPropagation()"></video>
+</div>
+<div class="nav-buttons">
+<button class="nav-btn" title="回頂端" onclick="scrollToTop()">↑</button>
+<button class="nav-btn" title="去底部" onclick="scrollToBottom()">↓</button>
+</div>
+<div class="sidebar">
+<div class="sidebar-header">乃木坂46 MSG</div>
+<div class="sidebar-sort-info"><span id="sortStatus">排序：50音 (預設)</span><button id="resetSortBtn" class="reset-btn" onclick="resetSort()">重置</button></div>
+<div class="member-list" id="memberList"></div>
+</div>
+<div class="main-area">
+<div class="header">
+<div class="header-center-group">
+<div class="header-title" id="headerTitle">請選擇成員</div>
+<select id="yearSelect" disabled><option>年</option></select>
+<select id="monthSelect" disabled><option>月</option></select>
+<select id="scaleSelect"><option value="25%" selected>圖: 小</option><option value="50%">圖: 中</option><option value="75%">圖: 大</option><option value="100%">圖: 原</option></select>
+<input id="searchInput" class="search-input" type="search" placeholder="搜尋訊息" style="display:none">
+</div>
+<div class="search-results" id="searchResults"></div>
+</div>
+<div class="chat-container" id="chatBox"><div class="empty-state">請從左側選擇要瀏覽的成員</div></div>
+</div>
+{data_scripts}<script>
+const packedData = {json_data}; // 精簡格式 {{成員: {{f: [檔名], ts: [時間], c: [文字], th: [有縮圖的訊息], mo: [[年月, 筆數]]}}}}，開啟成員時才展開
+const allData = {{}};
+const avatarMap = window.nogkAvatars || {json_avatars}; // 頭像設定以 avatars/avatar_map.js 為準，內嵌的只是備用
+const mediaAlias = window.nogkMediaAlias || {{}}; // 內容相同的媒體改用同一份檔案 (data/media_alias.js)，瀏覽器只下載一次
+const memberIndex = window.nogkManifest || null; // split 模式: {{成員: {{n: 訊息數, src: 資料檔前綴, mo: [[年月, 筆數, 版本]]}}}}
+const monthIndexes = {{}};
+const monthStates = {{}}; // split 模式: {{成員: {{年月: true (已載入) 或 [載入後的 callback]}}}}
+let currentMember = null;
+let currentYears = {{}}; 
+let scrollTimeout = null;
+const memberListEl = document.getElementById('memberList');
+const chatBox = document.getElementById('chatBox');
+const headerTitle = document.getElementById('headerTitle');
+const yearSelect = document.getElementById('yearSelect');
+const monthSelect = document.getElementById('monthSelect');
+const scaleSelect = document.getElementById('scaleSelect');
+const sortStatus = document.getElementById('sortStatus');
+const resetSortBtn = document.getElementById('resetSortBtn');
+const searchInput = document.getElementById('searchInput');
+const searchResultsEl = document.getElementById('searchResults');
+function openLightbox(src, type='img') {{ const lb = document.getElementById('lightbox'); const lbImg = document.getElementById('lightbox-img'); const lbVid = document.getElementById('lightbox-video'); lb.style.display = "flex"; if (type === 'video') {{ lbImg.style.display = "none"; lbVid.style.display = "block"; lbVid.src = src; lbVid.play(); }} else {{ lbVid.style.display = "none"; lbVid.pause(); lbImg.style.display = "block"; lbImg.src = src; }} }}
+function closeLightbox(e) {{ const lb = document.getElementById('lightbox'); const lbVid = document.getElementById('lightbox-video'); lbVid.pause(); lb.style.display = "none"; }}
+function scrollToTop() {{ chatBox.scrollTo({{ top: 0, behavior: 'smooth' }}); }}
+function scrollToBottom() {{ chatBox.scrollTo({{ top: chatBox.scrollHeight, behavior: 'smooth' }}); }}
+function decodeMember(p) {{
+// 副檔名由檔名推得，日期與時間由 ts 格式化，展開成 {{f, t, ts, d, hm, c, th, w, h, du}}
+const out = new Array(p.f.length); const th = new Set(p.th || []);
+for (let i = 0; i < p.f.length; i++) {{
+const f = p.f[i]; const dot = f.lastIndexOf('.'); const ts = String(p.ts[i]).padStart(14, '0');
+const msg = {{ f: f, t: dot >= 0 ? f.slice(dot).toLowerCase() : '', ts: ts, d: ts.slice(0, 4) + '/' + ts.slice(4, 6) + '/' + ts.slice(6, 8), hm: ts.slice(8, 10) + ':' + ts.slice(10, 12), c: p.c[i] }};
+if (th.has(i)) msg.th = 1;
+out[i] = msg;
+}}
+const dim = p.dim || []; for (let i = 0; i < dim.length; i += 3) {{ out[dim[i]].w = dim[i + 1]; out[dim[i]].h = dim[i + 2]; }}
+const du = p.du || []; for (let i = 0; i < du.length; i += 2) out[du[i]].du = du[i + 1];
+return out;
+}}
+function memberData(name) {{
+// split 模式先建立等長的空陣列，各月份載入後填入對應位置
+if (!allData[name]) {{ if (memberIndex) {{ if (memberIndex[name]) allData[name] = new Array(memberIndex[name].n); }} else if (packedData[name]) {{ allData[name] = decodeMember(packedData[name]); }} }}
+return allData[name];
+}}
+function memberMonths(name) {{
+// 月份索引 [{{ym, n, start, v}}]：由產生器預先算好，不必掃描每則訊息
+if (!monthIndexes[name]) {{
+const src = memberIndex ? memberIndex[name].mo : packedData[name].mo; let start = 0; const months = []; months.byYm = {{}};
+src.forEach(e => {{ const mo = {{ ym: e[0], n: e[1], start: start, v: e[2] }}; start += e[1]; months.push(mo); months.byYm[mo.ym] = mo; }});
+monthIndexes[name] = months;
+}}
+return monthIndexes[name];
+}}
+function monthOf(name, idx) {{ const months = memberMonths(name); let lo = 0, hi = months.length - 1, ans = null; while (lo <= hi) {{ const mid = (lo + hi) >> 1; if (months[mid].start <= idx) {{ ans = months[mid]; lo = mid + 1; }} else {{ hi = mid - 1; }} }} return ans; }}
+function adjacentMonths(name, ym) {{ const months = memberMonths(name); const i = months.indexOf(months.byYm[ym]); return months.slice(Math.max(0, i - 1), i + 2).map(mo => mo.ym); }}
+function monthLoaded(name, ym) {{ return !memberIndex || (monthStates[name] && monthStates[name][ym] === true); }}
+function nogkMonth(name, ym, packed) {{
+const mo = memberMonths(name).byYm[ym]; const msgs = memberData(name); const part = decodeMember(packed);
+for (let i = 0; i < part.length; i++) msgs[mo.start + i] = part[i];
+const state = monthStates[name] || (monthStates[name] = {{}}); const cbs = state[ym]; state[ym] = true;
+if (Array.isArray(cbs)) cbs.forEach(cb => cb());
+}}
+function ensureMonths(name, yms, cb) {{
+// 載入尚未載入的月份 (data/<前綴>_YYYYMM.js)，全部完成後呼叫 cb；inline 模式資料都已在頁面中
+if (!memberIndex) {{ cb(); return; }}
+const state = monthStates[name] || (monthStates[name] = {{}}); let remaining = 1;
+const done = () => {{ if (--remaining === 0) cb(); }};
+yms.forEach(ym => {{
+const st = state[ym]; if (st === true) return;
+remaining++; if (st) {{ st.push(done); return; }}
+state[ym] = [done];
+const s = document.createElement('script'); s.src = memberIndex[name].src + '_' + ym + '.js?v=' + memberMonths(name).byYm[ym].v;
+s.onerror = () => {{ delete state[ym]; if (currentMember === name) {{ chatBox.innerHTML = '<div class="empty-state">資料載入失敗</div>'; chatBox.style.opacity = '1'; teardownView(); }} }};
+document.head.appendChild(s);
+}});
+done();
+}}
+function init() {{
+let members = Object.keys(memberIndex || packedData).sort();
+const savedOrder = localStorage.getItem('nogi_member_order');
+if (savedOrder) {{ try {{ const customOrder = JSON.parse(savedOrder); const validCustom = customOrder.filter(m => members.includes(m)); const missing = members.filter(m => !validCustom.includes(m)); members = [...validCustom, ...missing]; updateSortStatus(true); }} catch(e) {{}} }}
+renderSidebar(members);
+initSearch();
+scaleSelect.onchange = function() {{ document.documentElement.style.setProperty('--img-scale', this.value); }};
+document.documentElement.style.setProperty('--img-scale', '25%');
+const lastMember = localStorage.getItem('nogi_last_member');
+if (location.hash === '#bench') {{ runViewerBench(); }}
+else if (lastMember && (memberIndex || packedData)[lastMember]) {{ loadMember(lastMember); }}
+chatBox.addEventListener('scroll', function() {{ if (!currentMember || chatBox.style.opacity === '0') return; clearTimeout(scrollTimeout); scrollTimeout = setTimeout(saveScrollPosition, 200); }});
+}}
+function runViewerBench() {{
+// 網址加上 #bench 時依序開啟每位成員，量測 loadMember 到畫面顯示的時間 (nogk_bench.py 使用)
+const names = Object.keys(memberIndex || packedData).sort(); const results = [];
+const next = i => {{
+if (i >= names.length) {{ const pre = document.createElement('pre'); pre.id = 'nogkBench'; pre.textContent = JSON.stringify(results); document.body.appendChild(pre); console.log('nogk-bench ' + pre.textContent); return; }}
+const name = names[i]; const t0 = performance.now(); localStorage.removeItem('nogi_scroll_' + name); loadMember(name);
+const poll = () => {{ if (view && view.name === name && chatBox.style.opacity === '1') {{ results.push({{ member: name, messages: view.msgs.length, ms: Math.round(performance.now() - t0), nodes: chatBox.getElementsByTagName('*').length }}); setTimeout(() => next(i + 1), 50); }} else {{ setTimeout(poll, 5); }} }};
+poll();
+}};
+next(0);
+}}
+function renderSidebar(members) {{
+memberListEl.innerHTML = '';
+members.forEach(m => {{
+const div = document.createElement('div'); div.className = 'member-item'; div.draggable = true; div.dataset.name = m;
+let avatarHtml = `<div class="member-avatar-icon">${{m[0]}}</div>`;
+if (avatarMap[m]) {{ avatarHtml = `<div class="member-avatar-icon clickable" onclick="event.stopPropagation(); openLightbox('${{avatarMap[m]}}')"><img src="${{avatarMap[m]}}"></div>`; }}
+div.innerHTML = `${{avatarHtml}}<div>${{m}}</div>`;
+div.onclick = () => loadMember(m);
+div.addEventListener('dragstart', handleDragStart); div.addEventListener('dragover', handleDragOver); div.addEventListener('drop', handleDrop); div.addEventListener('dragenter', handleDragEnter); div.addEventListener('dragleave', handleDragLeave);
+memberListEl.appendChild(div);
+}});
+}}
+let dragSrcEl = null;
+function handleDragStart(e) {{ this.classList.add('dragging'); dragSrcEl = this; e.dataTransfer.effectAllowed = 'move'; e.dataTransfer.setData('text/html', this.innerHTML); }}
+function handleDragOver(e) {{ if (e.preventDefault) {{ e.preventDefault(); }} e.dataTransfer.dropEffect = 'move'; return false; }}
+function handleDragEnter(e) {{ this.classList.add('over'); }}
+function handleDragLeave(e) {{ this.classList.remove('over'); }}
+function handleDrop(e) {{
+if (e.stopPropagation) {{ e.stopPropagation(); }}
+document.querySelectorAll('.member-item').forEach(col => {{ col.classList.remove('over'); col.classList.remove('dragging'); }});
+if (dragSrcEl !== this) {{ const allItems = [...memberListEl.querySelectorAll('.member-item')]; const srcIndex = allItems.indexOf(dragSrcEl); const targetIndex = allItems.indexOf(this); if (srcIndex < targetIndex) {{ this.after(dragSrcEl); }} else {{ this.before(dragSrcEl); }} saveSortOrder(); }}
+return false;
+}}
+function saveSortOrder() {{ const items = document.querySelectorAll('.member-item'); const order = Array.from(items).map(item => item.dataset.name); localStorage.setItem('nogi_member_order', JSON.stringify(order)); updateSortStatus(true); }}
+function resetSort() {{ localStorage.removeItem('nogi_member_order'); location.reload(); }}
+function updateSortStatus(isCustom) {{ if (isCustom) {{ sortStatus.textContent = "排序：自訂"; sortStatus.style.color = "#7e1083"; sortStatus.style.fontWeight = "bold"; resetSortBtn.style.display = "inline-block"; }} else {{ sortStatus.textContent = "排序：50音 (預設)"; sortStatus.style.color = "#666"; sortStatus.style.fontWeight = "normal"; resetSortBtn.style.display = "none"; }} }}
+function loadMember(name) {{
+chatBox.style.opacity = '0'; currentMember = name; localStorage.setItem('nogi_last_member', name);
+document.querySelectorAll('.member-item').forEach(el => el.classList.remove('active'));
+const targetItem = document.querySelector(`.member-item[data-name="${{name}}"]`);
+if(targetItem) targetItem.classList.add('active');
+headerTitle.textContent = name;
+if (!memberData(name)) return;
+analyzeDates(name); setTimeout(() => {{ if (currentMember === name) renderMessages(name); }}, 10);
+}}
+function analyzeDates(name) {{
+currentYears = {{}};
+memberMonths(name).forEach(mo => {{ const y = mo.ym.substring(0, 4); (currentYears[y] = currentYears[y] || []).push(mo); }});
+const years = Object.keys(currentYears).sort().reverse();
+yearSelect.innerHTML = '<option value="">年</option>';
+years.forEach(y => {{ const opt = document.createElement('option'); opt.value = y; opt.textContent = y; yearSelect.appendChild(opt); }});
+yearSelect.disabled = false; monthSelect.innerHTML = '<option value="">月</option>'; monthSelect.disabled = true;
+yearSelect.onchange = () => updateMonthSelect(yearSelect.value);
+monthSelect.onchange = () => scrollToDate(yearSelect.value, monthSelect.value);
+}}
+function updateMonthSelect(year) {{
+monthSelect.innerHTML = '<option value="">月</option>'; if (!year) {{ monthSelect.disabled = true; return; }}
+currentYears[year].forEach(mo => {{ const m = mo.ym.substring(4, 6); const opt = document.createElement('option'); opt.value = m; opt.textContent = m + "月 (" + mo.n + ")"; monthSelect.appendChild(opt); }});
+monthSelect.disabled = false;
+}}
+function linkify(text) {{ var urlRegex = /(https?:\\/\\/[^\\s]+)/g; return text.replace(urlRegex, function(url) {{ return '<a href="' + url + '" target="_blank">' + url + '</a>'; }}); }}
+// 虛擬化渲染：訊息依月份切成小區塊，只有接近畫面的區塊才會產生 DOM，其餘以等高的空白區塊佔位
+// split 模式下區塊接近畫面時才載入該月份的資料檔
+const SEG_SIZE = 50;
+const LOOKAHEAD_PX = 1500;
+const MEDIA_LOOKAHEAD_PX = {media_lookahead}; // 媒體在這個距離內才指定 src，離開後釋放暫停中的影片與語音
+const lazyMedia = 'IntersectionObserver' in window;
+let rowHeightEstimate = 70;
+let view = null;
+function buildSegments(months) {{
+// 只需要月份索引，不必等訊息載入
+const segs = [];
+months.forEach(mo => {{ for (let s = mo.start; s < mo.start + mo.n; s += SEG_SIZE) segs.push({{ start: s, end: Math.min(s + SEG_SIZE, mo.start + mo.n), month: mo.ym, first: s === mo.start }}); }});
+return segs;
+}}
+function formatDuration(sec) {{ sec = Math.round(sec); return Math.floor(sec / 60) + ':' + String(sec % 60).padStart(2, '0'); }}
+function buildMessageRow(name, msg) {{
+const msgDiv = document.createElement('div');
+let contentHtml = ''; const safePath = mediaAlias[name + '/' + msg.f] || name + '/' + msg.f;
+const dims = msg.w ? ` width="${{msg.w}}" height="${{msg.h}}"` : ''; // 預先知道寬高，圖片載入前就保留正確比例的空間
+const src = lazyMedia ? 'data-src' : 'src'; // 延遲載入：接近畫面時才由 onMediaIntersect 指定 src
+if (msg.t === '.txt') {{ let textContent = msg.c.replace(/\\n/g, '<br>'); textContent = linkify(textContent); contentHtml = `<div class="bubble">${{textContent}}</div>`; }}
+else if (['.jpg', '.jpeg', '.png'].includes(msg.t)) {{ const thumbPath = msg.th ? 'thumbs/' + name + '/' + msg.f + '.jpg' : safePath; contentHtml = `<div class="bubble media-bubble"><img ${{src}}="${{thumbPath}}" data-full="${{safePath}}"${{dims}} loading="lazy" decoding="async" class="chat-img" onclick="openLightbox(this.dataset.full)"></div>`; }}
+else if (msg.t === '.mp4') {{ contentHtml = `<div class="video-container"><div class="video-wrapper"><div class="bubble media-bubble"><video ${{src}}="${{safePath}}"${{dims}} controls class="chat-video" preload="metadata"></video></div></div><button class="video-expand-btn" title="全螢幕播放" onclick="openLightbox('${{safePath}}', 'video')">⛶</button></div>`; }}
+else if (['.m4a', '.mp3', '.wav'].includes(msg.t)) {{ contentHtml = `<div class="bubble media-bubble"><audio ${{src}}="${{safePath}}" controls class="chat-audio" preload="none"></audio></div>`; }}
+msgDiv.className = 'msg-row';
+let avatarHtml = `<div class="avatar">${{name[0]}}</div>`;
+if (avatarMap[name]) {{ avatarHtml = `<div class="avatar clickable" onclick="openLightbox('${{avatarMap[name]}}')"><img src="${{avatarMap[name]}}"></div>`; }}
+const duration = msg.du !== undefined ? `<br>${{formatDuration(msg.du)}}` : '';
+msgDiv.innerHTML = `${{avatarHtml}}<div class="bubble-wrapper">${{contentHtml}}</div><div class="time-label">${{msg.hm}}${{duration}}</div>`;
+return msgDiv;
+}}
+function renderSegment(seg) {{
+const msgs = view.msgs; const fragment = document.createDocumentFragment();
+let lastDate = seg.start > 0 && !seg.first ? msgs[seg.start - 1].d : ''; // 月份的第一段一定換日
+for (let i = seg.start; i < seg.end; i++) {{
+const msg = msgs[i];
+if (msg.d !== lastDate) {{ const sep = document.createElement('div'); sep.className = 'timestamp-separator'; sep.textContent = msg.d; fragment.appendChild(sep); lastDate = msg.d; }}
+const row = buildMessageRow(view.name, msg); row.dataset.idx = i; fragment.appendChild(row);
+}}
+return fragment;
+}}
+function materialize(block) {{
+if (!block || block.live) return;
+const seg = view.segs[block.seg]; block.wanted = true;
+if (!monthLoaded(view.name, seg.month)) {{ const v = view; ensureMonths(v.name, [seg.month], () => {{ if (view === v && block.wanted) materialize(block); }}); return; }}
+const oldH = block._h;
+block.live = true; block.appendChild(renderSegment(seg)); block.style.height = '';
+if (view.mo) block.querySelectorAll('[data-src]').forEach(el => view.mo.observe(el));
+const newH = block.offsetHeight; block._h = newH;
+if (!block.measured && newH > 0) {{ block.measured = true; view.measuredH += newH; view.measuredN += seg.end - seg.start; rowHeightEstimate = view.measuredH / view.measuredN; }}
+if (view.ro) view.ro.observe(block);
+compensateScroll(block, oldH, newH);
+}}
+function dematerialize(block) {{
+block.wanted = false;
+if (!block.live) return;
+if (view.ro) view.ro.unobserve(block);
+if (view.mo) block.querySelectorAll('[data-src]').forEach(el => view.mo.unobserve(el));
+block.live = false; block.style.height = block._h + 'px'; block.innerHTML = '';
+}}
+function compensateScroll(block, oldH, newH) {{
+// 畫面上方的區塊高度改變時同步調整捲動位置，避免畫面跳動
+if (newH !== oldH && block.offsetTop + oldH <= chatBox.scrollTop) chatBox.scrollTop += newH - oldH;
+}}
+function onBlocksIntersect(entries) {{ if (!view) return; entries.forEach(e => {{ if (e.isIntersecting) materialize(e.target); else dematerialize(e.target); }}); }}
+function onBlocksResize(entries) {{ if (!view) return; entries.forEach(e => {{ const block = e.target; if (!block.live) return; const oldH = block._h; const newH = block.offsetHeight; if (newH === oldH) return; block._h = newH; compensateScroll(block, oldH, newH); }}); }}
+function onMediaIntersect(entries) {{
+entries.forEach(e => {{
+const el = e.target;
+if (e.isIntersecting) {{ if (!el.hasAttribute('src')) el.src = el.dataset.src; }}
+else if (el.tagName !== 'IMG' && el.hasAttribute('src') && el.paused) {{ el.removeAttribute('src'); el.load(); }} // 釋放解碼器與緩衝，播放中的不動
+}});
+}}
+function teardownView() {{ if (!view) return; if (view.io) view.io.disconnect(); if (view.ro) view.ro.disconnect(); if (view.mo) view.mo.disconnect(); view = null; }}
+function renderMessages(name) {{
+teardownView(); chatBox.innerHTML = '';
+view = {{ name: name, msgs: memberData(name), segs: buildSegments(memberMonths(name)), blocks: [], measuredH: 0, measuredN: 0, io: null, ro: null, mo: null }};
+const fragment = document.createDocumentFragment();
+view.segs.forEach((seg, i) => {{
+const block = document.createElement('div'); block.className = 'msg-block'; block.seg = i; block.live = false;
+if (seg.first) block.id = 'anchor-' + seg.month;
+block._h = Math.round((seg.end - seg.start) * rowHeightEstimate); block.style.height = block._h + 'px';
+view.blocks.push(block); fragment.appendChild(block);
+}});
+chatBox.appendChild(fragment);
+if ('ResizeObserver' in window) view.ro = new ResizeObserver(onBlocksResize);
+if (lazyMedia) view.mo = new IntersectionObserver(onMediaIntersect, {{ root: chatBox, rootMargin: MEDIA_LOOKAHEAD_PX + 'px 0px' }});
+if ('IntersectionObserver' in window) {{ view.io = new IntersectionObserver(onBlocksIntersect, {{ root: chatBox, rootMargin: LOOKAHEAD_PX + 'px 0px' }}); view.blocks.forEach(b => view.io.observe(b)); }}
+else {{ view.blocks.forEach(materialize); }}
+restoreScroll(name);
+}}
+function findBlockIndex(pred) {{ let lo = 0, hi = view.blocks.length - 1, ans = 0; while (lo <= hi) {{ const mid = (lo + hi) >> 1; if (pred(mid)) {{ ans = mid; lo = mid + 1; }} else {{ hi = mid - 1; }} }} return ans; }}
+function blockForMessage(idx) {{ return view.blocks[findBlockIndex(i => view.segs[i].start <= idx)]; }}
+function blockAtOffset(top) {{ return view.blocks[findBlockIndex(i => view.blocks[i].offsetTop <= top)]; }}
+function jumpToBlock(block, offset, done) {{
+// offset 為 null 時捲到最底部；先捲到估計的位置，目標月份與前後月份載入後再精確定位，完成後呼叫 done
+const v = view; const blocks = [block.seg - 1, block.seg, block.seg + 1].map(i => v.blocks[i]).filter(Boolean);
+if (offset === null && v.blocks.length > 1) blocks.push(v.blocks[v.blocks.length - 2]);
+const place = () => {{ chatBox.scrollTop = offset === null ? chatBox.scrollHeight : block.offsetTop + offset; }};
+place();
+ensureMonths(v.name, adjacentMonths(v.name, v.segs[block.seg].month), () => {{ if (view !== v) return; blocks.forEach(materialize); place(); if (done) done(); }});
+}}
+function saveScrollPosition() {{
+// 以「區塊第一則訊息的索引 + 區塊內位移」記錄，不受未載入區塊的估計高度影響
+if (!view || !view.blocks.length) return;
+const top = chatBox.scrollTop; const block = blockAtOffset(top);
+localStorage.setItem('nogi_scroll_' + view.name, 'm' + view.segs[block.seg].start + ':' + Math.round(top - block.offsetTop));
+}}
+function restoreScroll(name) {{
+if (!view.blocks.length) {{ chatBox.style.opacity = '1'; return; }}
+let reposition;
+if (pendingJump && pendingJump.name === name) {{ const idx = pendingJump.idx; pendingJump = null; reposition = done => scrollToMessage(idx, done); }}
+else {{
+const saved = localStorage.getItem('nogi_scroll_' + name); const m = saved ? /^m(\\d+):(-?\\d+)$/.exec(saved) : null;
+let target = view.blocks[view.blocks.length - 1], offset = null;
+if (m) {{ target = blockForMessage(parseInt(m[1])); offset = parseInt(m[2]); }}
+else if (saved) {{ target = blockAtOffset(parseInt(saved)); offset = parseInt(saved) - target.offsetTop; }} // 舊版記錄的是 scrollTop
+reposition = done => jumpToBlock(target, offset, done);
+}}
+reposition(() => waitForImagesAndScroll(name, reposition));
+}}
+function waitForImagesAndScroll(name, reposition) {{
+// 只等待已產生的區塊內、不知道尺寸的圖片 (舊資料或讀不到檔頭)；有寬高的圖片已保留空間，可以立即顯示
+const imgs = Array.from(chatBox.querySelectorAll('img.chat-img')).filter(img => !img.hasAttribute('height')); let loadedCount = 0; const total = imgs.length;
+const reveal = () => {{ if (!view || view.name !== name) return; reposition(); chatBox.style.opacity = '1'; }};
+if (total === 0) {{ reveal(); }} else {{ const fallback = setTimeout(reveal, 1000); imgs.forEach(img => {{ if(img.complete) {{ loadedCount++; if(loadedCount === total) {{ clearTimeout(fallback); reveal(); }} }} else {{ img.onload = img.onerror = () => {{ loadedCount++; if(loadedCount === total) {{ clearTimeout(fallback); reveal(); }} }}; }} }}); }}
+}}
+function scrollToDate(year, month) {{ if (!year || !month || !view) return; const id = 'anchor-' + year + month; const el = document.getElementById(id); if (el) {{ jumpToBlock(el, 0); }} }}
+// 全文搜尋：查詢字切成 bigram，只載入需要的索引分片，交集後列出命中的訊息
+const searchMeta = window.nogkSearchMeta || null;
+const searchShards = {{}};
+const searchWaiters = {{}};
+const DOC_BASE = 1048576; // 索引中的訊息編號 = 成員序號 * 2^20 + 訊息序號
+let searchSeq = 0;
+let searchTimer = null;
+let pendingJump = null;
+function nogkSearchShard(id, postings) {{ searchShards[id] = postings; const cbs = searchWaiters[id] || []; delete searchWaiters[id]; cbs.forEach(cb => cb()); }}
+function loadSearchShard(id, cb) {{
+if (searchShards[id]) {{ cb(); return; }}
+if (searchWaiters[id]) {{ searchWaiters[id].push(cb); return; }}
+searchWaiters[id] = [cb];
+const s = document.createElement('script'); s.src = searchMeta.dir + '/s' + id + '.js?v=' + searchMeta.v;
+s.onerror = () => {{ delete searchWaiters[id]; searchResultsEl.textContent = '搜尋索引載入失敗'; }};
+document.head.appendChild(s);
+}}
+function normalizeText(s) {{ return s.normalize('NFKC').toLowerCase(); }}
+function queryTerms(q) {{ return normalizeText(q).split(/\\s+/).filter(Boolean); }}
+function queryKeys(terms) {{
+// 單一字元的詞比對所有以該字開頭的 bigram
+const keys = [];
+terms.forEach(term => {{ const chars = Array.from(term); if (chars.length === 1) {{ keys.push({{ prefix: chars[0] }}); }} else {{ for (let i = 0; i < chars.length - 1; i++) keys.push({{ key: chars[i] + chars[i + 1] }}); }} }});
+return keys;
+}}
+function shardOf(k) {{ return (k.key || k.prefix).codePointAt(0) % searchMeta.shards; }}
+function decodePostings(flat, out) {{ let i = 0; while (i < flat.length) {{ const m = flat[i++]; const n = flat[i++]; let idx = 0; for (let j = 0; j < n; j++) {{ idx += flat[i++]; out.push(m * DOC_BASE + idx); }} }} return out; }}
+function lookupKey(k) {{
+const shard = searchShards[shardOf(k)];
+if (k.key) return decodePostings(shard[k.key] || [], []);
+const docs = []; Object.keys(shard).forEach(bg => {{ if (bg.startsWith(k.prefix)) decodePostings(shard[bg], docs); }});
+return Array.from(new Set(docs));
+}}
+function intersectKeys(keys) {{
+const lists = keys.map(lookupKey).sort((a, b) => a.length - b.length);
+let result = lists[0];
+for (let i = 1; i < lists.length && result.length; i++) {{ const next = new Set(lists[i]); result = result.filter(d => next.has(d)); }}
+return result.sort((a, b) => (Math.floor(a / DOC_BASE) - Math.floor(b / DOC_BASE)) || (b - a));
+}}
+function runSearch(q) {{
+const terms = queryTerms(q); if (!terms.length) {{ searchResultsEl.style.display = 'none'; return; }}
+const keys = queryKeys(terms); const seq = ++searchSeq; const t0 = performance.now();
+const shardIds = Array.from(new Set(keys.map(shardOf))); let remaining = shardIds.length;
+shardIds.forEach(id => loadSearchShard(id, () => {{ if (--remaining === 0 && seq === searchSeq) showSearchResults(terms, intersectKeys(keys), t0, seq); }}));
+}}
+function showSearchResults(terms, docs, t0, seq) {{
+// bigram 交集可能有誤判，已載入的訊息再以原文確認；未載入的月份 (split 模式) 先載入再重新顯示
+const missing = {{}}; const hits = [];
+for (const doc of docs) {{
+const name = searchMeta.members[Math.floor(doc / DOC_BASE)]; const idx = doc % DOC_BASE; const msgs = memberData(name);
+if (!msgs || idx >= msgs.length) continue;
+const msg = msgs[idx];
+if (!msg) {{ (missing[name] = missing[name] || new Set()).add(monthOf(name, idx).ym); hits.push({{ name: name, idx: idx, msg: null }}); }}
+else {{ if (!terms.every(t => normalizeText(msg.c).includes(t))) continue; hits.push({{ name: name, idx: idx, msg: msg }}); }}
+if (hits.length >= 100) break;
+}}
+const missingNames = Object.keys(missing);
+if (missingNames.length) {{ let remaining = missingNames.length; missingNames.forEach(name => ensureMonths(name, Array.from(missing[name]), () => {{ if (--remaining === 0 && seq === searchSeq) showSearchResults(terms, docs, t0, seq); }})); }}
+const ms = Math.round(performance.now() - t0);
+searchResultsEl.innerHTML = `<div class="search-summary">${{hits.length >= 100 ? '100+' : hits.length}} 筆結果 (${{ms}} ms)</div>`;
+hits.forEach(hit => {{
+const item = document.createElement('div'); item.className = 'search-item';
+const snippet = hit.msg ? hit.msg.c.substring(0, 80) : '…';
+const head = document.createElement('div'); head.className = 'search-item-head'; head.textContent = hit.name + ' ';
+const when = document.createElement('span'); when.textContent = hit.msg ? hit.msg.d + ' ' + hit.msg.hm : ''; head.appendChild(when);
+const text = document.createElement('div'); text.className = 'search-item-text'; text.textContent = snippet;
+item.appendChild(head); item.appendChild(text);
+item.onclick = () => {{ searchResultsEl.style.display = 'none'; jumpToMessage(hit.name, hit.idx); }};
+searchResultsEl.appendChild(item);
+}});
+searchResultsEl.style.display = 'block';
+}}
+function jumpToMessage(name, idx) {{
+pendingJump = {{ name: name, idx: idx }};
+if (currentMember === name && view && view.name === name) {{ pendingJump = null; scrollToMessage(idx); }} else {{ loadMember(name); }}
+}}
+function scrollToMessage(idx, done) {{
+const block = blockForMessage(idx);
+jumpToBlock(block, 0, () => {{
+const row = Array.from(block.children).find(el => el.dataset && el.dataset.idx == idx);
+if (row) {{ chatBox.scrollTop = row.offsetTop - 60; row.classList.add('search-hit'); setTimeout(() => row.classList.remove('search-hit'), 2000); }}
+if (done) done();
+}});
+}}
+function initSearch() {{
+if (!searchMeta) return;
+searchInput.style.display = '';
+searchInput.addEventListener('input', () => {{ clearTimeout(searchTimer); searchTimer = setTimeout(() => runSearch(searchInput.value), 250); }});
+searchInput.addEventListener('keydown', e => {{ if (e.key === 'Enter') {{ clearTimeout(searchTimer); runSearch(searchInput.value); }} else if (e.key === 'Escape') {{ searchResultsEl.style.display = 'none'; }} }});
+}}
+init();
+</script>
+</body>
+</html>"""
+
+def snapshot_members(group_folder_path):
+    """ 記錄每個成員資料夾的修改時間 (新增檔案時資料夾的修改時間會跟著變)，只需要 stat 資料夾本身 """
+    snapshot = {}
+    try:
+        with os.scandir(group_folder_path) as it:
+            for e in it:
+                if e.is_dir() and e.name not in RESERVED_DIRS and not e.name.startswith('.'):
+                    snapshot[e.name] = e.stat().st_mtime_ns
+    except OSError:
+        pass
+    return snapshot
+
+def changed_members(before, after):
+    """ 比對兩次 snapshot_members，回傳新增、有變動或已刪除的成員 (依名稱排序) """
+    return sorted({m for m, mtime in after.items() if before.get(m) != mtime} | (before.keys() - after.keys()))
+
+def stale_members(group_folder_path):
+    """ 資料夾在上次寫進網頁的掃描之後又有變動的成員，用來在監看開始時補上漏掉的更新 (包含更新失敗或被取消的成員) """
+    scanned = {}
+    if os.path.exists(os.path.join(group_folder_path, CACHE_DIR_NAME, INDEX_DB_NAME)):
+        try:
+            with MessageIndex(group_folder_path) as index:
+                scanned = index.scanned_times()
+        except (OSError, sqlite3.Error):
+            pass
+    return sorted(m for m, mtime in snapshot_members(group_folder_path).items() if scanned.get(m, -1) < mtime)
+
+def has_generated_page(group_folder_path):
+    """ 產生過網頁 (有 index.html 與產生設定) 的群組才能只更新變動的成員 """
+    return os.path.exists(os.path.join(group_folder_path, "index.html")) and \
+        os.path.exists(os.path.join(group_folder_path, CACHE_DIR_NAME, SETTINGS_NAME))
+
+def _is_retryable(error):
+    # 讀寫檔案失敗、資料庫被鎖定、另一個程序正在產生等暫時性錯誤，稍後重試可能成功；其他錯誤重試也一樣會失敗
+    return isinstance(error, (OSError, sqlite3.OperationalError, GenerationBusy))
+
+def watch_groups(group_folders, interval=5.0, debounce=10.0, stop_event=None, log=print, scan_workers=None):
+    """ 監看群組資料夾，有成員新增檔案時只更新那些成員的網頁資料 (需要先產生過一次網頁)
+        每 interval 秒比對一次成員資料夾的修改時間；最後一次變動後 debounce 秒沒有新變動才更新，
+        避免備份途中一直重建。還沒產生過網頁的群組先略過，產生之後才開始更新。設定 stop_event 後結束 """
+    stop_event = stop_event or threading.Event()
+    snapshots = {g: snapshot_members(g) for g in group_folders}
+    ready = {g: has_generated_page(g) for g in group_folders}
+    pending = {g: set(stale_members(g)) if ready[g] else set() for g in group_folders}  # 監看開始前就已經有變動的成員
+    last_change = {g: 0.0 for g in group_folders}
+    for group in group_folders:
+        if not ready[group]: log(f"[略過] {group}: 尚未產生網頁，手動產生一次後才會自動更新")
+    while True:
+        now = time.monotonic()
+        for group in group_folders:
+            snapshot = snapshot_members(group)
+            changed = changed_members(snapshots[group], snapshot)
+            snapshots[group] = snapshot
+            if not ready[group]:
+                if not has_generated_page(group): continue
+                ready[group] = True
+                pending[group].update(stale_members(group))
+                log(f"[開始] {group}: 已產生網頁，開始自動更新")
+            if changed:
+                pending[group].update(changed)
+                last_change[group] = now
+            if pending[group] and now - last_change[group] >= debounce:
+                members = sorted(pending[group])
+                pending[group].clear()
+                gen = ChatGenerator(max_workers=scan_workers)
+                success, result = gen.regenerate_members(group, members, cancel_event=stop_event)
+                if success:
+                    log(f"[更新] {group}: {', '.join(members)} ({gen.last_profile.total:.2f}s)")
+                elif stop_event.is_set():
+                    return
+                elif not has_generated_page(group):
+                    ready[group] = False  # 網頁或產生設定被刪除：等重新產生後再繼續
+                    log(f"[略過] {group}: {result}")
+                elif _is_retryable(gen.last_error):
+                    # 監看途中不會再呼叫 stale_members：放回待更新清單，debounce 秒後重試
+                    pending[group].update(members)
+                    last_change[group] = time.monotonic()
+                    log(f"[失敗] {group}: {result} (稍後重試)")
+                else:
+                    log(f"[失敗] {group}: {result}")
+        if stop_event.wait(interval): return
+
+# --- colmsg 備份 (v31.6: 依成員平行執行) ---
+def _run_colmsg_once(cmd, prefix, on_line, startupinfo):
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8',
+                               errors='replace', bufsize=1, startupinfo=startupinfo)
+    for line in process.stdout:
+        if on_line: on_line(prefix, line.rstrip())
+    return process.wait()
+
+def run_colmsg_jobs(base_cmd, names=(), max_parallel=1, retries=1, on_line=None, on_done=None, startupinfo=None):
+    """ 執行 colmsg 備份：max_parallel > 1 且有指定成員時，每位成員一個 colmsg 行程，同時最多 max_parallel 個；
+        否則和以前一樣只啟動一個行程 (所有 --name 一起傳入)。結束碼非 0 的工作最多重試 retries 次
+        on_line(成員, 輸出行) 與 on_done(成員, 結果) 在工作執行緒中呼叫 (單一行程模式的成員為 "")
+        回傳 {'ok', 'elapsed', 'results': {成員: {'ok', 'returncode', 'attempts', 'elapsed'}}} """
+    names = [n for n in names if n]
+    if max_parallel > 1 and len(names) > 1:
+        jobs = {name: list(base_cmd) + ["--name", name] for name in names}
+    else:
+        jobs = {"": list(base_cmd) + [arg for name in names for arg in ("--name", name)]}
+
+    def run_job(name):
+        start = time.perf_counter()
+        attempts = 0
+        returncode = None
+        while attempts <= retries:
+            attempts += 1
+            try:
+                returncode = _run_colmsg_once(jobs[name], name, on_line, startupinfo)
+            except OSError as e:
+                if on_line: on_line(name, f"執行錯誤: {e}")
+                returncode = -1
+                break  # 找不到執行檔之類的錯誤，重試也沒用
+            if returncode == 0: break
+            if attempts <= retries and on_line: on_line(name, f"結束碼 {returncode}，重試 ({attempts}/{retries})")
+        result = {'ok': returncode == 0, 'returncode': returncode, 'attempts': attempts,
+                  'elapsed': round(time.perf_counter() - start, 1)}
+        if on_done: on_done(name, result)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(jobs)))) as pool:
+        results = dict(zip(jobs, pool.map(run_job, jobs)))
+    return {'ok': all(r['ok'] for r in results.values()), 'elapsed': round(time.perf_counter() - start, 1), 'results': results}
+
+# --- 本機伺服器 (v31.8) ---
+SERVE_PORT = 8046
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+class NogkRequestHandler(SimpleHTTPRequestHandler):
+    """ 只用標準函式庫的靜態檔案伺服器：有預先壓縮的 .gz 就直接送出，附 ETag 與快取標頭，
+        並支援 Range 請求 (影片、語音拖曳播放時不必從頭讀取) """
+    protocol_version = "HTTP/1.1"
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{
+        '.html': 'text/html; charset=utf-8', '.js': 'text/javascript; charset=utf-8', '.json': 'application/json',
+        '.mp4': 'video/mp4', '.m4a': 'audio/mp4', '.mp3': 'audio/mpeg', '.wav': 'audio/wav',
+    })
+
+    def do_GET(self):
+        self._send_file(head_only=False)
+
+    def do_HEAD(self):
+        self._send_file(head_only=True)
+
+    def log_message(self, format, *args):
+        if not getattr(self.server, 'quiet', False):
+            super().log_message(format, *args)
+
+    def _cache_control(self, path, query):
+        if 'v=' in query: return "public, max-age=31536000, immutable"  # 網址帶有內容雜湊 (data/m_xxx.js?v=...)
+        if path.endswith(('.html', '.js')): return "no-cache"  # 每次都以 ETag 確認是否有更新
+        return "public, max-age=86400"  # 備份的圖片、影片不會再變動
+
+    def _send_file(self, head_only):
+        url_path, _, query = self.path.partition('?')
+        if any(part.startswith('.') for part in unquote(url_path).split('/') if part):
+            self.send_error(404)  # 不公開 .nogk_cache 等隱藏資料夾
+            return
+        path = self.translate_path(url_path)
+        if os.path.isdir(path):
+            if not url_path.endswith('/'):
+                self.send_response(301)
+                self.send_header("Location", url_path + "/" + ("?" + query if query else ""))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if not os.path.exists(os.path.join(path, "index.html")):
+                listing = self.list_directory(path)  # 備份根目錄：列出各群組資料夾
+                if listing:
+                    try: self.copyfile(listing, self.wfile)
+                    finally: listing.close()
+                return
+            path = os.path.join(path, "index.html")
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            self.send_error(404)
+            return
+
+        ctype = self.guess_type(path)
+        cache_control = self._cache_control(path, query)
+        encoding = None
+        gz_st = None
+        try:
+            gz_st = os.stat(path + ".gz")
+        except OSError:
+            pass
+        range_header = self.headers.get("Range")
+        if gz_st is not None and gz_st.st_mtime_ns >= st.st_mtime_ns and not range_header \
+                and 'gzip' in self.headers.get("Accept-Encoding", ""):
+            path, st, encoding = path + ".gz", gz_st, "gzip"
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}{"-gz" if encoding else ""}"'
+
+        def common_headers():
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+            self.send_header("Cache-Control", cache_control)
+            if gz_st is not None: self.send_header("Vary", "Accept-Encoding")
+            if encoding: self.send_header("Content-Encoding", encoding)
+            else: self.send_header("Accept-Ranges", "bytes")
+
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            common_headers()
+            self.end_headers()
+            return
+
+        start, end = 0, st.st_size - 1
+        match = RANGE_PATTERN.match(range_header or "") if not encoding else None
+        if match and self.headers.get("If-Range", etag) == etag and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2): end = min(int(match.group(2)), st.st_size - 1)
+            else:
+                start = max(0, st.st_size - int(match.group(2)))  # bytes=-500: 最後 500 bytes
+            if start >= st.st_size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{st.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{st.st_size}")
+        else:
+            self.send_response(200)
+        length = max(0, end - start + 1)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(length))
+        common_headers()
+        self.end_headers()
+        if head_only: return
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                while length > 0:
+                    block = f.read(min(length, 1 << 18))
+                    if not block: break
+                    self.wfile.write(block)
+                    length -= len(block)
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # 瀏覽器拖曳影片時會中斷舊的請求
+
+def make_server(directory, host="127.0.0.1", port=SERVE_PORT, quiet=False):
+    """ 建立指向 directory (群組資料夾或備份根目錄) 的伺服器；port=0 時自動選擇可用的連接埠
+        呼叫 serve_forever() 開始服務，shutdown() 停止 """
+    handler = lambda *args, **kwargs: NogkRequestHandler(*args, directory=directory, **kwargs)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.quiet = quiet
+    return server
+
+# --- 命令列 / 批次執行 (v31.5) ---
+GROUP_NAMES = ("nogizaka", "sakurazaka", "hinatazaka")
+
+def find_group_folders(root_dir):
+    """ 在備份根目錄中找出 colmsg 建立的群組資料夾 """
+    return [os.path.join(root_dir, name) for name in GROUP_NAMES if os.path.isdir(os.path.join(root_dir, name))]
+
+def load_avatar_map(path):
+    """ 讀取頭像設定 JSON：{成員: 圖片路徑}，或依群組分開 {群組資料夾名稱: {成員: 圖片路徑}} """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("頭像設定檔必須是 JSON 物件")
+    return data
+
+def _avatar_map_for(avatar_map, group_folder_path):
+    if not avatar_map: return {}
+    group_name = os.path.basename(os.path.normpath(group_folder_path))
+    if any(isinstance(v, dict) for v in avatar_map.values()):
+        return avatar_map.get(group_name, {})
+    return avatar_map
+
+def run_batch(group_folders, action="generate", workers=1, scan_workers=None, nickname="", avatar_map=None, **options):
+    """ 對多個群組資料夾同時執行 generate_single_index (action="generate") 或 update_html_avatars (action="avatars")
+        options 直接傳給 generate_single_index (force_rebuild、layout、thumbnails、search…)
+        回傳可直接輸出成 JSON 的摘要 """
+    def run_one(group_folder_path):
+        gen = ChatGenerator(max_workers=scan_workers)
+        group_avatars = _avatar_map_for(avatar_map, group_folder_path)
+        start = time.perf_counter()
+        try:
+            if action == "avatars":
+                success, result = gen.update_html_avatars(group_folder_path, group_avatars)
+            else:
+                success, result = gen.generate_single_index(group_folder_path, nickname, group_avatars, **options)
+        except Exception as e:
+            success, result = False, str(e)
+        summary = {'group': group_folder_path, 'ok': success, 'result': result,
+                   'elapsed': round(time.perf_counter() - start, 3), 'stats': gen.last_stats}
+        if gen.last_profile is not None and (options.get('profile') or options.get('cprofile')):
+            summary['profile'] = gen.last_profile.to_dict(members=False)
+        return summary
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(run_one, group_folders))
+    return {'ok': bool(results) and all(r['ok'] for r in results), 'action': action,
+            'elapsed': round(time.perf_counter() - start, 3), 'groups': results}
+
+def query_index(group_folder_path, member=None, month=None, counts=False, as_json=False):
+    """ 命令列 query：直接讀訊息索引，不掃描資料夾 """
+    if not os.path.exists(os.path.join(group_folder_path, CACHE_DIR_NAME, INDEX_DB_NAME)):
+        print("找不到訊息索引，請先產生一次網頁")
+        return 1
+    try:
+        with MessageIndex(group_folder_path) as index:
+            if counts: result = index.month_counts(member)
+            elif member: result = index.messages(member, month)
+            else: result = dict(index.members())
+    except sqlite3.Error as e:
+        print(f"無法讀取訊息索引: {e}")
+        return 1
+    except ValueError as e:
+        print(e)
+        return 1
+    if as_json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif isinstance(result, dict):
+        for key, n in result.items(): print(f"{key}\t{n}")
+    else:
+        for m in result:
+            ts = m['ts']
+            text = m['c'].replace("\n", " ")[:60] if m['t'] == '.txt' else m['f']
+            print(f"{ts[:4]}/{ts[4:6]}/{ts[6:8]} {ts[8:10]}:{ts[10:12]}  {text}")
+    return 0
+
+def dedup_groups(group_folders, link=False, as_json=False):
+    """ 命令列 dedup：逐一群組找出重複媒體；網頁有使用 --dedup 時一併更新 data/media_alias.js """
+    gen = ChatGenerator()
+    results = {}
+    for group in group_folders:
+        settings = gen.load_generation_settings(group) or {}
+        results[group] = gen.dedup_media(group, link=link, write_alias=bool(settings.get('dedup')))
+    if as_json:
+        print(json.dumps({g: {'ok': ok, 'result': r} for g, (ok, r) in results.items()}, ensure_ascii=False, indent=2))
+    else:
+        for group, (ok, r) in results.items():
+            if not ok:
+                print(f"[NG] {group} {r}")
+                continue
+            line = (f"[OK] {group} 重複 {r['groups']} 組、{r['duplicates']} 個檔案，"
+                    f"多占 {r['duplicate_bytes'] / (1024 * 1024):.1f} MB (已是硬連結 {r['already_linked']} 個；本次計算雜湊 {r['hashed']} 個)")
+            if link: line += f"，建立硬連結 {r['linked']} 個" + (f"、失敗 {r['failed']} 個" if r['failed'] else "")
+            print(line)
+            for err in r['errors'][:5]: print(f"    建立硬連結失敗 {err}")
+            if len(r['errors']) > 5: print(f"    …另外還有 {len(r['errors']) - 5} 個")
+    return 0 if all(ok for ok, _ in results.values()) else 1
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="nogk_core", description="NogkSaver 網頁產生工具 (無介面版)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    for name, help_text in (("generate", "產生 index.html"), ("avatars", "只更新現有 index.html 的頭像")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("groups", nargs="*", help="群組資料夾 (例如 .../nogizaka)")
+        p.add_argument("--root", help="備份根目錄，自動尋找 " + " / ".join(GROUP_NAMES))
+        p.add_argument("--workers", type=int, default=1, help="同時處理的群組數 (預設 1)")
+        p.add_argument("--avatar-map", help="頭像設定 JSON 檔")
+        p.add_argument("--json", action="store_true", help="以 JSON 輸出執行摘要")
+        if name == "generate":
+            p.add_argument("--scan-workers", type=int, default=None, help="每個群組同時掃描的成員數")
+            p.add_argument("--nickname", default="", help="替換訊息中的 %%%%%%")
+            p.add_argument("--layout", choices=("inline", "split"), default="inline")
+            p.add_argument("--thumbnails", action="store_true", help="產生圖片縮圖 (需要 Pillow)")
+            p.add_argument("--search", action="store_true", help="建立全文搜尋索引")
+            p.add_argument("--force", action="store_true", help="忽略快取，完整重建")
+            p.add_argument("--precompress", action="store_true", help="另外產生 .gz 壓縮檔 (供 serve 使用)")
+            p.add_argument("--quick-scan", action="store_true", help="資料夾沒有變動的成員不逐一檢查檔案 (網路磁碟較快)")
+            p.add_argument("--dedup", action="store_true", help="內容相同的媒體在網頁中只載入一份")
+            p.add_argument("--media-lookahead", type=int, default=MEDIA_LOOKAHEAD, help=f"媒體距離畫面多少 px 內才載入 (預設 {MEDIA_LOOKAHEAD})")
+            p.add_argument("--profile", action="store_true", help="輸出各階段耗時，並寫入 .nogk_cache/profile.json")
+            p.add_argument("--cprofile", action="store_true", help="以 cProfile 執行，統計存成 .nogk_cache/profile.pstats")
+    p = sub.add_parser("watch", help="監看資料夾，有新訊息時只更新變動的成員 (需先產生過一次網頁)")
+    p.add_argument("groups", nargs="*", help="群組資料夾 (例如 .../nogizaka)")
+    p.add_argument("--root", help="備份根目錄，自動尋找 " + " / ".join(GROUP_NAMES))
+    p.add_argument("--interval", type=float, default=5.0, help="檢查間隔秒數 (預設 5)")
+    p.add_argument("--debounce", type=float, default=10.0, help="最後一次變動後等待幾秒才更新 (預設 10)")
+    p.add_argument("--scan-workers", type=int, default=None, help="每個群組同時掃描的成員數")
+    p = sub.add_parser("dedup", help="找出內容相同的媒體檔並統計重複的大小 (需先產生過一次網頁)")
+    p.add_argument("groups", nargs="*", help="群組資料夾 (例如 .../nogizaka)")
+    p.add_argument("--root", help="備份根目錄，自動尋找 " + " / ".join(GROUP_NAMES))
+    p.add_argument("--link", action="store_true", help="把重複的檔案換成硬連結 (同一個磁碟內)，節省空間")
+    p.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    p = sub.add_parser("serve", help="以本機 HTTP 伺服器瀏覽網頁 (支援 gzip、快取與影片拖曳)")
+    p.add_argument("directory", help="群組資料夾或備份根目錄")
+    p.add_argument("--host", default="127.0.0.1", help="預設只允許本機連線")
+    p.add_argument("--port", type=int, default=SERVE_PORT, help=f"連接埠 (預設 {SERVE_PORT})")
+    p.add_argument("--open", action="store_true", help="啟動後開啟瀏覽器")
+    p = sub.add_parser("query", help="查詢訊息索引 (需先產生過一次網頁)")
+    p.add_argument("group", help="群組資料夾 (例如 .../nogizaka)")
+    p.add_argument("--member", help="成員；未指定時列出所有成員與訊息數")
+    p.add_argument("--month", help="月份 YYYY-MM")
+    p.add_argument("--counts", action="store_true", help="列出每月訊息數")
+    p.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    args = parser.parse_args(argv)
+
+    if args.action == "query":
+        return query_index(args.group, args.member, args.month, args.counts, args.json)
+
+    if args.action == "serve":
+        server = make_server(args.directory, args.host, args.port)
+        url = f"http://{args.host}:{server.server_address[1]}/"
+        print(f"瀏覽 {url} (Ctrl+C 結束)", flush=True)
+        if args.open:
+            import webbrowser
+            webbrowser.open(url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    groups = list(args.groups)
+    if args.root: groups.extend(find_group_folders(args.root))
+    if not groups: parser.error("請指定群組資料夾或 --root")
+    if args.action == "dedup":
+        return dedup_groups(groups, args.link, args.json)
+    if args.action == "watch":
+        def log(msg): print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}", flush=True)
+        log(f"開始監看 {', '.join(groups)} (Ctrl+C 結束)")
+        try:
+            watch_groups(groups, args.interval, args.debounce, log=log, scan_workers=args.scan_workers)
+        except KeyboardInterrupt:
+            log("結束監看")
+        return 0
+    avatar_map = load_avatar_map(args.avatar_map) if args.avatar_map else None
+    if args.action == "avatars" and avatar_map is None: parser.error("avatars 需要 --avatar-map")
+
+    options = {}
+    if args.action == "generate":
+        options = {'scan_workers': args.scan_workers, 'nickname': args.nickname, 'layout': args.layout,
+                   'thumbnails': args.thumbnails, 'search': args.search, 'force_rebuild': args.force,
+                   'precompress': args.precompress, 'media_lookahead': args.media_lookahead, 'dedup': args.dedup,
+                   'quick_scan': args.quick_scan, 'profile': args.profile, 'cprofile': args.cprofile}
+    summary = run_batch(groups, args.action, workers=args.workers, avatar_map=avatar_map, **options)
+
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        for r in summary['groups']:
+            print(f"[{'OK' if r['ok'] else 'NG'}] {r['group']} ({r['elapsed']}s) {r['result']}")
+            for warning in r['stats'].get('warnings', ()): print(f"    {warning}")
+            if r.get('profile', {}).get('phases'):
+                phases = sorted(r['profile']['phases'].items(), key=lambda kv: kv[1], reverse=True)
+                print("    " + " / ".join(f"{PHASE_LABELS.get(k, k)} {v:.3f}s" for k, v in phases))
+        print(f"總耗時 {summary['elapsed']}s")
+    return 0 if summary['ok'] else 1
+
+if __name__ == "__main__":
+    import sys
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())